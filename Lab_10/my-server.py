@@ -4,12 +4,32 @@ Flask server for JWT token generation and verification
 Lab 10: JWT
 """
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
+from collections import OrderedDict
 import jwt
 import datetime
+import hashlib
+import hmac
+import json
+import math
+import os
+import sys
+import threading
+import time
 import uuid
 import logging
 
+try:
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import ec, ed25519
+except ImportError:  # only needed for EdDSA/ES256
+    serialization = ec = ed25519 = None
+
+# State backends and the rate limiter are shared with the Lab 09 server
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'shared'))
+from state_backends import (InMemoryBackend, SQLiteBackend, RedisBackend, create_backend,
+                            RateLimiter)
+
 app = Flask(__name__)
 
 # Configure logging
@@ -19,8 +39,550 @@ logger = logging.getLogger(__name__)
 # Secret key for JWT signing (in production, use environment variable)
 SECRET_KEY = "secret"
 
-# In-memory storage for revoked tokens (blacklist)
-revoked_tokens = set()
+# Signing keys: SECRET_KEY signs as kid SECRET_KEY_ID. With a rotation
+# interval (seconds), a key derived from SECRET_KEY takes over each interval
+# instead; every worker derives the same keys, so rotation needs no
+# coordination. 0 disables rotation.
+SECRET_KEY_ID = "primary"
+KEY_ROTATION_INTERVAL = int(os.environ.get('KEY_ROTATION_INTERVAL', 0))
+
+# Rotated-out keys still verify tokens for this many intervals
+KEY_RETAINED_INTERVALS = 7
+
+# Algorithm for new tokens: HS256 (shared secret), EdDSA (Ed25519) or ES256
+# (P-256). The asymmetric ones sign with the PEM private key in
+# JWT_PRIVATE_KEY_FILE under kid JWT_KEY_ID; without a file, a fresh key is
+# generated that only this process knows.
+JWT_ALGORITHM = os.environ.get('JWT_ALGORITHM', 'HS256')
+JWT_PRIVATE_KEY_FILE = os.environ.get('JWT_PRIVATE_KEY_FILE')
+JWT_KEY_ID = os.environ.get('JWT_KEY_ID', 'signing')
+
+# Extra public keys to verify with, as "kid=path.pem,kid=path.pem"
+JWT_PUBLIC_KEYS = os.environ.get('JWT_PUBLIC_KEYS', '')
+
+# "issuer" serves every endpoint. "verify" holds only the public keys in
+# JWT_PUBLIC_KEYS, never SECRET_KEY, and serves just the endpoints that
+# check tokens
+SERVICE_MODE = os.environ.get('SERVICE_MODE', 'issuer')
+ISSUER_ENDPOINTS = {'generate_token', 'generate_token_batch', 'revoke_token'}
+
+# Most tokens one /generate-token/batch request may issue, and one
+# /verify-token/batch request may check
+GENERATE_BATCH_MAX = 100000
+VERIFY_BATCH_MAX = 10000
+
+# Rate limits for /login, /verify-token and /verify-token/batch: token
+# buckets refilled at RATE_LIMIT_RATE per second, up to RATE_LIMIT_BURST, one
+# per client address and one per claimed user ID. A batch counts as one
+# request, and as one for each distinct user it claims, so a gateway can
+# verify in bulk at RATE_LIMIT_RATE batches a second. The buckets live in a
+# memory-mapped file: RATE_LIMIT_FILE (e.g. under /dev/shm) shares them between all
+# processes that open it; unset, an unnamed file is shared with workers
+# forked after the app is loaded (gunicorn --preload). A rate of 0 turns
+# limiting off.
+RATE_LIMIT_RATE = float(os.environ.get('RATE_LIMIT_RATE', 10))
+RATE_LIMIT_BURST = int(os.environ.get('RATE_LIMIT_BURST', 20))
+RATE_LIMIT_FILE = os.environ.get('RATE_LIMIT_FILE')
+RATE_LIMITED_ENDPOINTS = {'verify_token', 'verify_token_batch', 'login'}
+
+# Where revocations live: "memory" (this process only), "sqlite:///path.db"
+# (every worker on the host) or "redis://host:port/db" (every host)
+STATE_BACKEND = os.environ.get('STATE_BACKEND', 'memory')
+
+# Bloom filter in front of the revocation store: live revoked tokens it is
+# sized for, and the false-positive rate at that size
+REVOCATION_FILTER_CAPACITY = 100000
+REVOCATION_FILTER_FP_RATE = 0.01
+
+
+class CountingBloomFilter:
+    """
+    Counting Bloom filter over strings, with one byte-sized counter per slot.
+    
+    might_contain() never misses an added item, and it is wrong the other
+    way only at about the configured false-positive rate. Removing an item
+    decrements its counters; counters that reach 255 stick there for good.
+    Counter updates take a lock, since the backend purges (and so removes)
+    from whichever thread touches it; might_contain() reads without one.
+    """
+    
+    def __init__(self, capacity=REVOCATION_FILTER_CAPACITY, fp_rate=REVOCATION_FILTER_FP_RATE,
+                 size=None, hashes=None, key=None):
+        self.size = size or max(8, int(-capacity * math.log(fp_rate) / math.log(2) ** 2))
+        self.hashes = hashes or max(1, round(self.size / capacity * math.log(2)))
+        # Keyed hashing stops clients from choosing jtis that collide
+        self.key = key or os.urandom(16)
+        self.counters = bytearray(self.size)
+        self._lock = threading.Lock()
+    
+    def _slots(self, item):
+        digest = hashlib.blake2b(item.encode(), digest_size=16, key=self.key).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+    
+    def add(self, item):
+        slots = self._slots(item)
+        with self._lock:
+            counters = self.counters
+            for slot in slots:
+                if counters[slot] < 255:
+                    counters[slot] += 1
+    
+    def remove(self, item):
+        """Remove an item that was added earlier."""
+        slots = self._slots(item)
+        with self._lock:
+            counters = self.counters
+            for slot in slots:
+                if 0 < counters[slot] < 255:
+                    counters[slot] -= 1
+    
+    def might_contain(self, item):
+        counters = self.counters
+        return all(counters[slot] for slot in self._slots(item))
+    
+    def clear(self):
+        with self._lock:
+            self.counters = bytearray(self.size)
+
+
+class RevocationStore:
+    """
+    Revoked JWT IDs, each kept only until its token's exp.
+    
+    An expired token is rejected by jwt.decode anyway, so its jti is stored
+    with a TTL and forgotten then. Where the jtis live is up to the backend:
+    in this process, or in SQLite/Redis where every worker sees them.
+    
+    With a process-local backend, a counting Bloom filter mirrors the stored
+    jtis. Most tokens checked are not revoked, and for those the filter
+    answers without touching the store. A shared backend gets no filter,
+    since other workers' revocations would never reach it.
+    """
+    
+    def __init__(self, backend=None, bloom=None):
+        self.backend = backend if backend is not None else InMemoryBackend()
+        self.bloom = None
+        if not self.backend.shared:
+            self.bloom = bloom or CountingBloomFilter()
+            self.backend.on_expire = self.bloom.remove
+    
+    def add(self, jti, exp=None):
+        """Revoke jti until exp (a Unix timestamp); forever if exp is None."""
+        ttl = None if exp is None else exp - time.time()
+        if ttl is not None and ttl <= 0:
+            return
+        if self.bloom is None:
+            self.backend.set(jti, '' if exp is None else repr(exp), ttl)
+            return
+        # Filter first: once the backend holds jti, a check must not miss it
+        self.bloom.add(jti)
+        if not self.backend.set(jti, '' if exp is None else repr(exp), ttl):
+            self.bloom.remove(jti)  # already counted when it was first stored
+    
+    def __contains__(self, jti):
+        # Fast path: a filter miss means jti was never revoked (or was purged)
+        if self.bloom is not None and not self.bloom.might_contain(jti):
+            return False
+        return self.backend.get(jti) is not None
+    
+    def revoked(self, jtis):
+        """Set of the given jtis that are revoked, in one backend lookup."""
+        jtis = list(jtis)
+        if self.bloom is not None:
+            jtis = [jti for jti in jtis if self.bloom.might_contain(jti)]
+        return {jti for jti, value in zip(jtis, self.backend.get_many(jtis))
+                if value is not None}
+    
+    def __len__(self):
+        return self.backend.count()
+    
+    def clear(self):
+        self.backend.clear()
+        if self.bloom is not None:
+            self.bloom.clear()
+    
+    def stats(self):
+        """Size and purge counters."""
+        stats = self.backend.stats()
+        if self.bloom is not None:
+            stats["filter_bytes"] = self.bloom.size
+        return stats
+
+
+# Storage for revoked tokens (blacklist); STATE_BACKEND picks where it lives
+revoked_tokens = RevocationStore(create_backend(STATE_BACKEND, 'revoked_jti'))
+
+class PreparedHMACAlgorithm(jwt.algorithms.HMACAlgorithm):
+    """
+    HMAC algorithm that also takes a keyed hmac object as its key.
+    
+    Signing copies the object instead of building a new HMAC from the raw
+    secret, so the key checks and padding are done once per key rather than
+    once per token. Plain str/bytes keys work as before.
+    """
+    
+    def prepare_key(self, key):
+        if isinstance(key, hmac.HMAC):
+            return key
+        return super().prepare_key(key)
+    
+    def sign(self, msg, key):
+        if isinstance(key, hmac.HMAC):
+            mac = key.copy()
+            mac.update(msg)
+            return mac.digest()
+        return super().sign(msg, key)
+
+
+jwt.unregister_algorithm("HS256")
+jwt.register_algorithm("HS256", PreparedHMACAlgorithm(hashlib.sha256))
+
+
+def key_algorithm(key):
+    """JWT algorithm for an Ed25519 or P-256 key object (private or public)."""
+    if ed25519 is not None:
+        if isinstance(key, (ed25519.Ed25519PrivateKey, ed25519.Ed25519PublicKey)):
+            return "EdDSA"
+        if (isinstance(key, (ec.EllipticCurvePrivateKey, ec.EllipticCurvePublicKey))
+                and isinstance(key.curve, ec.SECP256R1)):
+            return "ES256"
+    raise ValueError(f"unsupported key type: {type(key).__name__}")
+
+
+def generate_private_key(algorithm):
+    """New private key for EdDSA (Ed25519) or ES256 (P-256)."""
+    if ed25519 is None:
+        raise RuntimeError("EdDSA and ES256 need the 'cryptography' package")
+    if algorithm == "EdDSA":
+        return ed25519.Ed25519PrivateKey.generate()
+    if algorithm == "ES256":
+        return ec.generate_private_key(ec.SECP256R1())
+    raise ValueError(f"unsupported algorithm: {algorithm}")
+
+
+def load_pem_key(path, private):
+    """Load a PEM private or public key from path."""
+    if ed25519 is None:
+        raise RuntimeError("EdDSA and ES256 need the 'cryptography' package")
+    with open(path, 'rb') as f:
+        data = f.read()
+    if private:
+        return serialization.load_pem_private_key(data, password=None)
+    return serialization.load_pem_public_key(data)
+
+
+class KeyRing:
+    """
+    JWT keys by kid.
+    
+    Tokens carry the kid of the key that signed them in their header, so
+    verification finds its key with one dict lookup instead of trying keys
+    in turn. Each kid is bound to one algorithm, so a token cannot choose
+    another in its header. Keys are kept ready to use: HS256 secrets as
+    keyed hmac objects, and Ed25519/P-256 keys as loaded key objects.
+    
+    With a rotation interval, the HS256 key for interval n is derived from
+    the master secret, so all workers sign with the same key at the same
+    time. The previous retained_intervals keys (and the next one, for clock
+    skew) stay available for verification. The master secret itself keeps
+    verifying as kid, and is used for tokens without a kid.
+    
+    Adding an Ed25519 or P-256 private key makes it the signing key. A
+    verify-only node is built with secret=None and given public keys only.
+    """
+    
+    def __init__(self, secret=SECRET_KEY, kid=SECRET_KEY_ID,
+                 rotation_interval=KEY_ROTATION_INTERVAL,
+                 retained_intervals=KEY_RETAINED_INTERVALS):
+        self._master = secret.encode() if isinstance(secret, str) else secret
+        self.static_kid = kid
+        self.rotation_interval = rotation_interval if secret is not None else 0
+        self.retained_intervals = retained_intervals
+        # {kid: (algorithm, signing key or None, verification key)};
+        # replaced, never mutated, so lookups need no lock
+        self._keys = {}
+        self._rotated = set()  # kids of derived HS256 keys
+        self._lock = threading.Lock()
+        self._interval = None
+        self._pinned = False  # an added private key signs, not the HS256 keys
+        self.current_kid = None
+        if secret is not None:
+            self._keys = {kid: self._hmac_entry(self._master)}
+            self.current_kid = kid
+    
+    @staticmethod
+    def _hmac_entry(secret):
+        mac = hmac.new(secret, digestmod=hashlib.sha256)
+        return ("HS256", mac, mac)
+    
+    def _derive(self, interval):
+        return hmac.new(self._master, f"jwt-signing-key:{interval}".encode(),
+                        hashlib.sha256).digest()
+    
+    def _rotate(self, now):
+        """Move to the key for the current interval, if not there already."""
+        interval = int(now // self.rotation_interval)
+        if interval == self._interval:
+            return
+        with self._lock:
+            if interval == self._interval:
+                return
+            keys = {kid: entry for kid, entry in self._keys.items() if kid not in self._rotated}
+            rotated = set()
+            for n in range(interval - self.retained_intervals, interval + 2):
+                kid = f"r{n}"
+                keys[kid] = self._keys.get(kid) or self._hmac_entry(self._derive(n))
+                rotated.add(kid)
+            self._keys = keys
+            self._rotated = rotated
+            if not self._pinned:
+                self.current_kid = f"r{interval}"
+            self._interval = interval
+    
+    def add_key(self, kid, key):
+        """Add an Ed25519 or P-256 key; a private key also becomes the signing key."""
+        algorithm = key_algorithm(key)
+        private = hasattr(key, 'public_key')
+        entry = (algorithm, key, key.public_key()) if private else (algorithm, None, key)
+        with self._lock:
+            self._keys = {**self._keys, kid: entry}
+            if private:
+                self.current_kid = kid
+                self._pinned = True
+    
+    def signing_key(self):
+        """(kid, algorithm, key) to sign new tokens with."""
+        if self.rotation_interval:
+            self._rotate(time.time())
+        kid = self.current_kid
+        if kid is None:
+            raise RuntimeError("No signing key: this node only verifies tokens")
+        algorithm, key, _ = self._keys[kid]
+        return kid, algorithm, key
+    
+    def verification_key(self, kid):
+        """(algorithm, key) for a token's kid (None for tokens without one), or None."""
+        if kid is not None and not isinstance(kid, str):
+            return None
+        if self.rotation_interval:
+            self._rotate(time.time())
+        entry = self._keys.get(self.static_kid if kid is None else kid)
+        return None if entry is None else (entry[0], entry[2])
+    
+    def kids(self):
+        return list(self._keys)
+
+
+def build_key_ring():
+    """Key ring for this node, from SERVICE_MODE and the JWT_* settings."""
+    if SERVICE_MODE == "verify":
+        ring = KeyRing(secret=None)
+    else:
+        ring = KeyRing()
+        if JWT_ALGORITHM != "HS256":
+            if JWT_PRIVATE_KEY_FILE:
+                private_key = load_pem_key(JWT_PRIVATE_KEY_FILE, private=True)
+            else:
+                logger.warning("No JWT_PRIVATE_KEY_FILE: generated a key only this process knows")
+                private_key = generate_private_key(JWT_ALGORITHM)
+            if key_algorithm(private_key) != JWT_ALGORITHM:
+                raise ValueError(f"JWT_PRIVATE_KEY_FILE does not hold a {JWT_ALGORITHM} key")
+            ring.add_key(JWT_KEY_ID, private_key)
+    for item in filter(None, JWT_PUBLIC_KEYS.split(',')):
+        kid, _, path = item.partition('=')
+        ring.add_key(kid.strip(), load_pem_key(path.strip(), private=False))
+    return ring
+
+
+key_ring = build_key_ring()
+
+
+def sign_token(payload):
+    """Encode payload as a JWT signed with the key ring's current key."""
+    kid, algorithm, key = key_ring.signing_key()
+    return jwt.encode(payload, key, algorithm=algorithm, headers={"kid": kid})
+
+
+def batch_signer():
+    """
+    Return sign(payload) for issuing many tokens with the current key.
+    The key, the algorithm object and the encoded header are looked up once
+    per batch instead of once per token, as jwt.encode would.
+    """
+    kid, algorithm, key = key_ring.signing_key()
+    alg = jwt.get_algorithm_by_name(algorithm)
+    key = alg.prepare_key(key)
+    header = jwt.utils.base64url_encode(json.dumps(
+        {"alg": algorithm, "kid": kid, "typ": "JWT"},
+        separators=(",", ":"), sort_keys=True).encode())
+    
+    def sign(payload):
+        signing_input = header + b"." + jwt.utils.base64url_encode(
+            json.dumps(payload, separators=(",", ":")).encode())
+        signature = jwt.utils.base64url_encode(alg.sign(signing_input, key))
+        return (signing_input + b"." + signature).decode()
+    
+    return sign
+
+
+def bulk_jtis(count, chunk=1024):
+    """
+    Yield count random (version 4) UUID strings. Randomness is read from
+    os.urandom a chunk of UUIDs at a time, not once per UUID like uuid4().
+    """
+    while count > 0:
+        n = min(chunk, count)
+        data = os.urandom(16 * n)
+        for i in range(0, 16 * n, 16):
+            yield str(uuid.UUID(bytes=data[i:i + 16], version=4))
+        count -= n
+
+
+def issued_tokens(items, sign, now, chunk=256):
+    """
+    Sign a token for each (user_id, expires_in) and yield the results as
+    pieces of one JSON array, chunk tokens at a time. Every token gets the
+    same iat, now.
+    """
+    yield "["
+    parts = []
+    separator = ""
+    for (user_id, expires_in), jti in zip(items, bulk_jtis(len(items))):
+        token = sign({"jti": jti, "user_id": user_id, "exp": now + expires_in, "iat": now})
+        parts.append(json.dumps({"user_id": user_id, "token": token, "expires_in": expires_in}))
+        if len(parts) == chunk:
+            yield separator + ",".join(parts)
+            parts = []
+            separator = ","
+    if parts:
+        yield separator + ",".join(parts)
+    yield "]"
+
+
+# Verified-token cache: maximum entries, and the longest (seconds) an entry
+# is trusted even if the token itself expires later
+TOKEN_CACHE_SIZE = 10000
+TOKEN_CACHE_TTL = 300
+
+
+class VerifiedTokenCache:
+    """
+    Bounded LRU cache of decoded claims for tokens that passed jwt.decode.
+
+    Entries are keyed by the token's signature and store the whole token,
+    so a cached signature pasted onto a different header or payload is a
+    miss. An entry is dropped once the token's exp passes (or after
+    TOKEN_CACHE_TTL), and revoke_token() removes it straight away.
+    """
+    
+    def __init__(self, max_size=TOKEN_CACHE_SIZE, ttl=TOKEN_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()  # {signature: (token, claims, expires_at)}
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def _signature(token):
+        return token.rpartition('.')[2]
+    
+    def get(self, token):
+        """Return the cached claims for token, or None."""
+        signature = self._signature(token)
+        with self._lock:
+            entry = self._entries.get(signature)
+            if entry is None:
+                return None
+            cached_token, claims, expires_at = entry
+            if not hmac.compare_digest(cached_token, token):
+                return None
+            if time.time() >= expires_at:
+                del self._entries[signature]
+                return None
+            self._entries.move_to_end(signature)
+            return claims
+    
+    def put(self, token, claims):
+        """Cache claims that jwt.decode just accepted for token."""
+        expires_at = time.time() + self.ttl
+        if 'exp' in claims:
+            expires_at = min(expires_at, claims['exp'])
+        with self._lock:
+            self._entries[self._signature(token)] = (token, claims, expires_at)
+            self._entries.move_to_end(self._signature(token))
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+    
+    def invalidate(self, token):
+        with self._lock:
+            self._entries.pop(self._signature(token), None)
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+token_cache = VerifiedTokenCache()
+
+
+def decode_token(token):
+    """
+    Decode and verify a JWT, reusing cached claims for tokens seen before.
+    Raises the same jwt exceptions as jwt.decode.
+    """
+    if not isinstance(token, str):
+        raise jwt.InvalidTokenError("Token must be a string")
+    claims = token_cache.get(token)
+    if claims is None:
+        entry = key_ring.verification_key(jwt.get_unverified_header(token).get('kid'))
+        if entry is None:
+            raise jwt.InvalidTokenError("Unknown signing key")
+        algorithm, key = entry
+        claims = jwt.decode(token, key, algorithms=[algorithm])
+        token_cache.put(token, claims)
+    return claims
+
+
+rate_limiter = RateLimiter(RATE_LIMIT_FILE)
+
+
+@app.before_request
+def limit_auth_attempts():
+    """Turn away clients (by address, then by claimed user ID) that have used up
+    their bucket, before the token is parsed or checked."""
+    if request.endpoint not in RATE_LIMITED_ENDPOINTS or RATE_LIMIT_RATE <= 0:
+        return None
+    data = request.get_json(silent=True) if request.is_json else request.form
+    if not isinstance(data, dict):
+        data = {}
+    if request.endpoint == 'verify_token_batch':
+        items = data.get('tokens') if isinstance(data.get('tokens'), list) else []
+        claimed = [item.get('user_id') for item in items if isinstance(item, dict)]
+    else:
+        claimed = [data.get('user_id')]
+    keys = [f"addr:{request.remote_addr}"]
+    for user_id in claimed:
+        key = f"user:{user_id}"
+        if user_id is not None and key not in keys:
+            keys.append(key)
+    for key in keys:
+        wait = rate_limiter.acquire(key, RATE_LIMIT_RATE, RATE_LIMIT_BURST)
+        if wait:
+            logger.warning(f"Rate limited {key}")
+            return jsonify({
+                "error": "Too many requests"
+            }), 429, {"Retry-After": str(math.ceil(wait))}
+    return None
+
+
+@app.before_request
+def enforce_service_mode():
+    """Verify-only nodes hold no signing key, so refuse issuer endpoints."""
+    if SERVICE_MODE == "verify" and request.endpoint in ISSUER_ENDPOINTS:
+        return jsonify({
+            "error": "This node only verifies tokens"
+        }), 403
 
 
 @app.route('/')
@@ -30,9 +592,12 @@ def home():
         "message": "JWT Token Service",
         "endpoints": {
             "/generate-token": "POST - Generate a new JWT token for a user ID",
+            "/generate-token/batch": "POST - Generate JWT tokens for a list of user IDs",
             "/verify-token": "POST - Verify an existing JWT token",
+            "/verify-token/batch": "POST - Verify a list of JWT tokens",
             "/login": "POST - Login with user ID and JWT token",
-            "/revoke-token": "POST - Revoke a JWT token (logout)"
+            "/revoke-token": "POST - Revoke a JWT token (logout)",
+            "/revocation-stats": "GET - Revocation store size and purge rate"
         }
     })
 
@@ -58,15 +623,16 @@ def generate_token():
         expires_in = data.get('expires_in', 3600)
         
         # Create JWT payload
+        now = datetime.datetime.utcnow()
         payload = {
             "jti": str(uuid.uuid4()),  # JWT ID (unique identifier)
             "user_id": user_id,
-            "exp": datetime.datetime.utcnow() + datetime.timedelta(seconds=expires_in),
-            "iat": datetime.datetime.utcnow()  # Issued at
+            "exp": now + datetime.timedelta(seconds=expires_in),
+            "iat": now  # Issued at
         }
         
         # Generate JWT token
-        token = jwt.encode(payload, SECRET_KEY, algorithm="HS256")
+        token = sign_token(payload)
         
         logger.info(f"Generated JWT for user: {user_id}")
         
@@ -83,6 +649,64 @@ def generate_token():
         }), 500
 
 
+@app.route('/generate-token/batch', methods=['POST'])
+def generate_token_batch():
+    """
+    Generate JWT tokens for many user IDs in one request
+    Expected JSON: {"users": [123, {"user_id": 456, "expires_in": 60}], "expires_in": 3600}
+    Returns: JSON array of {"user_id": 123, "token": "eyJ...", "expires_in": 3600},
+             streamed in input order
+    """
+    try:
+        data = request.get_json(silent=True)
+        
+        if not data or not isinstance(data.get('users'), list):
+            return jsonify({
+                "error": "Missing 'users' list in request"
+            }), 400
+        
+        users = data['users']
+        if not users:
+            return jsonify({
+                "error": "No users provided"
+            }), 400
+        
+        if len(users) > GENERATE_BATCH_MAX:
+            return jsonify({
+                "error": f"Batch exceeds {GENERATE_BATCH_MAX} users"
+            }), 413
+        
+        # Default expiration: 1 hour, unless the batch or the item says otherwise
+        default_expires_in = data.get('expires_in', 3600)
+        items = []
+        for index, user in enumerate(users):
+            if isinstance(user, dict):
+                if 'user_id' not in user:
+                    return jsonify({
+                        "error": f"Item {index}: missing 'user_id'"
+                    }), 400
+                user_id, expires_in = user['user_id'], user.get('expires_in', default_expires_in)
+            else:
+                user_id, expires_in = user, default_expires_in
+            if not isinstance(expires_in, int) or isinstance(expires_in, bool):
+                return jsonify({
+                    "error": f"Item {index}: 'expires_in' must be an integer"
+                }), 400
+            items.append((user_id, expires_in))
+        
+        sign = batch_signer()
+        logger.info(f"Generating {len(items)} JWTs in a batch")
+        
+        return Response(issued_tokens(items, sign, int(time.time())),
+                        status=201, mimetype='application/json')
+        
+    except Exception as e:
+        logger.error(f"Error generating token batch: {str(e)}")
+        return jsonify({
+            "error": "Internal server error"
+        }), 500
+
+
 @app.route('/verify-token', methods=['POST'])
 def verify_token():
     """
@@ -103,7 +727,7 @@ def verify_token():
         
         try:
             # Decode and verify JWT token
-            decoded = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
+            decoded = decode_token(token)
             
             # Check if token is revoked
             jti = decoded.get('jti')
@@ -152,6 +776,91 @@ def verify_token():
         }), 500
 
 
+def verify_batch(items):
+    """
+    Verification results for (token, user_id) pairs, in input order.
+    Signatures are checked one by one (cached ones are free); revocation
+    is then checked for all of them in a single store lookup.
+    """
+    results = [None] * len(items)
+    decoded = {}  # {index: claims} for tokens that passed jwt.decode
+    for index, (token, user_id) in enumerate(items):
+        try:
+            claims = decode_token(token)
+        except jwt.ExpiredSignatureError:
+            results[index] = {"valid": False, "message": "Token has expired"}
+            continue
+        except jwt.InvalidTokenError:
+            results[index] = {"valid": False, "message": "Invalid token"}
+            continue
+        if user_id is not None and claims.get('user_id') != user_id:
+            results[index] = {"valid": False, "message": "User ID does not match token"}
+            continue
+        decoded[index] = claims
+    
+    revoked = revoked_tokens.revoked(
+        claims['jti'] for claims in decoded.values() if claims.get('jti'))
+    for index, claims in decoded.items():
+        if claims.get('jti') in revoked:
+            results[index] = {"valid": False, "message": "Token has been revoked"}
+        else:
+            results[index] = {
+                "valid": True,
+                "user_id": claims.get('user_id'),
+                "jti": claims.get('jti'),
+                "exp": claims.get('exp')
+            }
+    return results
+
+
+@app.route('/verify-token/batch', methods=['POST'])
+def verify_token_batch():
+    """
+    Verify many JWT tokens in one request
+    Expected JSON: {"tokens": ["eyJ...", {"token": "eyJ...", "user_id": 123}]}
+    Returns: {"results": [{"valid": true, "user_id": 123, "jti": "...", "exp": ...},
+                          {"valid": false, "message": "..."}]} in input order
+    """
+    try:
+        data = request.get_json(silent=True)
+        
+        if not data or not isinstance(data.get('tokens'), list):
+            return jsonify({
+                "error": "Missing 'tokens' list in request"
+            }), 400
+        
+        tokens = data['tokens']
+        if len(tokens) > VERIFY_BATCH_MAX:
+            return jsonify({
+                "error": f"Batch exceeds {VERIFY_BATCH_MAX} tokens"
+            }), 413
+        
+        items = []
+        for index, item in enumerate(tokens):
+            if isinstance(item, dict):
+                if 'token' not in item:
+                    return jsonify({
+                        "error": f"Item {index}: missing 'token'"
+                    }), 400
+                items.append((item['token'], item.get('user_id')))
+            else:
+                items.append((item, None))
+        
+        results = verify_batch(items)
+        valid = sum(result["valid"] for result in results)
+        logger.info(f"Batch verified {valid} of {len(results)} tokens")
+        
+        return jsonify({
+            "results": results
+        }), 200
+        
+    except Exception as e:
+        logger.error(f"Error verifying token batch: {str(e)}")
+        return jsonify({
+            "error": "Internal server error"
+        }), 500
+
+
 @app.route('/login', methods=['POST'])
 def login():
     """
@@ -181,7 +890,7 @@ def login():
         
         try:
             # Verify the token
-            decoded = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
+            decoded = decode_token(token)
             
             # Check if token is revoked
             jti = decoded.get('jti')
@@ -240,11 +949,12 @@ def revoke_token():
         
         try:
             # Decode token to get jti
-            decoded = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
+            decoded = decode_token(token)
             jti = decoded.get('jti')
             
             if jti:
-                revoked_tokens.add(jti)
+                revoked_tokens.add(jti, decoded.get('exp'))
+                token_cache.invalidate(token)
                 logger.info(f"Token revoked: {jti}")
                 
                 return jsonify({
@@ -272,5 +982,46 @@ def revoke_token():
         }), 500
 
 
+@app.route('/revocation-stats', methods=['GET'])
+def revocation_stats():
+    """
+    Report the revocation store's size and purge activity
+    Returns: {"size": 12, "purged_total": 340, "purge_rate_per_sec": 0.5}
+    """
+    return jsonify(revoked_tokens.stats()), 200
+
+
+def benchmark_algorithms(iterations=2000):
+    """
+    Sign and verify throughput per algorithm, in tokens per second.
+    Keys are prepared the way the key ring holds them.
+    """
+    keys = {"HS256": KeyRing(rotation_interval=0).signing_key()[2]}
+    if ed25519 is not None:
+        keys["EdDSA"] = generate_private_key("EdDSA")
+        keys["ES256"] = generate_private_key("ES256")
+    payload = {"jti": str(uuid.uuid4()), "user_id": 1, "exp": int(time.time()) + 3600}
+    results = {}
+    for algorithm, key in keys.items():
+        public = key.public_key() if hasattr(key, 'public_key') else key
+        start = time.perf_counter()
+        for _ in range(iterations):
+            token = jwt.encode(payload, key, algorithm=algorithm)
+        signed = time.perf_counter()
+        for _ in range(iterations):
+            jwt.decode(token, public, algorithms=[algorithm])
+        verified = time.perf_counter()
+        results[algorithm] = {
+            "sign_per_sec": round(iterations / (signed - start)),
+            "verify_per_sec": round(iterations / (verified - signed))
+        }
+    return results
+
+
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=5000)
+    if '--benchmark' in sys.argv[1:]:
+        print(f"{'algorithm':<10}{'sign/s':>12}{'verify/s':>12}")
+        for algorithm, result in benchmark_algorithms().items():
+            print(f"{algorithm:<10}{result['sign_per_sec']:>12}{result['verify_per_sec']:>12}")
+    else:
+        app.run(debug=True, host='0.0.0.0', port=5000)
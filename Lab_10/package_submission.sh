@@ -14,6 +14,7 @@ mkdir -p "$SUBMISSION_DIR"
 # Copy required files
 echo "Copying files..."
 cp my-server.py "$SUBMISSION_DIR/"
+cp ../shared/state_backends.py "$SUBMISSION_DIR/"
 cp my-calls.py "$SUBMISSION_DIR/"
 cp test_jwt_service.py "$SUBMISSION_DIR/"
 cp requirements.txt "$SUBMISSION_DIR/"
@@ -10,6 +10,10 @@ import jwt
 import time
 import sys
 import os
+import socketserver
+import tempfile
+import threading
+from unittest import mock
 
 # Add the parent directory to the path to import the server
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
@@ -29,6 +33,72 @@ except ModuleNotFoundError:
     SECRET_KEY = my_server.SECRET_KEY
 
 
+class FakeRedisHandler(socketserver.StreamRequestHandler):
+    """Just enough of the Redis protocol for the state backend"""
+    
+    def read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        args = []
+        for _ in range(int(line[1:])):
+            length = int(self.rfile.readline()[1:])
+            args.append(self.rfile.read(length + 2)[:-2].decode())
+        return args
+    
+    @staticmethod
+    def encode(value):
+        if value is None:
+            return b'$-1\r\n'
+        if isinstance(value, int):
+            return b':%d\r\n' % value
+        if isinstance(value, list):
+            return b'*%d\r\n' % len(value) + b''.join(FakeRedisHandler.encode(v) for v in value)
+        data = value.encode()
+        return b'$%d\r\n%s\r\n' % (len(data), data)
+    
+    def handle(self):
+        data = self.server.data  # {key: (value, expires_at)}
+        while True:
+            args = self.read_command()
+            if args is None:
+                return
+            self.server.commands += 1
+            name, now = args[0].upper(), time.time()
+            for key in [k for k, (_, exp) in data.items() if exp and exp <= now]:
+                del data[key]
+            if name == 'GET':
+                reply = data.get(args[1], (None,))[0]
+            elif name == 'MGET':
+                reply = [data.get(key, (None,))[0] for key in args[1:]]
+            elif name == 'SET':
+                exp = now + int(args[4]) / 1000 if len(args) > 3 else None
+                data[args[1]] = (args[2], exp)
+                reply = 'OK'
+            elif name == 'GETDEL':
+                reply = data.pop(args[1], (None,))[0]
+            elif name == 'DEL':
+                reply = sum(data.pop(key, None) is not None for key in args[1:])
+            elif name == 'SCAN':
+                prefix = args[3].rstrip('*')
+                reply = ['0', [key for key in data if key.startswith(prefix)]]
+            else:
+                self.wfile.write(b'-ERR unknown command\r\n')
+                continue
+            self.wfile.write(b'+OK\r\n' if reply == 'OK' else self.encode(reply))
+
+
+class FakeRedisServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), FakeRedisHandler)
+        self.data = {}
+        self.commands = 0
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+
 class TestJWTTokenService(unittest.TestCase):
     """Unit and functional tests for the JWT token service"""
     
@@ -38,8 +108,10 @@ class TestJWTTokenService(unittest.TestCase):
         self.client = self.app.test_client()
         self.app.testing = True
         
-        # Clear revoked tokens before each test
+        # Clear revoked tokens, cached verifications and rate limits before each test
         revoked_tokens.clear()
+        my_server.token_cache.clear()
+        my_server.rate_limiter.clear()
     
     def tearDown(self):
         """Clean up after each test"""
@@ -130,6 +202,62 @@ class TestJWTTokenService(unittest.TestCase):
         # All JTIs should be unique
         self.assertEqual(len(jtis), len(set(jtis)), "JTI values are not unique")
     
+    def test_generate_token_batch(self):
+        """Test batch issuance: input order, per-item expiry, one iat"""
+        response = self.client.post(
+            '/generate-token/batch',
+            json={'users': [1, {'user_id': 2, 'expires_in': 60}, 'alice'], 'expires_in': 120}
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.mimetype, 'application/json')
+        results = json.loads(response.data)
+        self.assertEqual([r['user_id'] for r in results], [1, 2, 'alice'])
+        self.assertEqual([r['expires_in'] for r in results], [120, 60, 120])
+        
+        decoded = [jwt.decode(r['token'], SECRET_KEY, algorithms=["HS256"]) for r in results]
+        self.assertEqual(len({d['iat'] for d in decoded}), 1)
+        self.assertEqual([d['exp'] - d['iat'] for d in decoded], [120, 60, 120])
+        self.assertEqual(len({d['jti'] for d in decoded}), 3)
+        
+        verify = self.client.post('/verify-token', json={'token': results[2]['token'], 'user_id': 'alice'})
+        self.assertEqual(verify.status_code, 200)
+    
+    def test_generate_token_batch_streams_large_batches(self):
+        """Test that a batch larger than one streamed chunk stays one JSON array"""
+        response = self.client.post('/generate-token/batch', json={'users': list(range(600))})
+        results = json.loads(response.data)
+        self.assertEqual([r['user_id'] for r in results], list(range(600)))
+        self.assertEqual(len({r['token'] for r in results}), 600)
+    
+    def test_generate_token_batch_invalid(self):
+        """Test batch issuance rejects bad input before issuing anything"""
+        for body in [{}, {'users': 'x'}, {'users': []},
+                     {'users': [1, {'expires_in': 5}]},
+                     {'users': [1], 'expires_in': 'soon'}]:
+            with self.subTest(body=body):
+                response = self.client.post('/generate-token/batch', json=body)
+                self.assertEqual(response.status_code, 400)
+        
+        with mock.patch.object(my_server, 'GENERATE_BATCH_MAX', 2):
+            response = self.client.post('/generate-token/batch', json={'users': [1, 2, 3]})
+        self.assertEqual(response.status_code, 413)
+    
+    def test_batch_signer_matches_jwt_encode(self):
+        """Test that batch-signed tokens verify like jwt.encode ones"""
+        ring = my_server.KeyRing()
+        ring.add_key('es1', my_server.generate_private_key('ES256'))
+        with mock.patch.object(my_server, 'key_ring', ring):
+            token = my_server.batch_signer()({'user_id': 3, 'jti': 'j'})
+        self.assertEqual(jwt.get_unverified_header(token), {'alg': 'ES256', 'kid': 'es1', 'typ': 'JWT'})
+        _, public_key = ring.verification_key('es1')
+        self.assertEqual(jwt.decode(token, public_key, algorithms=['ES256'])['user_id'], 3)
+    
+    def test_bulk_jtis_are_uuid4(self):
+        """Test the bulk jti generator yields distinct version 4 UUIDs"""
+        jtis = list(my_server.bulk_jtis(2500, chunk=1000))
+        self.assertEqual(len(set(jtis)), 2500)
+        self.assertTrue(all(my_server.uuid.UUID(jti).version == 4 for jti in jtis))
+    
     # ========== Unit Tests for Token Verification ==========
     
     def test_verify_token_success(self):
@@ -214,6 +342,17 @@ class TestJWTTokenService(unittest.TestCase):
         data = json.loads(response.data)
         self.assertFalse(data['valid'])
     
+    def test_non_string_token_rejected(self):
+        """Test that a non-string token is invalid, not a server error"""
+        for token in [123, None, ['a.b.c'], {'t': 1}]:
+            with self.subTest(token=token):
+                response = self.client.post('/verify-token', json={'token': token})
+                self.assertEqual(response.status_code, 401)
+                response = self.client.post('/login', json={'user_id': 1, 'token': token})
+                self.assertEqual(response.status_code, 401)
+                response = self.client.post('/revoke-token', json={'token': token})
+                self.assertEqual(response.status_code, 400)
+    
     def test_verify_token_missing_token_field(self):
         """Test verification without token field"""
         response = self.client.post(
@@ -251,6 +390,51 @@ class TestJWTTokenService(unittest.TestCase):
         self.assertFalse(data['valid'])
         self.assertIn('expired', data['message'].lower())
     
+    def test_verify_token_batch(self):
+        """Test batch verification returns per-token results in input order"""
+        good = self._generate(1)
+        revoked = self._generate(2)
+        expired = self._generate(3, expires_in=-10)
+        self.client.post('/revoke-token', json={'token': revoked})
+        
+        response = self.client.post('/verify-token/batch', json={'tokens': [
+            good, revoked, expired, 'not-a-jwt',
+            {'token': good, 'user_id': 1}, {'token': good, 'user_id': 99},
+            123, None, {'token': ['x']}
+        ]})
+        self.assertEqual(response.status_code, 200)
+        results = json.loads(response.data)['results']
+        self.assertEqual([r['valid'] for r in results],
+                         [True, False, False, False, True, False, False, False, False])
+        self.assertEqual(results[0]['user_id'], 1)
+        self.assertEqual([r.get('message') for r in results[1:4]],
+                         ['Token has been revoked', 'Token has expired', 'Invalid token'])
+        self.assertEqual(results[5]['message'], 'User ID does not match token')
+        self.assertEqual([r['message'] for r in results[6:]], ['Invalid token'] * 3)
+    
+    def test_verify_token_batch_single_revocation_lookup(self):
+        """Test that a batch checks revocation in one store lookup"""
+        tokens = [self._generate(i) for i in range(20)]
+        with mock.patch.object(my_server.revoked_tokens.backend, 'get_many',
+                               wraps=my_server.revoked_tokens.backend.get_many) as get_many, \
+                mock.patch.object(my_server.revoked_tokens.backend, 'get',
+                                  wraps=my_server.revoked_tokens.backend.get) as get:
+            response = self.client.post('/verify-token/batch', json={'tokens': tokens})
+        self.assertTrue(all(r['valid'] for r in json.loads(response.data)['results']))
+        self.assertEqual(get_many.call_count, 1)
+        self.assertEqual(get.call_count, 0)
+    
+    def test_verify_token_batch_invalid(self):
+        """Test batch verification input validation"""
+        for body in [{}, {'tokens': 'x'}, {'tokens': [{'user_id': 1}]}]:
+            with self.subTest(body=body):
+                response = self.client.post('/verify-token/batch', json=body)
+                self.assertEqual(response.status_code, 400)
+        
+        with mock.patch.object(my_server, 'VERIFY_BATCH_MAX', 2):
+            response = self.client.post('/verify-token/batch', json={'tokens': ['a', 'b', 'c']})
+        self.assertEqual(response.status_code, 413)
+    
     # ========== Unit Tests for Login ==========
     
     def test_login_success_json(self):
@@ -395,6 +579,427 @@ class TestJWTTokenService(unittest.TestCase):
         
         self.assertEqual(response.status_code, 400)
     
+    # ========== Unit Tests for Verified-Token Cache ==========
+    
+    def _generate(self, user_id, expires_in=3600):
+        response = self.client.post(
+            '/generate-token',
+            json={'user_id': user_id, 'expires_in': expires_in},
+            content_type='application/json'
+        )
+        return json.loads(response.data)['token']
+    
+    def test_repeat_verification_skips_decode(self):
+        """Test that a token verified once is served from the cache"""
+        token = self._generate(5555)
+        
+        with mock.patch.object(my_server.jwt, 'decode', wraps=jwt.decode) as decode:
+            for _ in range(5):
+                response = self.client.post(
+                    '/verify-token',
+                    json={'token': token},
+                    content_type='application/json'
+                )
+                self.assertEqual(response.status_code, 200)
+            login_response = self.client.post(
+                '/login',
+                json={'user_id': 5555, 'token': token},
+                content_type='application/json'
+            )
+            self.assertEqual(login_response.status_code, 200)
+        
+        self.assertEqual(decode.call_count, 1)
+    
+    def test_cache_rejects_reused_signature(self):
+        """Test that a cached signature on a different payload is not trusted"""
+        token = self._generate(5555)
+        self.client.post('/verify-token', json={'token': token})
+        
+        header, _, signature = token.split('.')
+        forged_payload = jwt.encode({'user_id': 1, 'jti': 'x'}, 'other-key', algorithm='HS256').split('.')[1]
+        forged = f"{header}.{forged_payload}.{signature}"
+        
+        response = self.client.post('/verify-token', json={'token': forged})
+        self.assertEqual(response.status_code, 401)
+        self.assertFalse(json.loads(response.data)['valid'])
+    
+    def test_cache_entry_expires_with_token(self):
+        """Test that cached claims are not served past the token's exp"""
+        cache = my_server.VerifiedTokenCache(ttl=300)
+        cache.put('a.b.c', {'user_id': 1, 'exp': time.time() - 1})
+        self.assertIsNone(cache.get('a.b.c'))
+        
+        cache.put('a.b.d', {'user_id': 1, 'exp': time.time() + 60})
+        self.assertEqual(cache.get('a.b.d'), {'user_id': 1, 'exp': mock.ANY})
+    
+    def test_cache_bounded_size(self):
+        """Test that the cache evicts least recently used entries"""
+        cache = my_server.VerifiedTokenCache(max_size=2)
+        for sig in ['s1', 's2', 's3']:
+            cache.put(f'h.p.{sig}', {'user_id': sig})
+        self.assertIsNone(cache.get('h.p.s1'))
+        self.assertIsNotNone(cache.get('h.p.s3'))
+    
+    def test_revocation_invalidates_cached_token(self):
+        """Test that a cached token is rejected right after revocation"""
+        token = self._generate(6666)
+        self.client.post('/verify-token', json={'token': token})
+        self.assertIsNotNone(my_server.token_cache.get(token))
+        
+        self.client.post('/revoke-token', json={'token': token})
+        self.assertIsNone(my_server.token_cache.get(token))
+        
+        response = self.client.post('/verify-token', json={'token': token})
+        self.assertEqual(response.status_code, 401)
+    
+    # ========== Unit Tests for Rate Limiting ==========
+    
+    def test_rate_limit_before_decoding(self):
+        """Test that a client past its burst gets 429 without the token being decoded"""
+        token = self._generate(1)
+        with mock.patch.object(my_server, 'RATE_LIMIT_BURST', 2), \
+                mock.patch.object(my_server, 'decode_token', wraps=my_server.decode_token) as decode:
+            codes = [self.client.post('/verify-token', json={'token': token}).status_code
+                     for _ in range(3)]
+            self.assertEqual(codes, [200, 200, 429])
+            self.assertEqual(decode.call_count, 2)
+            response = self.client.post('/login', json={'user_id': 1, 'token': token})
+            self.assertEqual(response.status_code, 429)
+            self.assertIn('Retry-After', response.headers)
+            self.assertEqual(decode.call_count, 2)
+    
+    def test_rate_limit_charges_batch_as_one_request(self):
+        """Test that a gateway can send batch after batch without being locked out"""
+        token = self._generate(1)
+        with mock.patch.object(my_server, 'RATE_LIMIT_BURST', 20), \
+                mock.patch.object(my_server, 'RATE_LIMIT_RATE', 0.01):
+            for _ in range(5):
+                response = self.client.post('/verify-token/batch', json={'tokens': [token] * 200})
+                self.assertEqual(response.status_code, 200)
+            response = self.client.post('/verify-token', json={'token': token})
+            self.assertEqual(response.status_code, 200)
+            
+            # Each claimed user is charged once per batch, across addresses
+            claims = {'tokens': [{'token': 'guess', 'user_id': 7}] * 50}
+            for i in range(20):
+                response = self.client.post('/verify-token/batch', json=claims,
+                                            environ_base={'REMOTE_ADDR': f'10.0.1.{i}'})
+                self.assertEqual(response.status_code, 200)
+            response = self.client.post('/login', json={'user_id': 7, 'token': 'guess'},
+                                        environ_base={'REMOTE_ADDR': '10.0.2.1'})
+            self.assertEqual(response.status_code, 429)
+    
+    def test_rate_limit_by_claimed_user(self):
+        """Test that logins for one user are limited across client addresses"""
+        with mock.patch.object(my_server, 'RATE_LIMIT_BURST', 2):
+            codes = [self.client.post('/login', data={'user_id': '7', 'token': 'guess'},
+                                      environ_base={'REMOTE_ADDR': f'10.0.0.{i}'}).status_code
+                     for i in range(3)]
+        self.assertEqual(codes, [401, 401, 429])
+    
+    # ========== Unit Tests for Revocation Store ==========
+    
+    def test_revocation_store_forgets_expired_entries(self):
+        """Test that revoked jtis are purged once their tokens expire"""
+        store = my_server.RevocationStore()
+        now = time.time()
+        store.add('live', now + 60)
+        store.add('forever')
+        store.add('already-expired', now - 1)
+        store.add('expiring', now + 0.5)
+        
+        self.assertIn('live', store)
+        self.assertIn('forever', store)
+        self.assertIn('expiring', store)
+        self.assertNotIn('already-expired', store)
+        self.assertEqual(len(store), 3)
+        
+        time.sleep(0.6)
+        self.assertNotIn('expiring', store)
+        stats = store.stats()
+        self.assertEqual(stats['size'], 2)
+        self.assertEqual(stats['purged_total'], 1)
+        self.assertGreater(stats['purge_rate_per_sec'], 0)
+    
+    def test_revocation_store_purges_incrementally(self):
+        """Test that each operation purges at most one batch"""
+        backend = my_server.InMemoryBackend(purge_batch=10)
+        store = my_server.RevocationStore(backend)
+        now = time.time()
+        for i in range(35):
+            store.add(f'jti-{i}', now + 0.2)
+        time.sleep(0.3)
+        
+        store.add('live-0', now + 60)
+        self.assertEqual(backend.purged_total, 10)
+        for i in range(1, 4):
+            store.add(f'live-{i}', now + 60)
+        self.assertEqual(backend.purged_total, 35)
+        self.assertEqual(len(store), 4)
+    
+    def test_bloom_filter_membership(self):
+        """Test the counting Bloom filter never misses added items"""
+        bloom = my_server.CountingBloomFilter(capacity=1000, fp_rate=0.01)
+        added = [f'jti-{i}' for i in range(1000)]
+        for jti in added:
+            bloom.add(jti)
+        self.assertTrue(all(bloom.might_contain(jti) for jti in added))
+        
+        false_positives = sum(bloom.might_contain(f'other-{i}') for i in range(10000))
+        self.assertLess(false_positives, 300)
+        
+        for jti in added:
+            bloom.remove(jti)
+        self.assertFalse(any(bloom.might_contain(jti) for jti in added))
+    
+    def test_revocation_store_filter_tracks_entries(self):
+        """Test that purged and cleared jtis leave the filter"""
+        store = my_server.RevocationStore()
+        store.add('short', time.time() + 0.2)
+        store.add('long', time.time() + 60)
+        self.assertTrue(store.bloom.might_contain('short'))
+        
+        time.sleep(0.3)
+        store.add('trigger-purge', time.time() + 60)
+        self.assertFalse(store.bloom.might_contain('short'))
+        self.assertIn('long', store)
+        
+        store.clear()
+        self.assertFalse(store.bloom.might_contain('long'))
+        self.assertNotIn('long', store)
+    
+    def test_revocation_filter_concurrent_adds_and_purges(self):
+        """Test that the filter's counts survive adds racing purges in other threads"""
+        store = my_server.RevocationStore(my_server.InMemoryBackend(purge_batch=100000))
+        
+        def revoke(worker):
+            for i in range(500):
+                store.add(f'{worker}-{i}', time.time() + 0.05)
+                store.add(f'{worker}-{i // 2}', time.time() + 0.05)  # re-revoked: counted once
+        
+        threads = [threading.Thread(target=revoke, args=(w,)) for w in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        time.sleep(0.1)
+        store.backend.get('trigger-purge')
+        self.assertEqual(len(store), 0)
+        self.assertFalse(any(store.bloom.counters))
+    
+    def _backends(self):
+        """One instance of each state backend, all empty"""
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        redis = FakeRedisServer()
+        self.addCleanup(redis.server_close)
+        self.addCleanup(redis.shutdown)
+        return [
+            my_server.InMemoryBackend(),
+            my_server.SQLiteBackend(os.path.join(tmp.name, 'state.db')),
+            my_server.RedisBackend('127.0.0.1', redis.server_address[1]),
+        ]
+    
+    def test_state_backends_behave_alike(self):
+        """Test get/set/pop/expiry across the memory, SQLite and Redis backends"""
+        for backend in self._backends():
+            with self.subTest(backend=type(backend).__name__):
+                backend.set('a', '1')
+                backend.set('b', '2', ttl=0.2)
+                backend.set_many([('c', '3'), ('d', '4')], ttl=60)
+                self.assertEqual(backend.get('a'), '1')
+                self.assertEqual(backend.get_many(['a', 'missing', 'd']), ['1', None, '4'])
+                self.assertEqual(backend.count(), 4)
+                
+                time.sleep(0.3)
+                self.assertIsNone(backend.get('b'))
+                self.assertEqual(backend.pop('c'), '3')
+                self.assertIsNone(backend.pop('c'))
+                self.assertEqual(backend.count(), 2)
+                
+                backend.clear()
+                self.assertEqual(backend.get_many(['a', 'd']), [None, None])
+    
+    def test_shared_backend_revocation_seen_by_other_workers(self):
+        """Test that a jti revoked through one store is revoked in another"""
+        for backend in self._backends()[1:]:
+            with self.subTest(backend=type(backend).__name__):
+                if isinstance(backend, my_server.SQLiteBackend):
+                    other = my_server.SQLiteBackend(backend.path)
+                else:
+                    other = my_server.RedisBackend(backend.host, backend.port)
+                worker_a = my_server.RevocationStore(backend)
+                worker_b = my_server.RevocationStore(other)
+                self.assertIsNone(worker_b.bloom)
+                
+                worker_a.add('revoked-jti', time.time() + 60)
+                self.assertIn('revoked-jti', worker_b)
+                self.assertEqual(worker_b.revoked(['revoked-jti', 'live-jti']), {'revoked-jti'})
+    
+    def test_redis_lookups_are_pipelined(self):
+        """Test that batch lookups and writes cost one command round trip"""
+        redis = FakeRedisServer()
+        self.addCleanup(redis.server_close)
+        self.addCleanup(redis.shutdown)
+        backend = my_server.RedisBackend('127.0.0.1', redis.server_address[1])
+        backend.set_many([(f'jti-{i}', '') for i in range(100)], ttl=60)
+        
+        before = redis.commands
+        values = backend.get_many([f'jti-{i}' for i in range(200)])
+        self.assertEqual(redis.commands - before, 1)
+        self.assertEqual(sum(v is not None for v in values), 100)
+    
+    def test_create_backend_from_url(self):
+        """Test that STATE_BACKEND urls pick the backend"""
+        self.assertIsInstance(my_server.create_backend('memory', 'ns'), my_server.InMemoryBackend)
+        sqlite = my_server.create_backend('sqlite:////tmp/state.db', 'ns')
+        self.assertEqual((sqlite.path, sqlite.table), ('/tmp/state.db', 'ns'))
+        redis = my_server.create_backend('redis://cache:6380/2', 'ns')
+        self.assertEqual((redis.host, redis.port, redis.db, redis.prefix), ('cache', 6380, 2, 'ns:'))
+        with self.assertRaises(ValueError):
+            my_server.create_backend('mongodb://x', 'ns')
+    
+    def test_revocation_stats_endpoint(self):
+        """Test the revocation stats endpoint reports the store size"""
+        token = self._generate(7777)
+        self.client.post('/revoke-token', json={'token': token})
+        
+        response = self.client.get('/revocation-stats')
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        self.assertEqual(data['size'], 1)
+        self.assertIn('purged_total', data)
+        self.assertIn('purge_rate_per_sec', data)
+    
+    # ========== Unit Tests for Key Rotation ==========
+    
+    def test_token_header_carries_kid(self):
+        """Test that issued tokens name their signing key"""
+        token = self._generate(8888)
+        self.assertEqual(jwt.get_unverified_header(token)['kid'], my_server.SECRET_KEY_ID)
+    
+    def test_prepared_hmac_matches_plain_key(self):
+        """Test that signing with the prepared key gives the usual signature"""
+        payload = {'user_id': 1, 'jti': 'abc'}
+        _, _, key = my_server.KeyRing('k').signing_key()
+        self.assertEqual(jwt.encode(payload, key, algorithm='HS256'),
+                         jwt.encode(payload, 'k', algorithm='HS256'))
+    
+    def test_key_ring_rotates_on_schedule(self):
+        """Test that each interval signs with a new key and old keys retire"""
+        ring = my_server.KeyRing('master', rotation_interval=60, retained_intervals=2)
+        with mock.patch.object(my_server.time, 'time', return_value=6000):
+            kid, _, key = ring.signing_key()
+            self.assertEqual(kid, 'r100')
+            token = jwt.encode({'user_id': 1}, key, algorithm='HS256', headers={'kid': kid})
+        
+        with mock.patch.object(my_server.time, 'time', return_value=6000 + 2 * 60):
+            self.assertEqual(ring.signing_key()[0], 'r102')
+            algorithm, key = ring.verification_key('r100')
+            self.assertEqual(jwt.decode(token, key, algorithms=[algorithm])['user_id'], 1)
+            self.assertIsNotNone(ring.verification_key(None))
+        
+        with mock.patch.object(my_server.time, 'time', return_value=6000 + 3 * 60):
+            self.assertIsNone(ring.verification_key('r100'))
+            self.assertIsNotNone(ring.verification_key('primary'))
+    
+    def test_rotated_keys_agree_across_workers(self):
+        """Test that two workers derive the same key for an interval"""
+        ring_a = my_server.KeyRing('master', rotation_interval=60)
+        ring_b = my_server.KeyRing('master', rotation_interval=60)
+        kid, _, key = ring_a.signing_key()
+        token = jwt.encode({'user_id': 2}, key, algorithm='HS256', headers={'kid': kid})
+        _, key = ring_b.verification_key(kid)
+        self.assertEqual(jwt.decode(token, key, algorithms=['HS256'])['user_id'], 2)
+    
+    def test_verify_token_signed_with_rotated_key(self):
+        """Test that the server verifies by kid, and rejects unknown kids"""
+        ring = my_server.KeyRing(my_server.SECRET_KEY, rotation_interval=3600)
+        with mock.patch.object(my_server, 'key_ring', ring):
+            token = self._generate(9999)
+            self.assertTrue(jwt.get_unverified_header(token)['kid'].startswith('r'))
+            response = self.client.post('/verify-token', json={'token': token})
+            self.assertEqual(response.status_code, 200)
+            
+            legacy = jwt.encode({'user_id': 9999, 'jti': 'legacy'}, my_server.SECRET_KEY, algorithm='HS256')
+            response = self.client.post('/verify-token', json={'token': legacy})
+            self.assertEqual(response.status_code, 200)
+        
+        unknown = jwt.encode({'user_id': 1, 'jti': 'x'}, 'other-key', algorithm='HS256',
+                             headers={'kid': 'retired'})
+        response = self.client.post('/verify-token', json={'token': unknown})
+        self.assertEqual(response.status_code, 401)
+    
+    # ========== Unit Tests for Asymmetric Signing ==========
+    
+    def test_asymmetric_tokens_verify_with_public_key(self):
+        """Test EdDSA and ES256 issuance, verified by a node holding only the public key"""
+        for algorithm in ['EdDSA', 'ES256']:
+            with self.subTest(algorithm=algorithm):
+                private_key = my_server.generate_private_key(algorithm)
+                issuer = my_server.KeyRing()
+                issuer.add_key('k1', private_key)
+                verifier = my_server.KeyRing(secret=None)
+                verifier.add_key('k1', private_key.public_key())
+                
+                with mock.patch.object(my_server, 'key_ring', issuer):
+                    token = self._generate(4242)
+                self.assertEqual(jwt.get_unverified_header(token)['alg'], algorithm)
+                
+                my_server.token_cache.clear()
+                with mock.patch.object(my_server, 'key_ring', verifier):
+                    response = self.client.post('/verify-token', json={'token': token})
+                    self.assertEqual(response.status_code, 200)
+                    with self.assertRaises(RuntimeError):
+                        verifier.signing_key()
+    
+    def test_kid_pins_algorithm(self):
+        """Test that a token cannot switch its kid's algorithm to HS256"""
+        private_key = my_server.generate_private_key('EdDSA')
+        ring = my_server.KeyRing(secret=None)
+        ring.add_key('k1', private_key.public_key())
+        public_pem = private_key.public_key().public_bytes(
+            my_server.serialization.Encoding.Raw, my_server.serialization.PublicFormat.Raw)
+        forged = jwt.encode({'user_id': 1, 'jti': 'x'}, public_pem, algorithm='HS256',
+                            headers={'kid': 'k1'})
+        with mock.patch.object(my_server, 'key_ring', ring):
+            response = self.client.post('/verify-token', json={'token': forged})
+        self.assertEqual(response.status_code, 401)
+    
+    def test_verify_only_mode_refuses_issuance(self):
+        """Test that a verify-only node serves verification but not issuance"""
+        token = self._generate(4343)
+        with mock.patch.object(my_server, 'SERVICE_MODE', 'verify'):
+            response = self.client.post('/generate-token', json={'user_id': 1})
+            self.assertEqual(response.status_code, 403)
+            response = self.client.post('/revoke-token', json={'token': token})
+            self.assertEqual(response.status_code, 403)
+            response = self.client.post('/login', json={'user_id': 4343, 'token': token})
+            self.assertEqual(response.status_code, 200)
+    
+    def test_build_key_ring_from_settings(self):
+        """Test that verify mode loads only the configured public keys"""
+        private_key = my_server.generate_private_key('ES256')
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'es.pub.pem')
+            with open(path, 'wb') as f:
+                f.write(private_key.public_key().public_bytes(
+                    my_server.serialization.Encoding.PEM,
+                    my_server.serialization.PublicFormat.SubjectPublicKeyInfo))
+            with mock.patch.multiple(my_server, SERVICE_MODE='verify', JWT_PUBLIC_KEYS=f'es1={path}'):
+                ring = my_server.build_key_ring()
+        self.assertEqual(ring.kids(), ['es1'])
+        self.assertEqual(ring.verification_key('es1')[0], 'ES256')
+        self.assertIsNone(ring.verification_key(None))
+    
+    def test_benchmark_algorithms(self):
+        """Test the sign/verify benchmark covers every algorithm"""
+        results = my_server.benchmark_algorithms(iterations=5)
+        self.assertEqual(set(results), {'HS256', 'EdDSA', 'ES256'})
+        for result in results.values():
+            self.assertGreater(result['sign_per_sec'], 0)
+            self.assertGreater(result['verify_per_sec'], 0)
+    
     # ========== Functional Tests ==========
     
     def test_home_endpoint(self):
@@ -42,4 +42,20 @@ for number in test_cases:
         else:
             print(f"Error response: {response.text}")
     except Exception as e:
-        print(f"Error making request: {e}") 
\ No newline at end of file
+        print(f"Error making request: {e}") 
+
+print("\n=== Testing batch factors endpoint ===")
+
+# One request for the whole list instead of one round trip per number
+try:
+    response = httpx.post(url + "factors/batch", json=test_cases)
+    print(f"Status code: {response.status_code}")
+    
+    if response.status_code == 200:
+        for line in response.text.splitlines():
+            result = json.loads(line)
+            print(f"{result['number']}: {result.get('factors', result.get('error'))}")
+    else:
+        print(f"Error response: {response.text}")
+except Exception as e:
+    print(f"Error making request: {e}")
@@ -1,7 +1,60 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
+from array import array
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from collections import OrderedDict
+from concurrent.futures.process import BrokenProcessPool
+import json
+import math
+import mmap
+import os
+import random
+import sys
+import threading
+import time
 
 app = Flask(__name__)
 
+# Inputs below this bound are factored by smallest-prime-factor table
+# lookups. The table takes 2 bytes per entry and is built on first use.
+SPF_SIEVE_LIMIT = int(os.environ.get("SPF_SIEVE_LIMIT", 10**7))
+
+# Optional file backing the table. When set, the table is written there
+# once and memory-mapped read-only, so worker processes share one copy.
+SPF_TABLE_PATH = os.environ.get("SPF_TABLE_PATH")
+
+# Inputs below this bound are cheap enough for plain trial division
+# (at most ~2000 odd candidates); larger ones go to Pollard-rho.
+TRIAL_DIVISION_LIMIT = 1 << 24
+
+# Primes stripped off by the wheel pre-pass before Pollard-rho runs.
+SMALL_PRIME_BOUND = 1000
+
+# Inputs at or above this bound are factored in a worker process instead of
+# on the request thread.
+FACTOR_POOL_THRESHOLD = int(os.environ.get("FACTOR_POOL_THRESHOLD", 1 << 40))
+
+# Worker processes, and how many offloaded jobs may be queued or running
+# at once before /factors answers 503.
+FACTOR_POOL_WORKERS = int(os.environ.get("FACTOR_POOL_WORKERS", os.cpu_count() or 1))
+FACTOR_POOL_MAX_PENDING = int(os.environ.get("FACTOR_POOL_MAX_PENDING", 4 * FACTOR_POOL_WORKERS))
+
+# Seconds an offloaded factorization may take before it is abandoned.
+FACTOR_TIME_BUDGET = float(os.environ.get("FACTOR_TIME_BUDGET", 5.0))
+
+# Retry-After value (seconds) sent with 503 responses.
+FACTOR_POOL_RETRY_AFTER = 1
+
+# Bounds on the factorization result cache: entry count and approximate
+# memory footprint in bytes. The least recently used entries go first.
+FACTOR_CACHE_MAX_ENTRIES = int(os.environ.get("FACTOR_CACHE_MAX_ENTRIES", 100000))
+FACTOR_CACHE_MAX_BYTES = int(os.environ.get("FACTOR_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+
+# Maximum number of integers accepted by one /factors/batch request.
+MAX_BATCH_SIZE = 10000
+
+# Witness bases that make Miller-Rabin deterministic for n < 3.3 * 10**24.
+MILLER_RABIN_BASES = (2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41)
+
 def trial_division(n):
     """
     AI generated factorization function using trial division method.
@@ -32,6 +85,529 @@ def trial_division(n):
     
     return factors
 
+def small_primes(limit):
+    """
+    Return all primes below limit using the sieve of Eratosthenes.
+    """
+    sieve = bytearray([1]) * limit
+    sieve[0:2] = b"\x00\x00"
+    for p in range(2, math.isqrt(limit - 1) + 1):
+        if sieve[p]:
+            sieve[p * p::p] = bytes(len(range(p * p, limit, p)))
+    return [p for p in range(limit) if sieve[p]]
+
+SMALL_PRIMES = small_primes(SMALL_PRIME_BOUND)
+
+def build_spf_table(limit):
+    """
+    Build a smallest-prime-factor table for 0 <= n < limit.
+    Entry n holds the smallest prime factor of composite n and 0 when n is
+    prime (or 0/1). Composite factors never exceed sqrt(limit), which is
+    why 16-bit entries are enough for limit <= 2**32.
+    """
+    if limit > 1 << 32:
+        raise ValueError("SPF table limit must not exceed 2**32")
+    
+    table = array('H', bytes(2 * limit))
+    # Largest primes first, so smaller primes overwrite shared multiples
+    for p in reversed(small_primes(math.isqrt(max(limit - 1, 0)) + 1)):
+        table[p * p::p] = array('H', [p]) * len(range(p * p, limit, p))
+    return table
+
+def load_spf_table(limit, path=None):
+    """
+    Return the SPF table for limit, memory-mapped from path if given.
+    A missing or wrongly sized file is (re)built and replaced atomically.
+    """
+    if path is None:
+        return build_spf_table(limit)
+    
+    if not os.path.exists(path) or os.path.getsize(path) != 2 * limit:
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            build_spf_table(limit).tofile(f)
+        os.replace(tmp_path, path)
+    
+    with open(path, 'rb') as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return memoryview(mapped).cast('H')
+
+_spf_table = None
+_spf_table_lock = threading.Lock()
+
+def get_spf_table():
+    """
+    Return the shared SPF table, loading it on first use.
+    """
+    global _spf_table
+    if _spf_table is None:
+        with _spf_table_lock:
+            if _spf_table is None:
+                _spf_table = load_spf_table(SPF_SIEVE_LIMIT, SPF_TABLE_PATH)
+    return _spf_table
+
+def sieve_factorization(n):
+    """
+    Factorization for n below SPF_SIEVE_LIMIT.
+    Repeatedly divides by the tabled smallest prime factor, so it takes
+    one lookup per prime factor. Returns the same list as trial_division.
+    """
+    if n <= 0:
+        return []
+    
+    if n == 1:
+        return [1]
+    
+    table = get_spf_table()
+    factors = []
+    while n > 1:
+        p = table[n] or n
+        factors.append(p)
+        n //= p
+    return factors
+
+def is_prime(n):
+    """
+    Miller-Rabin primality test.
+    Deterministic for n < 3.3 * 10**24; beyond that a composite passes
+    with probability below 4**-13.
+    """
+    if n < 2:
+        return False
+    for p in MILLER_RABIN_BASES:
+        if n % p == 0:
+            return n == p
+    
+    d = n - 1
+    s = 0
+    while d % 2 == 0:
+        d //= 2
+        s += 1
+    
+    for a in MILLER_RABIN_BASES:
+        x = pow(a, d, n)
+        if x == 1 or x == n - 1:
+            continue
+        for _ in range(s - 1):
+            x = x * x % n
+            if x == n - 1:
+                break
+        else:
+            return False
+    return True
+
+class FactorizationTimeout(Exception):
+    """Raised in a worker process when a job runs past its time budget."""
+
+# Deadline (time.monotonic) of the job running in this process, if any.
+# Only set inside pool workers, which run one job at a time.
+_job_deadline = None
+
+def check_deadline():
+    """
+    Abort the current job if it has run past its deadline.
+    """
+    if _job_deadline is not None and time.monotonic() > _job_deadline:
+        raise FactorizationTimeout("Factorization exceeded its time budget")
+
+def brent_factor(n):
+    """
+    Find a non-trivial factor of the odd composite n using Pollard-rho
+    with Brent's cycle detection. gcd is taken over batches of products
+    so only one gcd is computed every few hundred steps.
+    """
+    batch = 128
+    while True:
+        y = random.randrange(1, n)
+        c = random.randrange(1, n)
+        g = r = q = 1
+        while g == 1:
+            check_deadline()
+            x = y
+            for _ in range(r):
+                y = (y * y + c) % n
+            k = 0
+            while k < r and g == 1:
+                ys = y
+                for _ in range(min(batch, r - k)):
+                    y = (y * y + c) % n
+                    q = q * abs(x - y) % n
+                g = math.gcd(q, n)
+                k += batch
+                check_deadline()
+            r *= 2
+        
+        if g == n:
+            # The batch overshot the cycle; step back through it one by one
+            g = 1
+            while g == 1:
+                ys = (ys * ys + c) % n
+                g = math.gcd(abs(x - ys), n)
+        
+        if g != n:
+            return g
+
+def pollard_rho(n):
+    """
+    Factorization for large integers.
+    Strips small primes with a wheel pre-pass, then splits the remaining
+    cofactor with Brent's Pollard-rho until every part passes Miller-Rabin.
+    Returns a sorted list of prime factors, matching trial_division.
+    """
+    if n <= 0:
+        return []
+    
+    if n == 1:
+        return [1]
+    
+    factors = []
+    for p in SMALL_PRIMES:
+        if p * p > n:
+            break
+        while n % p == 0:
+            factors.append(p)
+            n //= p
+    
+    stack = [n] if n > 1 else []
+    while stack:
+        m = stack.pop()
+        if m < SMALL_PRIME_BOUND * SMALL_PRIME_BOUND or is_prime(m):
+            # Every factor below the bound was stripped, so m is prime
+            factors.append(m)
+        else:
+            d = brent_factor(m)
+            stack.append(d)
+            stack.append(m // d)
+    
+    factors.sort()
+    return factors
+
+# Factorization engines in order of preference: the first whose limit
+# is above n handles it. A limit of None accepts any input.
+FACTORIZATION_ENGINES = [
+    (SPF_SIEVE_LIMIT, sieve_factorization),
+    (TRIAL_DIVISION_LIMIT, trial_division),
+    (None, pollard_rho),
+]
+
+def factorize(n):
+    """
+    Factor n with the engine best suited to its size.
+    """
+    for limit, engine in FACTORIZATION_ENGINES:
+        if limit is None or n < limit:
+            return engine(n)
+    raise ValueError(f"No factorization engine accepts {n}")
+
+class FactorCache:
+    """
+    Thread-safe LRU cache of prime factorizations, bounded both by entry
+    count and by an estimate of the memory its keys and values use.
+    """
+    
+    # Rough per-entry cost of the OrderedDict slot and linked-list node
+    ENTRY_OVERHEAD = 100
+    
+    def __init__(self, max_entries, max_bytes):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.partial_hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    @classmethod
+    def entry_size(cls, n, factors):
+        return (cls.ENTRY_OVERHEAD + sys.getsizeof(n) + sys.getsizeof(factors)
+                + sum(sys.getsizeof(p) for p in factors))
+    
+    def peek(self, n):
+        """
+        Return the cached factors of n without touching the counters.
+        """
+        with self._lock:
+            entry = self._entries.get(n)
+            if entry is None:
+                return None
+            self._entries.move_to_end(n)
+            return entry[0]
+    
+    def get(self, n):
+        """
+        Return the cached factors of n, or None. A miss falls back to
+        looking up n with its small prime factors divided out, so if the
+        factors of m are cached then those of k*m are too for any k built
+        from primes below SMALL_PRIME_BOUND.
+        """
+        factors = self.peek(n)
+        if factors is not None:
+            with self._lock:
+                self.hits += 1
+            return factors
+        
+        small = []
+        m = n
+        for p in SMALL_PRIMES:
+            if p * p > m:
+                break
+            if m % p:
+                continue
+            while m % p == 0:
+                small.append(p)
+                m //= p
+            if m == 1:
+                break
+            cofactor = self.peek(m)
+            if cofactor is not None:
+                factors = tuple(sorted(small + list(cofactor)))
+                with self._lock:
+                    self.partial_hits += 1
+                self.put(n, factors)
+                return factors
+        
+        with self._lock:
+            self.misses += 1
+        return None
+    
+    def put(self, n, factors):
+        """
+        Cache the factors of n, evicting least recently used entries
+        until both bounds hold again.
+        """
+        factors = tuple(factors)
+        size = self.entry_size(n, factors)
+        if size > self.max_bytes or self.max_entries <= 0:
+            return
+        with self._lock:
+            old = self._entries.pop(n, None)
+            if old is not None:
+                self.bytes -= old[1]
+            self._entries[n] = (factors, size)
+            self.bytes += size
+            while len(self._entries) > self.max_entries or self.bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.bytes -= evicted_size
+                self.evictions += 1
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+            self.hits = self.partial_hits = self.misses = self.evictions = 0
+    
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self.bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "partial_hits": self.partial_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+factor_cache = FactorCache(FACTOR_CACHE_MAX_ENTRIES, FACTOR_CACHE_MAX_BYTES)
+
+def cached_factorize(n):
+    """
+    factorize() behind factor_cache. Inputs below SPF_SIEVE_LIMIT skip
+    the cache: a sieve lookup is cheaper than a cache miss, and their
+    entries would only push out expensive Pollard-rho results.
+    """
+    if n < SPF_SIEVE_LIMIT:
+        return factorize(n)
+    factors = factor_cache.get(n)
+    if factors is None:
+        factors = factorize(n)
+        factor_cache.put(n, factors)
+    return list(factors)
+
+def format_factor_result(n, factors):
+    """
+    Build the /factors response body for n from its prime factors.
+    """
+    # Special case for 1 - not prime, return as is
+    if n == 1:
+        return {"number": n, "factors": [1], "is_prime": False}
+    
+    factors = list(factors)
+    
+    # If the number is prime (only one factor which is itself), return [n]
+    if len(factors) == 1 and factors[0] == n:
+        return {"number": n, "factors": [n], "is_prime": True}
+    
+    # For composite numbers, include 1 as the first factor as per example
+    return {"number": n, "factors": [1] + factors, "is_prime": False}
+
+def factor_result(n):
+    """
+    Build the /factors response body for a positive integer n.
+    """
+    return format_factor_result(n, cached_factorize(n))
+
+def _factor_job(n, budget):
+    """
+    Pool entry point: factor n in a worker process, giving up with
+    FactorizationTimeout once budget seconds have passed.
+    """
+    global _job_deadline
+    _job_deadline = time.monotonic() + budget
+    try:
+        return factorize(n)
+    finally:
+        _job_deadline = None
+
+class FactorPool:
+    """
+    Process pool for factorizations too slow for the request thread.
+    At most max_pending jobs are queued or running at once; a job keeps
+    its slot until its worker actually finishes, so abandoned jobs that
+    are still running count against the limit.
+    """
+    
+    def __init__(self, workers, max_pending):
+        self.workers = workers
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._executor = None
+        self._lock = threading.Lock()
+    
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            return self._executor
+    
+    def submit(self, n, budget):
+        """
+        Queue n for factorization. Returns a future, or None if the pool
+        is saturated.
+        """
+        if not self._slots.acquire(blocking=False):
+            return None
+        try:
+            future = self._get_executor().submit(_factor_job, n, budget)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda f: self._slots.release())
+        return future
+    
+    def reset(self):
+        """
+        Drop a broken executor so the next job starts fresh workers.
+        """
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+factor_pool = FactorPool(FACTOR_POOL_WORKERS, FACTOR_POOL_MAX_PENDING)
+
+class FactorPoolBusy(Exception):
+    """Raised when the pool has no room for another job."""
+
+def offloaded_factorize(n):
+    """
+    Factor n in the process pool within FACTOR_TIME_BUDGET, caching the
+    result. Raises FactorPoolBusy or FactorizationTimeout.
+    """
+    future = factor_pool.submit(n, FACTOR_TIME_BUDGET)
+    if future is None:
+        raise FactorPoolBusy()
+    
+    try:
+        factors = future.result(timeout=FACTOR_TIME_BUDGET)
+    except (FactorizationTimeout, FutureTimeout):
+        # Drops the job if it is still queued; a running job stops itself
+        # at its own deadline
+        future.cancel()
+        raise FactorizationTimeout("Factorization exceeded the time budget")
+    except BrokenProcessPool:
+        factor_pool.reset()
+        raise FactorPoolBusy()
+    
+    # Workers have their own memory, so the result is cached here
+    factor_cache.put(n, factors)
+    return factors
+
+def pool_unavailable():
+    """
+    503 response telling the client to retry once the pool drains.
+    """
+    response = jsonify({"error": "Factorization pool is busy, try again later"})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(FACTOR_POOL_RETRY_AFTER)
+    return response
+
+def offloaded_factor_result(n):
+    """
+    Factor n in the process pool within FACTOR_TIME_BUDGET.
+    Returns a Flask response.
+    """
+    try:
+        factors = offloaded_factorize(n)
+    except FactorPoolBusy:
+        return pool_unavailable()
+    except FactorizationTimeout:
+        return jsonify({"error": "Factorization exceeded the time budget"}), 504
+    return jsonify(format_factor_result(n, factors))
+
+def parse_batch(req):
+    """
+    Extract the raw batch items from a /factors/batch request.
+    Accepts a JSON list, a JSON object with a "numbers" list, or a
+    newline-delimited text body. Returns None if the body is unusable.
+    """
+    if req.is_json:
+        data = req.get_json(silent=True)
+        if isinstance(data, dict):
+            data = data.get('numbers')
+        return data if isinstance(data, list) else None
+    
+    text = req.get_data(as_text=True)
+    return [line.strip() for line in text.splitlines() if line.strip()]
+
+def batch_results(items):
+    """
+    Yield one NDJSON line per batch item, in input order.
+    Repeated numbers are factored once; the SPF table and small-prime list
+    are shared by the whole batch. Items at or above FACTOR_POOL_THRESHOLD
+    go through the process pool under FACTOR_TIME_BUDGET, as on /factors,
+    and get an error line if they time out or the pool is full.
+    """
+    seen = {}
+    for item in items:
+        try:
+            if isinstance(item, (bool, float)):
+                raise ValueError
+            n = int(item)
+        except (TypeError, ValueError):
+            result = {"number": item, "error": "Invalid integer format"}
+        else:
+            if n <= 0:
+                result = {"number": n, "error": "Number must be positive"}
+            elif n in seen:
+                result = seen[n]
+            elif n >= FACTOR_POOL_THRESHOLD:
+                try:
+                    factors = factor_cache.get(n)
+                    if factors is None:
+                        factors = offloaded_factorize(n)
+                    result = format_factor_result(n, factors)
+                except FactorPoolBusy:
+                    result = {"number": n, "error": "Factorization pool is busy, try again later"}
+                except FactorizationTimeout:
+                    result = {"number": n, "error": "Factorization exceeded the time budget"}
+                seen[n] = result
+            else:
+                result = seen[n] = factor_result(n)
+        yield json.dumps(result) + "\n"
+
 @app.route("/")
 def hello():
    return " you called \n"
@@ -58,23 +634,39 @@ def get_factors():
         if inINT <= 0:
             return jsonify({"error": "Number must be positive"}), 400
         
-        # Get factors
-        factors = trial_division(inINT)
+        # Large inputs run in a worker process so they don't block this one
+        if inINT >= FACTOR_POOL_THRESHOLD:
+            factors = factor_cache.get(inINT)
+            if factors is None:
+                return offloaded_factor_result(inINT)
+            return jsonify(format_factor_result(inINT, factors))
         
-        # Special case for 1 - not prime, return as is
-        if inINT == 1:
-            return jsonify({"number": inINT, "factors": [1], "is_prime": False})
-        
-        # If the number is prime (only one factor which is itself), return [inINT]
-        if len(factors) == 1 and factors[0] == inINT:
-            return jsonify({"number": inINT, "factors": [inINT], "is_prime": True})
-        else:
-            # For composite numbers, include 1 as the first factor as per example
-            factors_with_one = [1] + factors
-            return jsonify({"number": inINT, "factors": factors_with_one, "is_prime": False})
+        return jsonify(factor_result(inINT))
         
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+# curl -H "Content-Type: application/json" -d "[12, 7, 360]" -X POST http://localhost:5000/factors/batch
+# curl --data-binary $'12\n7\n360' -X POST http://localhost:5000/factors/batch
+@app.route("/factors/batch", methods=['POST'])
+def get_factors_batch():
+    items = parse_batch(request)
+    if items is None:
+        return jsonify({"error": "Expected a JSON list of numbers or one number per line"}), 400
+    
+    if not items:
+        return jsonify({"error": "No numbers provided"}), 400
+    
+    if len(items) > MAX_BATCH_SIZE:
+        return jsonify({"error": f"Batch exceeds {MAX_BATCH_SIZE} numbers"}), 413
+    
+    # Results are streamed as newline-delimited JSON in input order
+    return Response(batch_results(items), mimetype='application/x-ndjson')
+
+# curl http://localhost:5000/factors/cache
+@app.route("/factors/cache", methods=['GET'])
+def get_factor_cache_stats():
+    return jsonify(factor_cache.stats())
+
 if __name__ == "__main__":
    app.run(host='0.0.0.0', debug=True)
\ No newline at end of file
@@ -1,6 +1,11 @@
 import unittest
 import json
-from my_server import app, trial_division
+import os
+import tempfile
+import my_server
+from my_server import (app, trial_division, is_prime, pollard_rho, factorize,
+                       sieve_factorization, load_spf_table, FactorPool, FactorCache,
+                       factor_cache)
 
 class TestFactorization(unittest.TestCase):
     
@@ -8,6 +13,7 @@ class TestFactorization(unittest.TestCase):
         """Set up test client"""
         self.app = app.test_client()
         self.app.testing = True
+        factor_cache.clear()
     
     def test_trial_division_function(self):
         """Test the trial_division function directly"""
@@ -32,6 +38,58 @@ class TestFactorization(unittest.TestCase):
         self.assertEqual(trial_division(0), [])
         self.assertEqual(trial_division(-5), [])
     
+    def test_is_prime_function(self):
+        """Test the Miller-Rabin primality check"""
+        for p in [2, 3, 5, 97, 7919, 1000000007, 2**61 - 1]:
+            self.assertTrue(is_prime(p))
+        
+        # Carmichael numbers and strong pseudoprimes to small bases
+        for c in [0, 1, 4, 561, 1105, 3215031751, 2**61 + 1]:
+            self.assertFalse(is_prime(c))
+    
+    def test_pollard_rho_matches_trial_division(self):
+        """Test that Pollard-rho agrees with trial division"""
+        for n in list(range(1, 2000)) + [999983 * 999979, 2**32 - 1, 10**12]:
+            self.assertEqual(pollard_rho(n), trial_division(n))
+    
+    def test_factorize_large_numbers(self):
+        """Test factorization of inputs too large for trial division"""
+        # 18-digit semiprime
+        self.assertEqual(factorize(1000000007 * 998244353), [998244353, 1000000007])
+        self.assertEqual(factorize(2**64 - 1), [3, 5, 17, 257, 641, 65537, 6700417])
+        self.assertEqual(factorize(2**89 - 1), [2**89 - 1])
+    
+    def test_factors_endpoint_large_number(self):
+        """Test the /factors endpoint with a large semiprime"""
+        n = 1000000007 * 998244353
+        response = self.app.post('/factors', data={'number': str(n)})
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        self.assertEqual(data['number'], n)
+        self.assertEqual(data['factors'], [1, 998244353, 1000000007])
+        self.assertFalse(data['is_prime'])
+    
+    def test_sieve_factorization_matches_trial_division(self):
+        """Test that SPF table lookups agree with trial division"""
+        for n in list(range(-2, 5000)) + [9999991, 9999990, 2 * 4999999]:
+            self.assertEqual(sieve_factorization(n), trial_division(n))
+    
+    def test_spf_table_memory_mapped_file(self):
+        """Test that the SPF table is written once and then mapped from disk"""
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'spf.bin')
+            table = load_spf_table(1000, path)
+            self.assertEqual(os.path.getsize(path), 2000)
+            self.assertEqual(table[360], 2)
+            self.assertEqual(table[91], 7)
+            self.assertEqual(table[97], 0)
+            
+            # A second load maps the existing file instead of rebuilding it
+            mtime = os.path.getmtime(path)
+            self.assertEqual(load_spf_table(1000, path).tolist(), table.tolist())
+            self.assertEqual(os.path.getmtime(path), mtime)
+            table.release()
+    
     def test_factors_endpoint_prime_numbers(self):
         """Test the /factors endpoint with prime numbers"""
         # Test prime number 7
@@ -86,6 +144,156 @@ class TestFactorization(unittest.TestCase):
         self.assertEqual(data['factors'], [1])
         self.assertFalse(data['is_prime'])
     
+    def test_factors_endpoint_offloaded_to_pool(self):
+        """Test that inputs above the pool threshold are factored in a worker"""
+        n = 1000000007 * 998244353
+        self.assertGreaterEqual(n, my_server.FACTOR_POOL_THRESHOLD)
+        response = self.app.post('/factors', data={'number': str(n)})
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        self.assertEqual(data['factors'], [1, 998244353, 1000000007])
+    
+    def test_factors_endpoint_pool_saturated(self):
+        """Test that a saturated pool answers 503 with Retry-After"""
+        original = my_server.factor_pool
+        my_server.factor_pool = FactorPool(1, 0)
+        try:
+            response = self.app.post('/factors', data={'number': str(2**61 - 1)})
+        finally:
+            my_server.factor_pool = original
+        self.assertEqual(response.status_code, 503)
+        self.assertIn('Retry-After', response.headers)
+        self.assertIn('error', json.loads(response.data))
+        
+        # Small inputs never touch the pool
+        response = self.app.post('/factors', data={'number': '360'})
+        self.assertEqual(response.status_code, 200)
+    
+    def test_factors_endpoint_time_budget(self):
+        """Test that a job past its time budget is abandoned with 504"""
+        # Product of two 25-digit primes: far beyond Pollard-rho in 0.2s
+        n = (10**24 + 7) * (10**24 + 49)
+        original = my_server.FACTOR_TIME_BUDGET
+        my_server.FACTOR_TIME_BUDGET = 0.2
+        try:
+            response = self.app.post('/factors', data={'number': str(n)})
+        finally:
+            my_server.FACTOR_TIME_BUDGET = original
+        self.assertEqual(response.status_code, 504)
+        self.assertIn('error', json.loads(response.data))
+    
+    def test_factor_cache_hits_and_misses(self):
+        """Test that repeated requests are served from the cache"""
+        n = 999983 * 1000003  # above the sieve, below the pool threshold
+        for _ in range(3):
+            response = self.app.post('/factors', data={'number': str(n)})
+            self.assertEqual(json.loads(response.data)['factors'], [1, 999983, 1000003])
+        
+        response = self.app.get('/factors/cache')
+        self.assertEqual(response.status_code, 200)
+        stats = json.loads(response.data)
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['hits'], 2)
+        self.assertEqual(stats['entries'], 1)
+        self.assertGreater(stats['bytes'], 0)
+        
+        # Sieve-range inputs bypass the cache
+        self.app.post('/factors', data={'number': '360'})
+        self.assertEqual(factor_cache.stats()['entries'], 1)
+    
+    def test_factor_cache_reuses_cofactor(self):
+        """Test that k*n is answered from the cached factors of n"""
+        cache = FactorCache(100, 1 << 20)
+        n = 1000000007 * 998244353
+        cache.put(n, [998244353, 1000000007])
+        
+        self.assertEqual(list(cache.get(12 * n)), [2, 2, 3, 998244353, 1000000007])
+        self.assertEqual(cache.partial_hits, 1)
+        self.assertEqual(cache.misses, 0)
+        
+        # The combined result is cached in its own right
+        cache.get(12 * n)
+        self.assertEqual(cache.hits, 1)
+    
+    def test_factor_cache_eviction(self):
+        """Test that the cache evicts least recently used entries"""
+        cache = FactorCache(2, 1 << 20)
+        cache.put(10**9 + 7, [10**9 + 7])
+        cache.put(10**9 + 9, [10**9 + 9])
+        cache.get(10**9 + 7)
+        cache.put(998244353, [998244353])
+        
+        self.assertEqual(cache.evictions, 1)
+        self.assertIsNone(cache.peek(10**9 + 9))
+        self.assertIsNotNone(cache.peek(10**9 + 7))
+        
+        # The memory bound evicts as well
+        small = FactorCache(100, 2 * FactorCache.entry_size(4, (2, 2)))
+        for n in [4, 9, 25]:
+            small.put(n, trial_division(n))
+        self.assertEqual(small.stats()['entries'], 2)
+        self.assertEqual(small.evictions, 1)
+    
+    def test_factors_batch_json(self):
+        """Test the /factors/batch endpoint with a JSON list"""
+        response = self.app.post('/factors/batch', json=[12, 7, 1, 12, 'abc', -5])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        results = [json.loads(line) for line in response.data.decode().splitlines()]
+        
+        self.assertEqual(len(results), 6)
+        self.assertEqual(results[0], {'number': 12, 'factors': [1, 2, 2, 3], 'is_prime': False})
+        self.assertEqual(results[1], {'number': 7, 'factors': [7], 'is_prime': True})
+        self.assertEqual(results[2], {'number': 1, 'factors': [1], 'is_prime': False})
+        self.assertEqual(results[3], results[0])
+        self.assertIn('error', results[4])
+        self.assertIn('error', results[5])
+    
+    def test_factors_batch_large_items_use_pool(self):
+        """Test that batch items past the time budget or pool get error lines"""
+        hard = (10**24 + 7) * (10**24 + 49)
+        easy = 1000000007 * 998244353
+        original = my_server.FACTOR_TIME_BUDGET
+        my_server.FACTOR_TIME_BUDGET = 0.2
+        try:
+            response = self.app.post('/factors/batch', json=[hard, easy, 12])
+            results = [json.loads(line) for line in response.data.decode().splitlines()]
+        finally:
+            my_server.FACTOR_TIME_BUDGET = original
+        self.assertEqual(results[0], {'number': hard,
+                                      'error': 'Factorization exceeded the time budget'})
+        self.assertEqual(results[1]['factors'], [1, 998244353, 1000000007])
+        self.assertEqual(results[2]['factors'], [1, 2, 2, 3])
+        
+        original = my_server.factor_pool
+        my_server.factor_pool = FactorPool(1, 0)
+        try:
+            response = self.app.post('/factors/batch', json=[2**61 - 1, easy])
+            results = [json.loads(line) for line in response.data.decode().splitlines()]
+        finally:
+            my_server.factor_pool = original
+        self.assertIn('busy', results[0]['error'])
+        self.assertEqual(results[1]['factors'], [1, 998244353, 1000000007])  # cached
+    
+    def test_factors_batch_newline_delimited(self):
+        """Test the /factors/batch endpoint with one number per line"""
+        response = self.app.post('/factors/batch', data='360\n\n15\n',
+                                 content_type='text/plain')
+        self.assertEqual(response.status_code, 200)
+        results = [json.loads(line) for line in response.data.decode().splitlines()]
+        self.assertEqual([r['factors'] for r in results], [[1, 2, 2, 2, 3, 3, 5], [1, 3, 5]])
+    
+    def test_factors_batch_error_cases(self):
+        """Test the /factors/batch endpoint with unusable bodies"""
+        response = self.app.post('/factors/batch', json={'number': 12})
+        self.assertEqual(response.status_code, 400)
+        
+        response = self.app.post('/factors/batch', json=[])
+        self.assertEqual(response.status_code, 400)
+        
+        response = self.app.post('/factors/batch', json=list(range(1, 10002)))
+        self.assertEqual(response.status_code, 413)
+    
     def test_factors_endpoint_error_cases(self):
         """Test the /factors endpoint with invalid inputs"""
         # Test missing parameter
@@ -1,5 +1,15 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
+import asyncio
+import json
 import logging
+import math
+import os
+import random
+import sqlite3
+import threading
+import time
+
+import httpx
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -9,11 +19,506 @@ app = Flask(__name__)
 
 # In-memory storage for subscribers
 subscribers = {}  # {name: url}
-published_subject = ""  # Current published subject
+subscriber_topics = {}  # {name: topic pattern}
+published_subject = ""  # Current published subject (any topic)
+subject_history = {}  # {topic: SubjectHistory}
+history_lock = threading.Lock()
+# {topic: [Condition, waiter count]}, only for topics that streams are waiting on
+topic_waiters = {}
+
+# Topic used when a publish does not name one, and the pattern used when a
+# subscriber does not name one ('#' matches every topic).
+DEFAULT_TOPIC = 'default'
+DEFAULT_PATTERN = '#'
+
+# Number of recent subjects kept per topic for GET /subject?since=...
+HISTORY_SIZE = int(os.environ.get('HISTORY_SIZE', 100))
+
+# Streaming: seconds between SSE keep-alive comments, seconds before a
+# stream is closed (clients reconnect with Last-Event-ID), and the
+# longest a long-poll request may wait.
+STREAM_HEARTBEAT = float(os.environ.get('STREAM_HEARTBEAT', 15.0))
+STREAM_MAX_DURATION = float(os.environ.get('STREAM_MAX_DURATION', 300.0))
+LONG_POLL_MAX_WAIT = float(os.environ.get('LONG_POLL_MAX_WAIT', 30.0))
+
+# Delivery settings: seconds allowed for each subscriber POST, total pooled
+# connections, concurrent connections allowed to any one host, and seconds
+# the pool may take to hand out a connection.
+DELIVERY_TIMEOUT = float(os.environ.get('DELIVERY_TIMEOUT', 5.0))
+DELIVERY_MAX_CONNECTIONS = int(os.environ.get('DELIVERY_MAX_CONNECTIONS', 1000))
+DELIVERY_MAX_PER_HOST = int(os.environ.get('DELIVERY_MAX_PER_HOST', 10))
+DELIVERY_POOL_TIMEOUT = float(os.environ.get('DELIVERY_POOL_TIMEOUT', 60.0))
+
+# Durable delivery queue: SQLite file, attempts before a delivery is
+# dead-lettered, and the exponential backoff between attempts (seconds).
+DELIVERY_QUEUE_PATH = os.environ.get(
+    'DELIVERY_QUEUE_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'delivery_queue.db'))
+DELIVERY_MAX_ATTEMPTS = int(os.environ.get('DELIVERY_MAX_ATTEMPTS', 8))
+DELIVERY_BACKOFF_BASE = float(os.environ.get('DELIVERY_BACKOFF_BASE', 1.0))
+DELIVERY_BACKOFF_MAX = float(os.environ.get('DELIVERY_BACKOFF_MAX', 300.0))
+DELIVERY_BATCH_SIZE = 500
+
+
+class DeliveryEngine:
+    """
+    Delivers published subjects to subscriber URLs concurrently.
+
+    Runs its own asyncio event loop in a daemon thread so that one pooled
+    httpx.AsyncClient, and its keep-alive connections, is shared by every
+    publish. A publish to N subscribers takes about as long as the slowest
+    one (bounded by the timeout), not the sum of all of them. Deliveries
+    queue for a host slot and a pooled connection before their timeout
+    starts, so a busy pool does not time out healthy subscribers.
+    """
+
+    def __init__(self, timeout=DELIVERY_TIMEOUT, max_connections=DELIVERY_MAX_CONNECTIONS,
+                 max_per_host=DELIVERY_MAX_PER_HOST, pool_timeout=DELIVERY_POOL_TIMEOUT,
+                 transport=None):
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.max_per_host = max_per_host
+        self.pool_timeout = pool_timeout
+        self.transport = transport
+        self._loop = None
+        self._client = None
+        self._host_limits = {}  # {host: asyncio.Semaphore}
+        self._connections = None  # asyncio.Semaphore(max_connections)
+        self._lock = threading.Lock()
+
+    def _start(self):
+        """Start the event loop thread and HTTP client on first use."""
+        with self._lock:
+            if self._loop is not None:
+                return
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name='delivery-loop', daemon=True).start()
+            limits = httpx.Limits(max_connections=self.max_connections,
+                                  max_keepalive_connections=self.max_connections)
+            timeout = httpx.Timeout(self.timeout, pool=self.pool_timeout)
+            self._client = httpx.AsyncClient(limits=limits, timeout=timeout,
+                                             transport=self.transport)
+            self._connections = asyncio.Semaphore(self.max_connections)
+            self._loop = loop
+
+    async def _deliver_one(self, key, url, payload):
+        """POST the payload to one subscriber. Returns (key, error or None)."""
+        try:
+            host = httpx.URL(url).host
+            limit = self._host_limits.setdefault(host, asyncio.Semaphore(self.max_per_host))
+            # Waiting for a connection is bounded by the pool timeout, not
+            # by this subscriber's deadline, which covers only the request
+            async with limit, self._connections:
+                response = await asyncio.wait_for(
+                    self._client.post(url, json=payload), self.timeout)
+            if response.is_success:
+                return key, None
+            return key, f'HTTP {response.status_code}'
+        except asyncio.TimeoutError:
+            return key, 'timed out'
+        except (httpx.HTTPError, httpx.InvalidURL) as e:
+            return key, str(e) or type(e).__name__
+
+    async def _deliver_all(self, jobs):
+        return await asyncio.gather(
+            *(self._deliver_one(key, url, payload) for key, url, payload in jobs))
+
+    def deliver(self, jobs):
+        """
+        POST each (key, url, payload) in jobs concurrently and wait for all.
+        Returns {key: error} for the deliveries that failed.
+        """
+        if not jobs:
+            return {}
+        self._start()
+        future = asyncio.run_coroutine_threadsafe(self._deliver_all(jobs), self._loop)
+        return {key: error for key, error in future.result() if error is not None}
+
+    def max_duration(self, count):
+        """
+        Longest deliver() can take for count jobs: all to one host, sent
+        max_per_host at a time, each wave running to the timeout.
+        """
+        return math.ceil(count / self.max_per_host) * self.timeout
+
+    def close(self):
+        """Close the HTTP client and stop the event loop."""
+        with self._lock:
+            loop, client = self._loop, self._client
+            self._loop = self._client = None
+            self._host_limits = {}
+        if loop is not None:
+            asyncio.run_coroutine_threadsafe(client.aclose(), loop).result()
+            loop.call_soon_threadsafe(loop.stop)
+
+
+delivery_engine = DeliveryEngine()
+
+
+def is_valid_topic(topic):
+    """Topics are dot-separated, non-empty segments without wildcards."""
+    if not isinstance(topic, str):
+        return False
+    return all(segment and segment not in ('*', '#') for segment in topic.split('.'))
+
+
+def is_valid_url(url):
+    """Subscriber URLs are absolute http(s) URLs with a host."""
+    if not isinstance(url, str):
+        return False
+    try:
+        parsed = httpx.URL(url)
+    except httpx.InvalidURL:
+        return False
+    return parsed.scheme in ('http', 'https') and bool(parsed.host)
+
+
+def is_valid_pattern(pattern):
+    """Patterns may use '*' for any one segment and a final '#' for the rest."""
+    if not isinstance(pattern, str):
+        return False
+    segments = pattern.split('.')
+    return all(segments) and '#' not in segments[:-1]
+
+
+class TopicIndex:
+    """
+    Trie of subscription patterns, one level per topic segment.
+
+    '*' matches exactly one segment and a trailing '#' matches zero or more.
+    Matching only walks branches the topic can reach, so resolving a
+    publish costs time in proportion to the matching subscriptions rather
+    than to every subscriber.
+    """
+
+    class _Node:
+        __slots__ = ('children', 'names')
+
+        def __init__(self):
+            self.children = {}  # {segment: _Node}
+            self.names = set()  # subscribers whose pattern ends here
+
+    def __init__(self):
+        self._root = self._Node()
+
+    def add(self, pattern, name):
+        node = self._root
+        for segment in pattern.split('.'):
+            node = node.children.setdefault(segment, self._Node())
+        node.names.add(name)
+
+    def remove(self, pattern, name):
+        path = [self._root]
+        for segment in pattern.split('.'):
+            node = path[-1].children.get(segment)
+            if node is None:
+                return
+            path.append(node)
+        path[-1].names.discard(name)
+        # Prune branches left empty
+        for parent, segment in zip(reversed(path[:-1]), reversed(pattern.split('.'))):
+            child = parent.children[segment]
+            if child.names or child.children:
+                break
+            del parent.children[segment]
+
+    def match(self, topic):
+        """Return the names of subscribers whose pattern matches topic."""
+        segments = topic.split('.')
+        matched = set()
+        stack = [(self._root, 0)]
+        while stack:
+            node, depth = stack.pop()
+            rest = node.children.get('#')
+            if rest is not None:
+                matched |= rest.names
+            if depth == len(segments):
+                matched |= node.names
+                continue
+            for key in (segments[depth], '*'):
+                child = node.children.get(key)
+                if child is not None:
+                    stack.append((child, depth + 1))
+        return matched
+
+
+topic_index = TopicIndex()
+
+
+class SubjectHistory:
+    """
+    Fixed-size ring buffer of a topic's most recent subjects.
+
+    Every subject gets the next offset (starting at 1), so a consumer can
+    remember the last offset it saw and later fetch everything newer in a
+    single read. Once the buffer is full the oldest subjects are
+    overwritten.
+    """
+
+    def __init__(self, capacity=None):
+        self.capacity = capacity or HISTORY_SIZE
+        self._entries = [None] * self.capacity  # (offset, subject, published_at)
+        self.last_offset = 0
+
+    def append(self, subject):
+        """Store a subject and return its offset."""
+        self.last_offset += 1
+        self._entries[self.last_offset % self.capacity] = (self.last_offset, subject, time.time())
+        return self.last_offset
+
+    @property
+    def first_offset(self):
+        """Offset of the oldest subject still retained."""
+        return max(1, self.last_offset - self.capacity + 1)
+
+    def latest(self):
+        if self.last_offset == 0:
+            return ''
+        return self._entries[self.last_offset % self.capacity][1]
+
+    def since(self, offset):
+        """Return the retained subjects with an offset greater than offset, oldest first."""
+        start = max(offset + 1, self.first_offset)
+        return [
+            {'offset': entry[0], 'subject': entry[1], 'published_at': entry[2]}
+            for entry in (self._entries[o % self.capacity] for o in range(start, self.last_offset + 1))
+        ]
+
+
+class DeliveryQueue:
+    """
+    Persistent queue of pending subscriber deliveries, stored in SQLite.
+
+    Every publish records one delivery row per subscriber. Failed rows are
+    retried with exponential backoff and moved to the subscriber's
+    dead-letter list after DELIVERY_MAX_ATTEMPTS. Rows survive restarts,
+    so delivery is at-least-once.
+    """
+
+    def __init__(self, path=DELIVERY_QUEUE_PATH, max_attempts=DELIVERY_MAX_ATTEMPTS,
+                 backoff_base=DELIVERY_BACKOFF_BASE, backoff_max=DELIVERY_BACKOFF_MAX):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._lock = threading.Lock()
+        self._conn = None
+
+    @property
+    def _db(self):
+        """The SQLite connection, opened (and the schema created) on first use."""
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._create_schema()
+        return self._conn
+
+    def _create_schema(self):
+        self._conn.executescript('''
+            CREATE TABLE IF NOT EXISTS publishes (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                topic TEXT NOT NULL DEFAULT 'default',
+                subject TEXT NOT NULL,
+                created REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS deliveries (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                publish_id INTEGER NOT NULL REFERENCES publishes(id),
+                subscriber TEXT NOT NULL,
+                url TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt REAL NOT NULL,
+                last_error TEXT
+            );
+            CREATE INDEX IF NOT EXISTS deliveries_due ON deliveries (status, next_attempt);
+            CREATE INDEX IF NOT EXISTS deliveries_subscriber ON deliveries (subscriber, status);
+        ''')
+        # Queue files written before topics existed
+        columns = [row[1] for row in self._conn.execute('PRAGMA table_info(publishes)')]
+        if 'topic' not in columns:
+            self._conn.execute("ALTER TABLE publishes ADD COLUMN topic TEXT NOT NULL DEFAULT 'default'")
+        # Subjects are stored as JSON; older queue files hold them as plain text
+        if self._conn.execute('PRAGMA user_version').fetchone()[0] < 1:
+            self._conn.execute('UPDATE publishes SET subject = json_quote(subject)')
+            self._conn.execute('PRAGMA user_version = 1')
+
+    def enqueue(self, topic, subject, targets):
+        """
+        Record a publish and one pending delivery per (name, url). The
+        subject can be any JSON value. Returns the publish id.
+        """
+        now = time.time()
+        with self._lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                publish_id = self._db.execute(
+                    'INSERT INTO publishes (topic, subject, created) VALUES (?, ?, ?)',
+                    (topic, json.dumps(subject), now)).lastrowid
+                self._db.executemany(
+                    'INSERT INTO deliveries (publish_id, subscriber, url, next_attempt) VALUES (?, ?, ?, ?)',
+                    [(publish_id, name, url, now) for name, url in targets])
+                self._db.execute('COMMIT')
+            except BaseException:
+                self._db.execute('ROLLBACK')
+                raise
+        return publish_id
+
+    def claim_due(self, limit, lease, due_by=None):
+        """
+        Return up to limit deliveries due by due_by (default: now) as
+        (id, url, topic, subject, attempts) and push their next attempt lease
+        seconds ahead, so another worker sharing the file does not send
+        them at the same time.
+        """
+        now = time.time()
+        if due_by is None:
+            due_by = now
+        with self._lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                rows = self._db.execute('''
+                    SELECT d.id, d.url, p.topic, p.subject, d.attempts
+                    FROM deliveries d JOIN publishes p ON p.id = d.publish_id
+                    WHERE d.status = 'pending' AND d.next_attempt <= ?
+                    ORDER BY d.next_attempt LIMIT ?
+                ''', (due_by, limit)).fetchall()
+                self._db.executemany('UPDATE deliveries SET next_attempt = ? WHERE id = ?',
+                                     [(now + lease, row[0]) for row in rows])
+                self._db.execute('COMMIT')
+            except BaseException:
+                self._db.execute('ROLLBACK')
+                raise
+        return [(delivery_id, url, topic, json.loads(subject), attempts)
+                for delivery_id, url, topic, subject, attempts in rows]
+
+    def backoff(self, attempts):
+        """Delay before retry number attempts, with jitter."""
+        delay = min(self.backoff_base * 2 ** (attempts - 1), self.backoff_max)
+        return delay * random.uniform(0.5, 1.0)
+
+    def record_results(self, rows, failed):
+        """Mark claimed rows delivered, or schedule a retry / dead-letter them."""
+        now = time.time()
+        updates = []
+        for delivery_id, _, _, _, attempts in rows:
+            attempts += 1
+            error = failed.get(delivery_id)
+            if error is None:
+                updates.append(('delivered', attempts, now, None, delivery_id))
+            elif attempts >= self.max_attempts:
+                updates.append(('dead', attempts, now, error, delivery_id))
+            else:
+                updates.append(('pending', attempts, now + self.backoff(attempts), error, delivery_id))
+        with self._lock:
+            self._db.executemany(
+                'UPDATE deliveries SET status = ?, attempts = ?, next_attempt = ?, last_error = ? WHERE id = ?',
+                updates)
+
+    def cancel_subscriber(self, name):
+        """Drop pending deliveries for a subscriber that was removed."""
+        with self._lock:
+            self._db.execute(
+                "UPDATE deliveries SET status = 'cancelled' WHERE subscriber = ? AND status = 'pending'",
+                (name,))
+
+    def publish_status(self, publish_id):
+        """Per-subscriber delivery state of one publish, or None if unknown."""
+        with self._lock:
+            publish = self._db.execute(
+                'SELECT topic, subject FROM publishes WHERE id = ?', (publish_id,)).fetchone()
+            if publish is None:
+                return None
+            rows = self._db.execute(
+                'SELECT subscriber, status, attempts, last_error FROM deliveries WHERE publish_id = ?',
+                (publish_id,)).fetchall()
+        return {
+            'publish_id': publish_id,
+            'topic': publish[0],
+            'subject': json.loads(publish[1]),
+            'deliveries': {name: {'status': status, 'attempts': attempts, 'last_error': error}
+                           for name, status, attempts, error in rows}
+        }
+
+    def dead_letters(self, name):
+        """Deliveries to a subscriber that exhausted their retries."""
+        with self._lock:
+            rows = self._db.execute('''
+                SELECT d.publish_id, p.topic, p.subject, d.attempts, d.last_error
+                FROM deliveries d JOIN publishes p ON p.id = d.publish_id
+                WHERE d.subscriber = ? AND d.status = 'dead' ORDER BY d.id
+            ''', (name,)).fetchall()
+        return [{'publish_id': publish_id, 'topic': topic, 'subject': json.loads(subject),
+                 'attempts': attempts, 'last_error': error}
+                for publish_id, topic, subject, attempts, error in rows]
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+class DeliveryWorker:
+    """
+    Background thread that drains the delivery queue through the engine.
+    Sleeps until woken by a publish or until the next retry may be due.
+    """
+
+    def __init__(self, queue, engine, poll_interval=1.0, autostart=True):
+        self.queue = queue
+        self.engine = engine
+        self.poll_interval = poll_interval
+        self.autostart = autostart
+        self._wake = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def run_once(self):
+        """
+        Send every delivery due when the pass starts, in batches; retries
+        scheduled during the pass wait for the next one. Returns how many
+        deliveries were attempted.
+        """
+        started = time.time()
+        attempted = 0
+        # Hold the rows until the whole batch could have been sent, plus one
+        # timeout of slack, so no other worker picks them up mid-batch
+        lease = self.engine.max_duration(DELIVERY_BATCH_SIZE) + self.engine.timeout
+        while True:
+            rows = self.queue.claim_due(DELIVERY_BATCH_SIZE, lease=lease, due_by=started)
+            if not rows:
+                return attempted
+            failed = self.engine.deliver(
+                [(delivery_id, url, {'topic': topic, 'subject': subject})
+                 for delivery_id, url, topic, subject, _ in rows])
+            self.queue.record_results(rows, failed)
+            attempted += len(rows)
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+            try:
+                self.run_once()
+            except Exception:
+                logger.exception("Delivery worker pass failed")
+
+    def notify(self):
+        """Wake the worker, starting it on first use."""
+        if self.autostart and self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='delivery-worker', daemon=True)
+                    self._thread.start()
+        self._wake.set()
+
+
+delivery_queue = DeliveryQueue()
+delivery_worker = DeliveryWorker(delivery_queue, delivery_engine)
 
 @app.route('/subscribers', methods=['POST'])
 def add_subscriber():
-    """Add a new subscriber with name and URL."""
+    """Add a new subscriber with name, URL and optional topic pattern."""
     data = request.get_json()
     
     if not data or 'name' not in data or 'url' not in data:
@@ -21,12 +526,25 @@ def add_subscriber():
     
     name = data['name']
     url = data['url']
+    pattern = data.get('topic', DEFAULT_PATTERN)
+    
+    if not is_valid_pattern(pattern):
+        return jsonify({'error': f'Invalid topic pattern: {pattern}'}), 400
+    
+    # Names are path segments in the other endpoints, and are sorted on publish
+    if not isinstance(name, str) or not name:
+        return jsonify({'error': 'Name must be a non-empty string'}), 400
+    
+    if not is_valid_url(url):
+        return jsonify({'error': f'Invalid URL: {url}'}), 400
     
     if name in subscribers:
         return jsonify({'error': f'Subscriber {name} already exists'}), 409
     
     subscribers[name] = url
-    logger.info(f"Added subscriber: {name} -> {url}")
+    subscriber_topics[name] = pattern
+    topic_index.add(pattern, name)
+    logger.info(f"Added subscriber: {name} -> {url} ({pattern})")
     
     return jsonify({'message': f'Subscriber {name} added successfully'}), 201
 
@@ -37,51 +555,210 @@ def delete_subscriber(name):
         return jsonify({'error': f'Subscriber {name} not found'}), 404
     
     url = subscribers.pop(name)
+    topic_index.remove(subscriber_topics.pop(name), name)
+    delivery_queue.cancel_subscriber(name)
     logger.info(f"Deleted subscriber: {name} -> {url}")
     
     return jsonify({'message': f'Subscriber {name} deleted successfully'}), 200
 
 @app.route('/subscribers', methods=['GET'])
 def list_subscribers():
-    """Return a list of all subscribers and their URLs."""
-    return jsonify({'subscribers': subscribers}), 200
+    """Return a list of all subscribers, their URLs and topic patterns."""
+    return jsonify({'subscribers': subscribers, 'topics': subscriber_topics}), 200
+
+@app.route('/subscribers/<name>/dead-letters', methods=['GET'])
+def list_dead_letters(name):
+    """Return the publishes that could not be delivered to a subscriber."""
+    return jsonify({'subscriber': name, 'dead_letters': delivery_queue.dead_letters(name)}), 200
 
 @app.route('/publish', methods=['POST'])
 def publish_subject():
-    """Update the published subject and notify all subscribers."""
+    """Update a topic's subject and queue it for delivery to its subscribers."""
     data = request.get_json()
     
     if not data or 'subject' not in data:
         return jsonify({'error': 'Subject is required'}), 400
     
-    global published_subject
-    published_subject = data['subject']
+    topic = data.get('topic', DEFAULT_TOPIC)
+    if not is_valid_topic(topic):
+        return jsonify({'error': f'Invalid topic: {topic}'}), 400
+    
+    subject = data['subject']
+    
+    # Notify matching subscribers (print statements as specified)
+    logger.info(f"Publishing subject to {topic}: {subject}")
+    print(f"\n=== PUBLISHING SUBJECT ({topic}): {subject} ===")
     
-    # Notify all subscribers (print statements as specified)
-    logger.info(f"Publishing subject: {published_subject}")
-    print(f"\n=== PUBLISHING SUBJECT: {published_subject} ===")
+    # Deliveries are recorded durably and sent by the background worker,
+    # so the response does not wait on subscriber health. They are recorded
+    # first, so a publish that fails here leaves no trace in the history.
+    targets = [(name, subscribers[name]) for name in sorted(topic_index.match(topic))]
+    publish_id = delivery_queue.enqueue(topic, subject, targets)
     
-    if not subscribers:
+    global published_subject
+    with history_lock:
+        published_subject = subject
+        history = subject_history.get(topic)
+        if history is None:
+            history = subject_history[topic] = SubjectHistory()
+        offset = history.append(subject)
+        waiting = topic_waiters.get(topic)
+        if waiting is not None:
+            waiting[0].notify_all()
+    
+    if not targets:
         print("No subscribers to notify.")
         logger.info("No subscribers to notify")
     else:
-        print(f"Notifying {len(subscribers)} subscriber(s):")
-        for name, url in subscribers.items():
+        print(f"Queued delivery to {len(targets)} subscriber(s):")
+        for name, url in targets:
             print(f"  - Notifying {name} at {url}")
-            logger.info(f"Notified subscriber: {name} at {url}")
+        delivery_worker.notify()
     
-    print("=== NOTIFICATION COMPLETE ===\n")
+    print("=== NOTIFICATION QUEUED ===\n")
     
     return jsonify({
         'message': 'Subject published successfully',
-        'subject': published_subject,
-        'subscribers_notified': len(subscribers)
+        'topic': topic,
+        'subject': subject,
+        'offset': offset,
+        'publish_id': publish_id,
+        'subscribers_notified': len(targets)
     }), 200
 
+@app.route('/publish/<int:publish_id>', methods=['GET'])
+def get_publish_status(publish_id):
+    """Return the delivery state of a publish for each subscriber."""
+    status = delivery_queue.publish_status(publish_id)
+    if status is None:
+        return jsonify({'error': f'Publish {publish_id} not found'}), 404
+    return jsonify(status), 200
+
 @app.route('/subject', methods=['GET'])
 def get_subject():
-    """Get the current published subject."""
-    return jsonify({'subject': published_subject}), 200
+    """
+    Get the current subject of ?topic=..., or the latest on any topic.
+    With ?since=<offset>, also return every retained subject of the topic
+    (default topic if none is given) newer than that offset.
+    """
+    topic = request.args.get('topic')
+    since = request.args.get('since')
+    if topic is None and since is None:
+        return jsonify({'subject': published_subject}), 200
+    
+    topic = topic or DEFAULT_TOPIC
+    if not is_valid_topic(topic):
+        return jsonify({'error': f'Invalid topic: {topic}'}), 400
+    
+    with history_lock:
+        history = subject_history.get(topic) or SubjectHistory(1)
+        body = {'topic': topic, 'subject': history.latest(), 'last_offset': history.last_offset}
+        if since is not None:
+            try:
+                since = int(since)
+            except ValueError:
+                return jsonify({'error': 'since must be an integer offset'}), 400
+            body['subjects'] = history.since(since)
+            # Older subjects than the client asked for were overwritten
+            body['truncated'] = since + 1 < history.first_offset
+    return jsonify(body), 200
+
+def wait_for_subjects(topic, since, timeout):
+    """
+    Block until topic has subjects newer than since, or timeout seconds pass.
+    Returns (subjects, last_offset, truncated) like GET /subject?since=...
+    """
+    deadline = time.monotonic() + timeout
+    with history_lock:
+        while True:
+            history = subject_history.get(topic)
+            last_offset = history.last_offset if history is not None else 0
+            if last_offset > since:
+                return history.since(since), last_offset, since + 1 < history.first_offset
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return [], last_offset, False
+            wait_for_publish(topic, remaining)
+
+
+def wait_for_publish(topic, timeout):
+    """
+    Wait until something is published on topic, or timeout seconds pass.
+    The caller holds history_lock. The topic's condition exists only
+    while someone waits on it, so streams of topics that nothing is
+    published to leave nothing behind.
+    """
+    waiting = topic_waiters.get(topic)
+    if waiting is None:
+        waiting = topic_waiters[topic] = [threading.Condition(history_lock), 0]
+    waiting[1] += 1
+    try:
+        waiting[0].wait(timeout)
+    finally:
+        waiting[1] -= 1
+        if not waiting[1]:
+            del topic_waiters[topic]
+
+
+def sse_events(topic, since):
+    """Yield Server-Sent Events for each subject published on topic after since."""
+    # Clients reconnect after this many milliseconds if the stream drops
+    yield 'retry: 3000\n\n'
+    cursor = since
+    deadline = time.monotonic() + STREAM_MAX_DURATION
+    while time.monotonic() < deadline:
+        subjects, _, _ = wait_for_subjects(topic, cursor, STREAM_HEARTBEAT)
+        if not subjects:
+            yield ': keep-alive\n\n'
+            continue
+        for entry in subjects:
+            data = json.dumps({'topic': topic, 'subject': entry['subject'], 'offset': entry['offset']})
+            yield f"id: {entry['offset']}\nevent: subject\ndata: {data}\n\n"
+        cursor = subjects[-1]['offset']
+
+
+@app.route('/stream', methods=['GET'])
+def stream_subjects():
+    """
+    Push each new subject of ?topic=... to the client as it is published.
+    Serves Server-Sent Events by default; with ?mode=poll, waits up to
+    ?timeout=... seconds for something newer than ?since=... and returns it
+    as JSON (long-poll fallback). SSE clients resume from Last-Event-ID.
+    """
+    topic = request.args.get('topic') or DEFAULT_TOPIC
+    if not is_valid_topic(topic):
+        return jsonify({'error': f'Invalid topic: {topic}'}), 400
+    
+    since = request.headers.get('Last-Event-ID') or request.args.get('since')
+    try:
+        if since is None:
+            # New streams start from the current end of the topic
+            with history_lock:
+                history = subject_history.get(topic)
+                since = history.last_offset if history is not None else 0
+        since = int(since)
+        timeout = float(request.args.get('timeout', LONG_POLL_MAX_WAIT))
+    except ValueError:
+        return jsonify({'error': 'since and timeout must be numbers'}), 400
+    # nan would never count down to the deadline
+    if not math.isfinite(timeout) or timeout < 0:
+        return jsonify({'error': 'timeout must be a non-negative number of seconds'}), 400
+    timeout = min(timeout, LONG_POLL_MAX_WAIT)
+    
+    if request.args.get('mode') == 'poll':
+        subjects, last_offset, truncated = wait_for_subjects(topic, since, timeout)
+        return jsonify({
+            'topic': topic,
+            'subjects': subjects,
+            'last_offset': last_offset,
+            'truncated': truncated
+        }), 200
+    
+    response = Response(sse_events(topic, since), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # Stop reverse proxies from buffering the stream
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
 
 @app.route('/', methods=['GET'])
 def health_check():
@@ -99,8 +776,14 @@ if __name__ == '__main__':
     print("  DELETE /subscribers/<name> - Delete a subscriber")
     print("  GET /subscribers - List all subscribers")
     print("  POST /publish - Publish a subject and notify subscribers")
-    print("  GET /subject - Get current subject")
+    print("  GET /publish/<id> - Get delivery status of a publish")
+    print("  GET /subscribers/<name>/dead-letters - List undeliverable publishes")
+    print("  GET /subject?topic=<topic>&since=<offset> - Get current and recent subjects of a topic")
+    print("  GET /stream?topic=<topic> - Stream new subjects (SSE, or long-poll with mode=poll)")
     print("  GET / - Health check")
     print("\nServer running on http://localhost:5000")
     
+    # Resume deliveries left pending by a previous run
+    delivery_worker.notify()
+    
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
@@ -1,17 +1,52 @@
 import pytest
+import asyncio
 import json
+import sqlite3
+import threading
+import time
+import httpx
+import app as pubsub
 from app import app
 
+# Requests received by the mock subscriber endpoints
+received = []
+
+async def mock_subscriber(request):
+    """Stand-in for subscriber webhooks; misbehaves based on the host."""
+    received.append(request)
+    if request.url.host == 'slow.example.com':
+        await asyncio.sleep(0.2)
+    elif request.url.host == 'hung.example.com':
+        await asyncio.sleep(30)
+    elif request.url.host == 'broken.example.com':
+        return httpx.Response(500)
+    elif request.url.host == 'down.example.com':
+        raise httpx.ConnectError('Connection refused', request=request)
+    return httpx.Response(200)
+
 @pytest.fixture
-def client():
+def client(monkeypatch):
     """Create a test client for the Flask application."""
     app.config['TESTING'] = True
+    received.clear()
+    # Deliver to mock subscribers instead of the network, from an in-memory
+    # queue that the tests drain explicitly
+    engine = pubsub.DeliveryEngine(timeout=1.0, transport=httpx.MockTransport(mock_subscriber))
+    queue = pubsub.DeliveryQueue(':memory:', max_attempts=3, backoff_base=0)
+    monkeypatch.setattr(pubsub, 'delivery_engine', engine)
+    monkeypatch.setattr(pubsub, 'delivery_queue', queue)
+    monkeypatch.setattr(pubsub, 'delivery_worker', pubsub.DeliveryWorker(queue, engine, autostart=False))
+    monkeypatch.setattr(pubsub, 'topic_index', pubsub.TopicIndex())
+    pubsub.subscriber_topics.clear()
+    pubsub.subject_history.clear()
     with app.test_client() as client:
         with app.app_context():
             # Clear subscribers before each test
             from app import subscribers
             subscribers.clear()
             yield client
+    engine.close()
+    queue.close()
 
 def test_health_check(client):
     """Test the health check endpoint."""
@@ -51,6 +86,23 @@ def test_add_subscriber_missing_data(client):
                           data=json.dumps(subscriber_data),
                           content_type='application/json')
     assert response.status_code == 400
+    
+    # Test URLs that could never be delivered to
+    for url in [42, ['http://example.com'], 'example.com/webhook', 'ftp://example.com', 'http://']:
+        subscriber_data = {'name': 'test_subscriber', 'url': url}
+        response = client.post('/subscribers',
+                              data=json.dumps(subscriber_data),
+                              content_type='application/json')
+        assert response.status_code == 400
+    
+    # Test names that are not strings
+    for name in [1, '', None, ['a']]:
+        subscriber_data = {'name': name, 'url': 'http://example.com/webhook'}
+        response = client.post('/subscribers',
+                              data=json.dumps(subscriber_data),
+                              content_type='application/json')
+        assert response.status_code == 400
+    assert pubsub.subscribers == {}
 
 def test_add_duplicate_subscriber(client):
     """Test adding a duplicate subscriber."""
@@ -152,6 +204,213 @@ def test_publish_subject_success(client):
     assert data['subject'] == 'Test Subject'
     assert data['subscribers_notified'] == 2
 
+def test_publish_delivers_subject(client):
+    """Test that publishing POSTs the subject to every subscriber URL."""
+    for name in ['alice', 'bob']:
+        client.post('/subscribers',
+                   data=json.dumps({'name': name, 'url': f'http://{name}.example.com/hook'}),
+                   content_type='application/json')
+    
+    response = client.post('/publish',
+                          data=json.dumps({'subject': 'Delivered'}),
+                          content_type='application/json')
+    
+    assert response.status_code == 200
+    publish_id = json.loads(response.data)['publish_id']
+    # Nothing is sent on the request thread
+    assert received == []
+    
+    assert pubsub.delivery_worker.run_once() == 2
+    assert sorted(str(r.url) for r in received) == [
+        'http://alice.example.com/hook', 'http://bob.example.com/hook']
+    assert all(json.loads(r.content) == {'topic': 'default', 'subject': 'Delivered'} for r in received)
+    
+    response = client.get(f'/publish/{publish_id}')
+    assert response.status_code == 200
+    deliveries = json.loads(response.data)['deliveries']
+    assert {name: d['status'] for name, d in deliveries.items()} == {
+        'alice': 'delivered', 'bob': 'delivered'}
+
+def test_publish_status_not_found(client):
+    """Test getting the status of an unknown publish."""
+    response = client.get('/publish/12345')
+    assert response.status_code == 404
+
+def test_publish_reports_failed_subscribers(client):
+    """Test that unreachable, erroring and hung subscribers are reported."""
+    subscribers_to_add = [
+        {'name': 'ok', 'url': 'http://ok.example.com'},
+        {'name': 'broken', 'url': 'http://broken.example.com'},
+        {'name': 'down', 'url': 'http://down.example.com'},
+        {'name': 'hung', 'url': 'http://hung.example.com'}
+    ]
+    for subscriber in subscribers_to_add:
+        client.post('/subscribers',
+                   data=json.dumps(subscriber),
+                   content_type='application/json')
+    
+    response = client.post('/publish',
+                          data=json.dumps({'subject': 'Partial'}),
+                          content_type='application/json')
+    assert response.status_code == 200
+    publish_id = json.loads(response.data)['publish_id']
+    
+    start = time.monotonic()
+    pubsub.delivery_worker.run_once()
+    elapsed = time.monotonic() - start
+    # The hung subscriber costs one timeout, not its full 30 seconds
+    assert elapsed < 5
+    
+    deliveries = json.loads(client.get(f'/publish/{publish_id}').data)['deliveries']
+    assert deliveries['ok']['status'] == 'delivered'
+    for name in ['broken', 'down', 'hung']:
+        assert deliveries[name]['status'] == 'pending'
+        assert deliveries[name]['attempts'] == 1
+        assert deliveries[name]['last_error']
+
+def test_failed_deliveries_are_retried_then_dead_lettered(client):
+    """Test that retries stop after the attempt limit and land in dead letters."""
+    client.post('/subscribers',
+               data=json.dumps({'name': 'broken', 'url': 'http://broken.example.com'}),
+               content_type='application/json')
+    client.post('/publish',
+               data=json.dumps({'subject': 'Undeliverable'}),
+               content_type='application/json')
+    
+    # The test queue allows 3 attempts with no backoff delay
+    for _ in range(5):
+        pubsub.delivery_worker.run_once()
+    assert len(received) == 3
+    
+    response = client.get('/subscribers/broken/dead-letters')
+    assert response.status_code == 200
+    dead = json.loads(response.data)['dead_letters']
+    assert len(dead) == 1
+    assert dead[0]['subject'] == 'Undeliverable'
+    assert dead[0]['attempts'] == 3
+    assert dead[0]['last_error'] == 'HTTP 500'
+
+def test_deleted_subscriber_deliveries_cancelled(client):
+    """Test that pending deliveries to a deleted subscriber are dropped."""
+    client.post('/subscribers',
+               data=json.dumps({'name': 'gone', 'url': 'http://gone.example.com'}),
+               content_type='application/json')
+    client.post('/publish',
+               data=json.dumps({'subject': 'Never sent'}),
+               content_type='application/json')
+    client.delete('/subscribers/gone')
+    
+    assert pubsub.delivery_worker.run_once() == 0
+    assert received == []
+
+def test_delivery_queue_survives_restart(tmp_path):
+    """Test that pending deliveries are read back from the queue file."""
+    path = str(tmp_path / 'queue.db')
+    queue = pubsub.DeliveryQueue(path)
+    publish_id = queue.enqueue('news', 'Persisted', [('alice', 'http://alice.example.com')])
+    queue.close()
+    
+    reopened = pubsub.DeliveryQueue(path)
+    rows = reopened.claim_due(10, lease=60)
+    assert [(url, topic, subject) for _, url, topic, subject, _ in rows] == [
+        ('http://alice.example.com', 'news', 'Persisted')]
+    # Claimed rows are leased and not handed out twice
+    assert reopened.claim_due(10, lease=60) == []
+    assert reopened.publish_status(publish_id)['deliveries']['alice']['status'] == 'pending'
+    reopened.close()
+
+def test_publish_any_json_subject(client, monkeypatch):
+    """Test that non-string subjects are queued and delivered as JSON, and failed publishes leave no history."""
+    client.post('/subscribers',
+               data=json.dumps({'name': 'alice', 'url': 'http://alice.example.com/hook'}),
+               content_type='application/json')
+    for subject in [{'title': 'Structured', 'tags': ['a', 'b']}, [1, 2], None]:
+        received.clear()
+        response = client.post('/publish', data=json.dumps({'subject': subject}),
+                              content_type='application/json')
+        assert response.status_code == 200
+        publish_id = json.loads(response.data)['publish_id']
+        pubsub.delivery_worker.run_once()
+        assert json.loads(received[0].content) == {'topic': 'default', 'subject': subject}
+        assert json.loads(client.get(f'/publish/{publish_id}').data)['subject'] == subject
+    
+    def broken_enqueue(topic, subject, targets):
+        raise sqlite3.OperationalError('disk I/O error')
+    monkeypatch.setattr(pubsub.delivery_queue, 'enqueue', broken_enqueue)
+    with pytest.raises(sqlite3.OperationalError):
+        client.post('/publish', data=json.dumps({'subject': 'Lost'}), content_type='application/json')
+    assert pubsub.subject_history['default'].last_offset == 3
+    assert pubsub.published_subject is None
+
+def test_delivery_queue_reads_plain_text_subjects(tmp_path):
+    """Test that a queue file from before JSON subjects is converted on open."""
+    path = str(tmp_path / 'queue.db')
+    queue = pubsub.DeliveryQueue(path)
+    queue.enqueue('news', 'Old', [('alice', 'http://alice.example.com')])
+    queue.close()
+    db = sqlite3.connect(path)
+    db.execute("UPDATE publishes SET subject = 'Old'")
+    db.execute('PRAGMA user_version = 0')
+    db.commit()
+    db.close()
+    
+    reopened = pubsub.DeliveryQueue(path)
+    assert [row[3] for row in reopened.claim_due(10, lease=60)] == ['Old']
+    reopened.close()
+
+def test_publish_delivers_concurrently(client):
+    """Test that slow subscribers are notified in parallel."""
+    for i in range(20):
+        client.post('/subscribers',
+                   data=json.dumps({'name': f'slow{i}', 'url': f'http://slow.example.com/{i}'}),
+                   content_type='application/json')
+    
+    client.post('/publish',
+               data=json.dumps({'subject': 'Fan-out'}),
+               content_type='application/json')
+    
+    start = time.monotonic()
+    assert pubsub.delivery_worker.run_once() == 20
+    elapsed = time.monotonic() - start
+    
+    assert len(received) == 20
+    # 20 x 0.2s sequentially would be 4s; at most 10 per host run at once
+    assert elapsed < 2
+
+def test_pool_wait_does_not_count_against_timeout():
+    """Test that deliveries waiting for a pooled connection are not timed out by it."""
+    engine = pubsub.DeliveryEngine(timeout=0.3, max_connections=2,
+                                   transport=httpx.MockTransport(mock_subscriber))
+    try:
+        start = time.monotonic()
+        failed = engine.deliver([(i, f'http://slow.example.com/{i}', {}) for i in range(6)])
+        elapsed = time.monotonic() - start
+    finally:
+        engine.close()
+    # Three waves of 0.2s through two connections; the last wave waits 0.4s first
+    assert failed == {}
+    assert elapsed >= 0.6
+
+def test_claim_lease_covers_whole_batch(client, monkeypatch):
+    """Test that claimed rows stay leased for as long as a full batch can take."""
+    leases = []
+    claim_due = pubsub.delivery_queue.claim_due
+    def recording_claim_due(limit, lease, due_by=None):
+        leases.append(lease)
+        return claim_due(limit, lease, due_by)
+    monkeypatch.setattr(pubsub.delivery_queue, 'claim_due', recording_claim_due)
+    
+    client.post('/subscribers',
+               data=json.dumps({'name': 'alice', 'url': 'http://example.com/alice'}),
+               content_type='application/json')
+    client.post('/publish', data=json.dumps({'subject': 'Leased'}), content_type='application/json')
+    assert pubsub.delivery_worker.run_once() == 1
+    
+    # 500 rows to one host, 10 at a time, each wave taking up to the 1s timeout
+    engine = pubsub.delivery_engine
+    assert engine.max_duration(pubsub.DELIVERY_BATCH_SIZE) == 50 * engine.timeout
+    assert leases and all(lease > 50 * engine.timeout for lease in leases)
+
 def test_publish_subject_no_subscribers(client):
     """Test publishing a subject with no subscribers."""
     subject_data = {'subject': 'Test Subject'}
@@ -185,6 +444,231 @@ def test_get_subject(client):
     assert 'subject' in data
     assert data['subject'] == 'Current Subject'
 
+def test_topic_index_matching():
+    """Test exact, single-segment and multi-segment pattern matching."""
+    index = pubsub.TopicIndex()
+    index.add('orders.new', 'exact')
+    index.add('orders.*', 'star')
+    index.add('orders.#', 'orders_all')
+    index.add('#', 'everything')
+    index.add('*.new', 'any_new')
+    
+    assert index.match('orders.new') == {'exact', 'star', 'orders_all', 'everything', 'any_new'}
+    assert index.match('orders.paid') == {'star', 'orders_all', 'everything'}
+    assert index.match('orders') == {'orders_all', 'everything'}
+    assert index.match('orders.new.eu') == {'orders_all', 'everything'}
+    assert index.match('users.new') == {'everything', 'any_new'}
+    
+    index.remove('orders.*', 'star')
+    index.remove('#', 'everything')
+    assert index.match('orders.paid') == {'orders_all'}
+    assert index.match('users.old') == set()
+
+def test_publish_routes_by_topic(client):
+    """Test that a publish only reaches subscribers of matching topics."""
+    subscribers_to_add = [
+        {'name': 'orders', 'url': 'http://orders.example.com', 'topic': 'orders.*'},
+        {'name': 'users', 'url': 'http://users.example.com', 'topic': 'users.created'},
+        {'name': 'audit', 'url': 'http://audit.example.com'}
+    ]
+    for subscriber in subscribers_to_add:
+        response = client.post('/subscribers',
+                              data=json.dumps(subscriber),
+                              content_type='application/json')
+        assert response.status_code == 201
+    
+    response = client.post('/publish',
+                          data=json.dumps({'topic': 'orders.paid', 'subject': 'Order 42 paid'}),
+                          content_type='application/json')
+    assert response.status_code == 200
+    data = json.loads(response.data)
+    assert data['topic'] == 'orders.paid'
+    assert data['subscribers_notified'] == 2
+    
+    pubsub.delivery_worker.run_once()
+    assert sorted(r.url.host for r in received) == ['audit.example.com', 'orders.example.com']
+    assert json.loads(received[0].content) == {'topic': 'orders.paid', 'subject': 'Order 42 paid'}
+
+def test_invalid_topics_rejected(client):
+    """Test that malformed topics and patterns are rejected."""
+    response = client.post('/subscribers',
+                          data=json.dumps({'name': 'bad', 'url': 'http://bad.example.com', 'topic': 'a.#.b'}),
+                          content_type='application/json')
+    assert response.status_code == 400
+    
+    response = client.post('/publish',
+                          data=json.dumps({'topic': 'orders.*', 'subject': 'Wildcard'}),
+                          content_type='application/json')
+    assert response.status_code == 400
+
+def test_get_subject_per_topic(client):
+    """Test that each topic keeps its own current subject."""
+    for topic, subject in [('orders.new', 'Order 1'), ('users.new', 'User 1')]:
+        client.post('/publish',
+                   data=json.dumps({'topic': topic, 'subject': subject}),
+                   content_type='application/json')
+    
+    assert json.loads(client.get('/subject?topic=orders.new').data)['subject'] == 'Order 1'
+    assert json.loads(client.get('/subject?topic=users.new').data)['subject'] == 'User 1'
+    assert json.loads(client.get('/subject?topic=unknown').data)['subject'] == ''
+    # Without a topic the latest subject on any topic is returned
+    assert json.loads(client.get('/subject').data)['subject'] == 'User 1'
+
+def test_subject_history_ring_buffer():
+    """Test offsets and overwriting in the subject ring buffer."""
+    history = pubsub.SubjectHistory(3)
+    assert history.latest() == ''
+    assert history.since(0) == []
+    
+    offsets = [history.append(f'S{i}') for i in range(1, 6)]
+    assert offsets == [1, 2, 3, 4, 5]
+    assert history.latest() == 'S5'
+    assert history.first_offset == 3
+    assert [e['subject'] for e in history.since(0)] == ['S3', 'S4', 'S5']
+    assert [e['offset'] for e in history.since(3)] == [4, 5]
+    assert history.since(5) == []
+
+def test_get_subject_since_offset(client):
+    """Test that a late consumer catches up with one read."""
+    offsets = []
+    for i in range(3):
+        response = client.post('/publish',
+                              data=json.dumps({'topic': 'news', 'subject': f'Story {i}'}),
+                              content_type='application/json')
+        offsets.append(json.loads(response.data)['offset'])
+    assert offsets == [1, 2, 3]
+    
+    response = client.get(f'/subject?topic=news&since={offsets[0]}')
+    assert response.status_code == 200
+    data = json.loads(response.data)
+    assert data['last_offset'] == 3
+    assert [s['subject'] for s in data['subjects']] == ['Story 1', 'Story 2']
+    assert data['truncated'] is False
+    
+    # Offsets are per topic
+    data = json.loads(client.get('/subject?topic=other&since=0').data)
+    assert data['subjects'] == []
+    assert data['last_offset'] == 0
+    
+    response = client.get('/subject?topic=news&since=abc')
+    assert response.status_code == 400
+
+def test_get_subject_since_reports_truncation(client, monkeypatch):
+    """Test that a consumer too far behind is told it missed subjects."""
+    monkeypatch.setattr(pubsub, 'HISTORY_SIZE', 2)
+    for i in range(4):
+        client.post('/publish',
+                   data=json.dumps({'subject': f'Update {i}'}),
+                   content_type='application/json')
+    
+    data = json.loads(client.get('/subject?since=0').data)
+    assert data['topic'] == 'default'
+    assert [s['offset'] for s in data['subjects']] == [3, 4]
+    assert data['truncated'] is True
+
+def publish_later(topic, subject, delay=0.2):
+    """Publish from another thread after a delay, like a separate client would."""
+    def run():
+        time.sleep(delay)
+        app.test_client().post('/publish',
+                               data=json.dumps({'topic': topic, 'subject': subject}),
+                               content_type='application/json')
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread
+
+def test_stream_sse_pushes_new_subjects(client):
+    """Test that an SSE stream replays from an offset and pushes live publishes."""
+    client.post('/publish',
+               data=json.dumps({'topic': 'news', 'subject': 'Old story'}),
+               content_type='application/json')
+    
+    response = client.get('/stream?topic=news&since=0', buffered=False)
+    assert response.status_code == 200
+    assert response.mimetype == 'text/event-stream'
+    events = iter(response.response)
+    assert next(events).startswith(b'retry:')
+    
+    first = next(events).decode()
+    assert first.startswith('id: 1\nevent: subject\n')
+    assert json.loads(first.split('data: ')[1])['subject'] == 'Old story'
+    
+    thread = publish_later('news', 'Breaking story')
+    live = next(events).decode()
+    thread.join()
+    assert live.startswith('id: 2\n')
+    assert json.loads(live.split('data: ')[1]) == {'topic': 'news', 'subject': 'Breaking story', 'offset': 2}
+    response.close()
+
+def test_stream_resumes_from_last_event_id(client):
+    """Test that a reconnecting SSE client only gets what it missed."""
+    for i in range(3):
+        client.post('/publish',
+                   data=json.dumps({'topic': 'news', 'subject': f'Story {i}'}),
+                   content_type='application/json')
+    
+    response = client.get('/stream?topic=news', headers={'Last-Event-ID': '2'}, buffered=False)
+    events = iter(response.response)
+    next(events)
+    assert next(events).decode().startswith('id: 3\n')
+    response.close()
+
+def test_stream_long_poll(client):
+    """Test the long-poll fallback returns on publish or after its timeout."""
+    # Nothing new: returns empty after the timeout
+    start = time.monotonic()
+    response = client.get('/stream?topic=news&mode=poll&since=0&timeout=0.2')
+    assert time.monotonic() - start >= 0.2
+    data = json.loads(response.data)
+    assert data['subjects'] == []
+    assert data['last_offset'] == 0
+    
+    # A publish while waiting wakes the request early
+    thread = publish_later('news', 'Waited for')
+    start = time.monotonic()
+    response = client.get('/stream?topic=news&mode=poll&since=0&timeout=10')
+    thread.join()
+    assert time.monotonic() - start < 5
+    data = json.loads(response.data)
+    assert [s['subject'] for s in data['subjects']] == ['Waited for']
+    assert data['last_offset'] == 1
+    
+    response = client.get('/stream?mode=poll&since=abc')
+    assert response.status_code == 400
+    for timeout in ['nan', 'inf', '-1']:
+        response = client.get(f'/stream?mode=poll&since=0&timeout={timeout}')
+        assert response.status_code == 400
+
+def test_publish_wakes_only_its_topic(client):
+    """Test that a publish wakes only its own topic's streams, and that waiting leaves no state."""
+    result = []
+    waiter = threading.Thread(target=lambda: result.append(pubsub.wait_for_subjects('sports', 0, 10)))
+    waiter.start()
+    while 'sports' not in pubsub.topic_waiters:
+        time.sleep(0.01)
+    woken = []
+    condition = pubsub.topic_waiters['sports'][0]
+    notify_all = condition.notify_all
+    condition.notify_all = lambda: (woken.append('sports'), notify_all())
+    
+    for i in range(3):
+        client.post('/publish',
+                   data=json.dumps({'topic': 'news', 'subject': f'Story {i}'}),
+                   content_type='application/json')
+    assert woken == []
+    client.post('/publish', data=json.dumps({'topic': 'sports', 'subject': 'Final score'}),
+               content_type='application/json')
+    waiter.join()
+    assert woken == ['sports']
+    assert [s['subject'] for s in result[0][0]] == ['Final score']
+    assert pubsub.topic_waiters == {}
+    
+    # Polling a topic nothing is published to stores nothing for it
+    response = client.get('/stream?topic=nobody&mode=poll&since=0&timeout=0.05')
+    assert json.loads(response.data)['subjects'] == []
+    assert 'nobody' not in pubsub.subject_history
+    assert pubsub.topic_waiters == {}
+
 def test_integration_workflow(client):
     """Test a complete workflow of adding subscribers, publishing, and deleting."""
     # Add subscribers
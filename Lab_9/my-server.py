@@ -5,18 +5,1115 @@ Lab 09: Web-tokens
 """
 
 from flask import Flask, request, jsonify
-import uuid
+from array import array
+import base64
+import binascii
+import hashlib
+import heapq
+import hmac
+import json
+import math
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+import urllib.parse
+import zlib
 import logging
 
+# State backends and the rate limiter are shared with the Lab 10 server
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'shared'))
+from state_backends import (InMemoryBackend, SQLiteBackend, RedisBackend, create_backend,
+                            RateLimiter)
+
 app = Flask(__name__)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# In-memory storage for tokens
-# In production, this would be a database
-token_store = {}
+# Where tokens live: "memory" (this process only), "sqlite:///path.db"
+# (every worker on the host) or "redis://host:port/db" (every host)
+STATE_BACKEND = os.environ.get('STATE_BACKEND', 'memory')
+
+# Lifetime (seconds) of a token when /generate-token is not given expires_in
+TOKEN_TTL = int(os.environ.get('TOKEN_TTL', 86400))
+
+# In-process token expiry: timer wheel resolution (seconds) and buckets per
+# turn of the wheel
+TIMER_WHEEL_TICK = 1
+TIMER_WHEEL_SLOTS = 3600
+
+# Tokens are opaque: version, shard, issue time and 16 random bytes, sealed
+# with a truncated HMAC-SHA256 under TOKEN_SECRET_KEY. Every worker must share
+# the key. Tokens issued more than TOKEN_MAX_AGE seconds ago (or more than
+# TOKEN_CLOCK_SKEW seconds in the future) are rejected without a lookup, and
+# no token may be issued for longer than TOKEN_MAX_AGE.
+TOKEN_SECRET_KEY = os.environ.get('TOKEN_SECRET_KEY', 'secret')
+TOKEN_VERSION = 1
+TOKEN_SHARDS = 16
+TOKEN_MAX_AGE = 30 * 86400
+TOKEN_CLOCK_SKEW = 60
+
+# Sliding sessions: a successful /login or /verify-token pushes a token's
+# expiry back out to a full expires_in from now, but only once less than
+# this fraction of it remains, so most requests write nothing. Tokens still
+# die TOKEN_MAX_AGE after issue. 0 turns sliding off.
+SESSION_REFRESH_FRACTION = float(os.environ.get('SESSION_REFRESH_FRACTION', 0.5))
+
+# GET /sessions/<id>: tokens per page by default, and at most
+SESSIONS_PAGE_SIZE = 100
+SESSIONS_PAGE_MAX = 1000
+
+# Rate limits for /login and /verify-token: token buckets refilled at
+# RATE_LIMIT_RATE requests per second, up to RATE_LIMIT_BURST, one per client
+# address and one per claimed ID. The buckets live in a memory-mapped file:
+# RATE_LIMIT_FILE (e.g. under /dev/shm) shares them between all processes
+# that open it; unset, an unnamed file is shared with workers forked after
+# the app is loaded (gunicorn --preload). A rate of 0 turns limiting off.
+RATE_LIMIT_RATE = float(os.environ.get('RATE_LIMIT_RATE', 10))
+RATE_LIMIT_BURST = int(os.environ.get('RATE_LIMIT_BURST', 20))
+RATE_LIMIT_FILE = os.environ.get('RATE_LIMIT_FILE')
+RATE_LIMITED_ENDPOINTS = {'verify_token', 'login'}
+
+# Directory for the in-process token store's write-ahead log and snapshots;
+# unset keeps tokens in memory only. A snapshot is written (and the log
+# started afresh) once the log grows past SNAPSHOT_LOG_BYTES.
+TOKEN_STORE_DIR = os.environ.get('TOKEN_STORE_DIR')
+SNAPSHOT_LOG_BYTES = 64 * 1024 * 1024
+
+
+def user_key(user_id):
+    """Canonical string for a user ID, used to index tokens by user."""
+    return json.dumps(user_id, sort_keys=True)
+
+
+TOKEN_LAYOUT = struct.Struct('>BBI16s')  # version, shard, issued, body
+TOKEN_MAC_BYTES = 8
+TOKEN_LENGTH = 4 * (TOKEN_LAYOUT.size + TOKEN_MAC_BYTES) // 3  # base64 characters
+_token_mac = hmac.new(TOKEN_SECRET_KEY.encode(), digestmod=hashlib.sha256)
+
+
+def token_mac(data):
+    """Truncated HMAC of a token's fields."""
+    mac = _token_mac.copy()
+    mac.update(data)
+    return mac.digest()[:TOKEN_MAC_BYTES]
+
+
+def make_token(body=None, issued=None):
+    """Opaque token string for a 16-byte body (random by default) issued at
+    issued (now by default). The shard follows from the body, so a stored
+    body and issue time are enough to rebuild the token."""
+    body = os.urandom(16) if body is None else bytes(body)
+    issued = int(time.time()) if issued is None else issued
+    data = TOKEN_LAYOUT.pack(TOKEN_VERSION, body[0] % TOKEN_SHARDS, issued, body)
+    return base64.urlsafe_b64encode(data + token_mac(data)).decode()
+
+
+def parse_token(token):
+    """(shard, issued, body) of a well-formed, authentic token that is not
+    past TOKEN_MAX_AGE, or None. Needs no store lookup."""
+    if not isinstance(token, str) or len(token) != TOKEN_LENGTH:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token)
+    except (binascii.Error, ValueError):
+        return None
+    data, mac = raw[:TOKEN_LAYOUT.size], raw[TOKEN_LAYOUT.size:]
+    if len(mac) != TOKEN_MAC_BYTES or data[0] != TOKEN_VERSION:
+        return None
+    if not hmac.compare_digest(mac, token_mac(data)):
+        return None
+    _, shard, issued, body = TOKEN_LAYOUT.unpack(data)
+    age = time.time() - issued
+    if age > TOKEN_MAX_AGE or age < -TOKEN_CLOCK_SKEW:
+        return None
+    return shard, issued, body
+
+
+def token_key(token):
+    """16-byte body of a valid token, or None."""
+    parsed = parse_token(token)
+    return None if parsed is None else parsed[2]
+
+
+SESSION_HANDLE_BYTES = 12  # version, shard, issue time and 6 body bytes
+
+
+def session_handle(body, issued):
+    """Handle naming a session in listings: the first 16 characters of its
+    token. It orders like the token, but is no credential."""
+    data = TOKEN_LAYOUT.pack(TOKEN_VERSION, body[0] % TOKEN_SHARDS, issued, bytes(body))
+    return base64.urlsafe_b64encode(data[:SESSION_HANDLE_BYTES]).decode()
+
+
+def check_cursor(after):
+    """Raise ValueError unless after is None or looks like a session handle."""
+    if after is not None and (not isinstance(after, str)
+                              or len(after) != 4 * SESSION_HANDLE_BYTES // 3):
+        raise ValueError("invalid cursor")
+
+
+def refreshed_expiry(expires_at, ttl, issued, now):
+    """New expiry (Unix seconds) for a session used at now, or None while
+    at least SESSION_REFRESH_FRACTION of its ttl remains."""
+    if not ttl or expires_at - now >= ttl * SESSION_REFRESH_FRACTION:
+        return None
+    extended = min(now + ttl, issued + TOKEN_MAX_AGE)
+    return extended if extended > expires_at else None
+
+
+class TokenStore:
+    """
+    Issued tokens and the ID each belongs to, kept in a state backend.
+    
+    Each token maps to JSON [ID, ttl, expiry], so IDs come back with the
+    type they were issued with, and touch() can tell whether a session is
+    due for extension from the value it reads anyway. With a shared
+    backend, every worker sees a token as soon as it is issued, and stops
+    accepting it as soon as it is revoked.
+    
+    Each user's tokens are also kept in a backend set. Tokens expire in the
+    backend without leaving their set, so sets are pruned as they are read;
+    and as no token outlives TOKEN_MAX_AGE, no set member does either.
+    Tokens that fail parse_token() are turned away before the backend is
+    asked about them.
+    """
+    
+    def __init__(self, backend=None):
+        self.backend = backend if backend is not None else InMemoryBackend()
+    
+    def issue(self, token, user_id, ttl=None):
+        """Store token for user_id, for ttl seconds (forever if None)."""
+        if parse_token(token) is None:
+            raise ValueError(f"not a valid token: {token!r}")
+        expires_at = None if ttl is None else time.time() + ttl
+        self.backend.set(token, json.dumps([user_id, ttl, expires_at]), ttl)
+        # parse_token() turns the token away by then, however it was issued
+        self.backend.add_member(user_key(user_id), token, TOKEN_MAX_AGE + TOKEN_CLOCK_SKEW)
+    
+    def lookup(self, token):
+        """ID the token was issued for, or None if it is unknown."""
+        if parse_token(token) is None:
+            return None
+        value = self.backend.get(token)
+        return None if value is None else json.loads(value)[0]
+    
+    def touch(self, token, user_id=None):
+        """ID the token was issued for, or None, as lookup(). Unless it
+        belongs to someone other than user_id, the session is extended when
+        refreshed_expiry() says it is due."""
+        parsed = parse_token(token)
+        if parsed is None:
+            return None
+        value = self.backend.get(token)
+        if value is None:
+            return None
+        stored_id, ttl, expires_at = json.loads(value)
+        if user_id is not None and user_id != stored_id:
+            return stored_id
+        now = time.time()
+        expires_at = refreshed_expiry(expires_at, ttl, parsed[1], now)
+        if expires_at is not None:
+            # Only if still present, so a racing revocation is not undone
+            self.backend.replace(token, json.dumps([stored_id, ttl, expires_at]),
+                                 expires_at - now)
+        return stored_id
+    
+    def lookup_many(self, tokens):
+        """IDs for tokens, in order, fetched in one backend round trip."""
+        valid = [parse_token(token) is not None for token in tokens]
+        values = iter(self.backend.get_many(
+            [token for token, ok in zip(tokens, valid) if ok]))
+        results = []
+        for ok in valid:
+            value = next(values) if ok else None
+            results.append(None if value is None else json.loads(value)[0])
+        return results
+    
+    def revoke(self, token):
+        """Forget the token, returning the ID it was issued for (or None)."""
+        if parse_token(token) is None:
+            return None
+        value = self.backend.pop(token)
+        if value is None:
+            return None
+        user_id = json.loads(value)[0]
+        self.backend.remove_members(user_key(user_id), [token])
+        return user_id
+    
+    def tokens_for(self, user_id):
+        """The user's live tokens."""
+        key = user_key(user_id)
+        tokens = self.backend.members(key)
+        values = self.backend.get_many(tokens)
+        stale = [token for token, value in zip(tokens, values) if value is None]
+        if stale:
+            self.backend.remove_members(key, stale)
+        return [token for token, value in zip(tokens, values) if value is not None]
+    
+    def sessions_page(self, user_id, after=None, limit=SESSIONS_PAGE_SIZE):
+        """Up to limit of the user's live sessions, as {"session", "issued_at",
+        "expires_at"} in handle order, starting after the handle after
+        (whose session need not be live any more)."""
+        check_cursor(after)
+        key = user_key(user_id)
+        # Tokens sort like their handles; '~' sorts after every base64
+        # character, so this skips all tokens that start with after
+        after = None if after is None else after + '~'
+        page = []
+        while len(page) < limit:
+            tokens = self.backend.members_page(key, after, limit - len(page))
+            if not tokens:
+                break
+            values = self.backend.get_many(tokens)
+            stale = [token for token, value in zip(tokens, values) if value is None]
+            if stale:
+                self.backend.remove_members(key, stale)
+            for token, value in zip(tokens, values):
+                parsed = parse_token(token)
+                if value is not None and parsed is not None:
+                    page.append({"session": session_handle(parsed[2], parsed[1]),
+                                 "issued_at": parsed[1],
+                                 "expires_at": json.loads(value)[2]})
+            after = tokens[-1]
+        return page
+    
+    def revoke_user(self, user_id):
+        """Forget all of the user's tokens, returning how many were live."""
+        key = user_key(user_id)
+        tokens = self.backend.members(key)
+        revoked = sum(value is not None for value in self.backend.pop_many(tokens))
+        self.backend.remove_members(key, tokens)
+        return revoked
+    
+    def __contains__(self, token):
+        return self.lookup(token) is not None
+    
+    def __len__(self):
+        return self.backend.count()
+    
+    def clear(self):
+        self.backend.clear()
+
+
+class TokenLog:
+    """
+    Append-only log of token store changes, in numbered segment files.
+    
+    Each record is framed as <length, crc32, body>, so a write torn by a
+    crash is found on replay and cut off. Appends only go to a buffer. A
+    flusher thread writes and fsyncs everything buffered at once, then
+    wakes every caller waiting on those records: one fsync covers all the
+    changes made while the previous one ran (group commit).
+    """
+    
+    FRAME = struct.Struct('<II')
+    
+    def __init__(self, directory, generation):
+        self.directory = directory
+        self.generation = generation
+        self._file = open(self.segment_path(directory, generation), 'ab')
+        self.size = self._file.tell()
+        self._buffer = []
+        self._appended = 0  # sequence number of the last appended record
+        self._durable = 0  # sequence number of the last fsynced record
+        self._cond = threading.Condition()
+        self._io_lock = threading.Lock()  # held while writing to the file
+        self._closed = False
+        self._flusher = threading.Thread(target=self._run, daemon=True)
+        self._flusher.start()
+    
+    @staticmethod
+    def segment_path(directory, generation):
+        return os.path.join(directory, f"tokens-{generation:08d}.wal")
+    
+    @staticmethod
+    def segments(directory):
+        """(generation, path) of every log segment, oldest first."""
+        found = []
+        for name in os.listdir(directory):
+            if name.startswith('tokens-') and name.endswith('.wal'):
+                found.append((int(name[7:-4]), os.path.join(directory, name)))
+        return sorted(found)
+    
+    @classmethod
+    def read(cls, path):
+        """Yield the record bodies in a segment, truncating it after the
+        last whole record."""
+        with open(path, 'r+b') as f:
+            data = f.read()
+            offset = 0
+            while offset + cls.FRAME.size <= len(data):
+                length, crc = cls.FRAME.unpack_from(data, offset)
+                body = data[offset + cls.FRAME.size:offset + cls.FRAME.size + length]
+                if len(body) < length or zlib.crc32(body) != crc:
+                    break
+                yield body
+                offset += cls.FRAME.size + length
+            if offset < len(data):
+                logger.warning(f"Dropping {len(data) - offset} torn bytes at the end of {path}")
+                f.truncate(offset)
+    
+    def append(self, body):
+        """Buffer a record; returns its sequence number for wait()."""
+        frame = self.FRAME.pack(len(body), zlib.crc32(body)) + body
+        with self._cond:
+            self._buffer.append(frame)
+            self._appended += 1
+            self._cond.notify_all()
+            return self._appended
+    
+    def wait(self, sequence):
+        """Block until the record with this sequence number is on disk."""
+        with self._cond:
+            while self._durable < sequence:
+                self._cond.wait()
+    
+    def _write_buffered(self):
+        """Write and fsync everything buffered. Caller holds _io_lock."""
+        with self._cond:
+            data = b''.join(self._buffer)
+            self._buffer = []
+            sequence = self._appended
+        if data:
+            self._file.write(data)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self.size += len(data)
+        with self._cond:
+            self._durable = sequence
+            self._cond.notify_all()
+    
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._buffer and not self._closed:
+                    self._cond.wait()
+                if self._closed and not self._buffer:
+                    return
+            with self._io_lock:
+                if not self._file.closed:
+                    self._write_buffered()
+    
+    def rotate(self, generation):
+        """Flush, then continue in a new segment for generation."""
+        with self._io_lock:
+            self._write_buffered()
+            self._file.close()
+            self.generation = generation
+            self._file = open(self.segment_path(self.directory, generation), 'ab')
+            self.size = 0
+    
+    def close(self):
+        with self._io_lock:
+            self._write_buffered()
+            self._file.close()
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._flusher.join()
+
+
+class MemoryTokenStore:
+    """
+    Issued tokens in this process, packed into flat arrays.
+    
+    A token is stored as its 16 random body bytes plus its issue time, its
+    ttl, an interned user number, an expiry tick and four 4-byte links, in
+    parallel arrays indexed by slot. An open-addressing table of slot
+    numbers finds a token by its body. Nothing is allocated per token: with
+    spare capacity, a token costs about 80 bytes, against about 190 for a
+    dict entry holding token and ID strings. Tokens that fail parse_token()
+    are turned away before the lock is taken.
+    
+    Every token sits on two doubly linked lists threaded through the slots:
+    its user's tokens, so revoking all of them costs O(their count), and
+    its timer-wheel bucket. The wheel has one bucket per tick; as time
+    passes, each operation empties the buckets for the ticks gone by and
+    drops the tokens that are due. A token due more than one turn of the
+    wheel away goes back into its bucket until its turn comes.
+    
+    Given a directory, every change is also written to a TokenLog, and
+    callers return once their change is on disk. When the log grows past
+    snapshot_bytes, the arrays are dumped as they are into a snapshot and
+    the log starts a new segment. A restart maps the snapshot, copies the
+    arrays straight out of it, and replays only the log written since.
+    """
+    
+    EMPTY = -1
+    DELETED = -2
+    SNAPSHOT_MAGIC = b'TOKSNAP3'
+    
+    def __init__(self, capacity=1024, wheel_slots=TIMER_WHEEL_SLOTS, tick=TIMER_WHEEL_TICK,
+                 directory=None, snapshot_bytes=SNAPSHOT_LOG_BYTES):
+        self.initial_capacity = capacity
+        self.tick = tick
+        self.wheel_slots = wheel_slots
+        self.directory = directory
+        self.snapshot_bytes = snapshot_bytes
+        self._lock = threading.Lock()
+        self._snapshot_lock = threading.Lock()
+        self._snapshotting = False
+        self._log = None
+        self._reset()
+        if directory is not None:
+            self._recover()
+    
+    def _reset(self):
+        capacity = self.initial_capacity
+        self._keys = bytearray(16 * capacity)
+        self._issued = array('I', [0]) * capacity
+        self._ttls = array('I', [0]) * capacity  # seconds; 0 if issued without one
+        self._users = array('i', [0]) * capacity
+        self._expires = array('q', [0]) * capacity
+        self._user_next = array('i', [-1]) * capacity  # also links free slots
+        self._user_prev = array('i', [-1]) * capacity
+        self._wheel_next = array('i', [-1]) * capacity
+        self._wheel_prev = array('i', [-1]) * capacity
+        self._capacity = capacity
+        self._used = 0  # slots handed out so far; later ones were never used
+        self._free = -1  # head of the list of released slots
+        self._size = 0
+        size = 16  # a power of two, so probing can wrap with a mask
+        while size < 2 * capacity:
+            size *= 2
+        self._table = array('i', [self.EMPTY]) * size
+        self._mask = size - 1
+        self._deleted = 0  # DELETED markers in the table
+        self._wheel = array('i', [-1]) * self.wheel_slots
+        self._tick = self._now_tick()
+        self._user_nums = {}  # {user_key: number}
+        self._user_ids = []  # [user_id] by number
+        self._user_heads = []  # [first slot of the user's tokens] by number
+        self._user_counts = []  # [live tokens] by number
+        self._free_users = []
+    
+    def _now_tick(self):
+        return int(time.time() / self.tick)
+    
+    # --- slots and the key table ---------------------------------------
+    
+    def _grow(self):
+        extra = self._capacity
+        self._keys.extend(bytes(16 * extra))
+        self._issued.extend(array('I', [0]) * extra)
+        self._ttls.extend(array('I', [0]) * extra)
+        self._users.extend(array('i', [0]) * extra)
+        self._expires.extend(array('q', [0]) * extra)
+        for links in (self._user_next, self._user_prev, self._wheel_next, self._wheel_prev):
+            links.extend(array('i', [-1]) * extra)
+        self._capacity += extra
+    
+    def _alloc(self):
+        slot = self._free
+        if slot >= 0:
+            self._free = self._user_next[slot]
+            return slot
+        if self._used == self._capacity:
+            self._grow()
+        self._used += 1
+        return self._used - 1
+    
+    def _probe(self, key):
+        """(table position, slot) for key; slot is -1 and the position is
+        where to insert it if key is not stored."""
+        table, keys, mask = self._table, self._keys, self._mask
+        pos = int.from_bytes(key[:8], 'little') & mask
+        insert_at = -1
+        while True:
+            slot = table[pos]
+            if slot == self.EMPTY:
+                return (pos if insert_at < 0 else insert_at), -1
+            if slot == self.DELETED:
+                if insert_at < 0:
+                    insert_at = pos
+            elif keys[16 * slot:16 * slot + 16] == key:
+                return pos, slot
+            pos = (pos + 1) & mask
+    
+    def _rebuild_table(self):
+        """Resize the table to twice the live tokens' needs, dropping DELETED markers."""
+        size = 16
+        while size < 4 * max(self._size, 1):
+            size *= 2
+        old = self._table
+        self._table = array('i', [self.EMPTY]) * size
+        self._mask = size - 1
+        self._deleted = 0
+        for slot in old:
+            if slot >= 0:
+                pos, _ = self._probe(self._keys[16 * slot:16 * slot + 16])
+                self._table[pos] = slot
+    
+    # --- linked lists ---------------------------------------------------
+    
+    def _link_user(self, slot, number):
+        head = self._user_heads[number]
+        self._user_next[slot] = head
+        self._user_prev[slot] = -1
+        if head >= 0:
+            self._user_prev[head] = slot
+        self._user_heads[number] = slot
+    
+    def _unlink_user(self, slot, number):
+        prev, nxt = self._user_prev[slot], self._user_next[slot]
+        if prev >= 0:
+            self._user_next[prev] = nxt
+        else:
+            self._user_heads[number] = nxt
+        if nxt >= 0:
+            self._user_prev[nxt] = prev
+    
+    def _link_wheel(self, slot):
+        bucket = self._expires[slot] % self.wheel_slots
+        head = self._wheel[bucket]
+        self._wheel_next[slot] = head
+        self._wheel_prev[slot] = -1
+        if head >= 0:
+            self._wheel_prev[head] = slot
+        self._wheel[bucket] = slot
+    
+    def _unlink_wheel(self, slot):
+        prev, nxt = self._wheel_prev[slot], self._wheel_next[slot]
+        if prev >= 0:
+            self._wheel_next[prev] = nxt
+        else:
+            self._wheel[self._expires[slot] % self.wheel_slots] = nxt
+        if nxt >= 0:
+            self._wheel_prev[nxt] = prev
+    
+    # --- users ----------------------------------------------------------
+    
+    def _user_number(self, user_id):
+        key = user_key(user_id)
+        number = self._user_nums.get(key)
+        if number is None:
+            if self._free_users:
+                number = self._free_users.pop()
+                self._user_ids[number] = user_id
+                self._user_heads[number] = -1
+                self._user_counts[number] = 0
+            else:
+                number = len(self._user_ids)
+                self._user_ids.append(user_id)
+                self._user_heads.append(-1)
+                self._user_counts.append(0)
+            self._user_nums[key] = number
+        return number
+    
+    # --- insert and remove ----------------------------------------------
+    
+    def _remove(self, slot, pos=None, on_wheel=True):
+        """Drop the token in slot. Caller holds the lock."""
+        if pos is None:
+            pos, _ = self._probe(self._keys[16 * slot:16 * slot + 16])
+        self._table[pos] = self.DELETED
+        self._deleted += 1
+        number = self._users[slot]
+        self._unlink_user(slot, number)
+        if on_wheel:
+            self._unlink_wheel(slot)
+        self._user_counts[number] -= 1
+        if self._user_counts[number] == 0:
+            del self._user_nums[user_key(self._user_ids[number])]
+            self._user_ids[number] = None
+            self._free_users.append(number)
+        self._user_next[slot] = self._free
+        self._free = slot
+        self._size -= 1
+    
+    def _expire(self, now_tick):
+        """Empty the wheel buckets for the ticks since the last call (at most
+        one full turn), dropping tokens that are due. Caller holds the lock."""
+        steps = min(now_tick - self._tick, self.wheel_slots)
+        for tick in range(self._tick + 1, self._tick + steps + 1):
+            bucket = tick % self.wheel_slots
+            slot = self._wheel[bucket]
+            self._wheel[bucket] = -1
+            while slot >= 0:
+                nxt = self._wheel_next[slot]
+                if self._expires[slot] <= now_tick:
+                    self._remove(slot, on_wheel=False)
+                else:
+                    self._link_wheel(slot)
+                slot = nxt
+        if now_tick > self._tick:
+            self._tick = now_tick
+    
+    def _find(self, key, now_tick):
+        """(position, slot) of a live token, or None. Caller holds the lock."""
+        self._expire(now_tick)
+        pos, slot = self._probe(key)
+        if slot < 0 or self._expires[slot] <= now_tick:
+            return None
+        return pos, slot
+    
+    def _insert(self, key, issued, ttl, user_id, expires):
+        """Store key for user_id until tick expires. Caller holds the lock."""
+        pos, slot = self._probe(key)
+        if slot >= 0:
+            self._remove(slot, pos)
+            pos, _ = self._probe(key)
+        slot = self._alloc()
+        self._keys[16 * slot:16 * slot + 16] = key
+        self._issued[slot] = issued
+        self._ttls[slot] = ttl
+        number = self._user_number(user_id)
+        self._users[slot] = number
+        self._user_counts[number] += 1
+        self._expires[slot] = expires
+        self._link_user(slot, number)
+        self._link_wheel(slot)
+        if self._table[pos] == self.DELETED:
+            self._deleted -= 1
+        self._table[pos] = slot
+        self._size += 1
+        if 2 * (self._size + self._deleted) > len(self._table):
+            self._rebuild_table()
+    
+    def _extend(self, slot, expires):
+        """Move the token in slot to expire at tick expires. Caller holds the lock."""
+        self._unlink_wheel(slot)
+        self._expires[slot] = expires
+        self._link_wheel(slot)
+    
+    # --- persistence ----------------------------------------------------
+    
+    def _logged(self, body):
+        """Append a change to the log. Caller holds the lock, and passes
+        the result to _sync() once it has released it."""
+        return self._log.append(body) if self._log is not None else 0
+    
+    def _sync(self, sequence):
+        """Wait for a logged change to reach disk, and snapshot if the log is due."""
+        if not sequence:
+            return
+        self._log.wait(sequence)
+        if self._log.size > self.snapshot_bytes and not self._snapshotting:
+            self._snapshotting = True
+            threading.Thread(target=self.snapshot, daemon=True).start()
+    
+    def _apply(self, body):
+        """Replay one log record. Caller holds the lock (or is recovering).
+        Tokens are inserted even if due, as a later record may extend them."""
+        op = body[:1]
+        if op == b'I':
+            expires, issued, ttl = struct.unpack_from('<qII', body, 17)
+            self._insert(body[1:17], issued, ttl, json.loads(body[33:]), expires)
+        elif op == b'E':
+            pos, slot = self._probe(body[1:17])
+            if slot >= 0:
+                self._extend(slot, struct.unpack_from('<q', body, 17)[0])
+        elif op == b'R':
+            pos, slot = self._probe(body[1:17])
+            if slot >= 0:
+                self._remove(slot, pos)
+        elif op == b'C':
+            self._reset()
+    
+    def _snapshot_path(self):
+        return os.path.join(self.directory, 'tokens.snapshot')
+    
+    def snapshot(self):
+        """Dump the store to a snapshot, continue the log in a new segment,
+        and delete the segments the snapshot covers."""
+        with self._snapshot_lock:
+            try:
+                with self._lock:
+                    header = {
+                        "capacity": self._capacity, "used": self._used, "free": self._free,
+                        "size": self._size, "deleted": self._deleted, "tick": self._tick,
+                        "tick_seconds": self.tick, "wheel_slots": self.wheel_slots,
+                        "user_ids": self._user_ids, "free_users": self._free_users
+                    }
+                    chunks = [bytes(self._keys)] + [a.tobytes() for a in (
+                        self._issued, self._ttls, self._users, self._expires, self._user_next, self._user_prev,
+                        self._wheel_next, self._wheel_prev, self._table, self._wheel,
+                        array('i', self._user_heads), array('i', self._user_counts))]
+                    header["generation"] = generation = self._log.generation + 1
+                    self._log.rotate(generation)
+                
+                path = self._snapshot_path()
+                encoded = json.dumps(header).encode()
+                with open(path + '.tmp', 'wb') as f:
+                    f.write(self.SNAPSHOT_MAGIC + struct.pack('<Q', len(encoded)) + encoded)
+                    for chunk in chunks:
+                        f.write(struct.pack('<Q', len(chunk)))
+                        f.write(chunk)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(path + '.tmp', path)
+                for old, segment in TokenLog.segments(self.directory):
+                    if old < generation:
+                        os.remove(segment)
+                logger.info(f"Token store snapshot written: {header['size']} tokens")
+            finally:
+                self._snapshotting = False
+    
+    def _load_snapshot(self, path):
+        """Load the arrays from a snapshot; returns its generation."""
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if mm[:len(self.SNAPSHOT_MAGIC)] != self.SNAPSHOT_MAGIC:
+                raise ValueError(f"{path} is not a token store snapshot")
+            offset = len(self.SNAPSHOT_MAGIC)
+            (length,) = struct.unpack_from('<Q', mm, offset)
+            header = json.loads(mm[offset + 8:offset + 8 + length])
+            offset += 8 + length
+            view = memoryview(mm)
+            chunks = []
+            while offset < len(mm):
+                (length,) = struct.unpack_from('<Q', mm, offset)
+                chunks.append(view[offset + 8:offset + 8 + length])
+                offset += 8 + length
+            self._keys = bytearray(chunks[0])
+            arrays = []
+            for typecode, chunk in zip('IIiqiiiiiiii', chunks[1:]):
+                loaded = array(typecode)
+                loaded.frombytes(chunk)
+                arrays.append(loaded)
+            del chunks, chunk
+            view.release()
+        (self._issued, self._ttls, self._users, self._expires, self._user_next, self._user_prev, self._wheel_next,
+         self._wheel_prev, self._table, self._wheel, user_heads, user_counts) = arrays
+        self._user_heads = user_heads.tolist()
+        self._user_counts = user_counts.tolist()
+        self._capacity = header["capacity"]
+        self._used = header["used"]
+        self._free = header["free"]
+        self._size = header["size"]
+        self._deleted = header["deleted"]
+        self._mask = len(self._table) - 1
+        self._user_ids = header["user_ids"]
+        self._free_users = header["free_users"]
+        freed = set(self._free_users)
+        self._user_nums = {user_key(user_id): number for number, user_id
+                           in enumerate(self._user_ids) if number not in freed}
+        self._tick = int(header["tick"] * header["tick_seconds"] / self.tick)
+        if header["tick_seconds"] != self.tick or header["wheel_slots"] != self.wheel_slots:
+            self._rebuild_wheel(header["tick_seconds"])
+        return header["generation"]
+    
+    def _rebuild_wheel(self, old_tick):
+        """Re-bucket every token for this store's tick and wheel size."""
+        self._wheel = array('i', [-1]) * self.wheel_slots
+        for slot in self._table:
+            if slot >= 0:
+                if self._expires[slot] < 2 ** 62:
+                    self._expires[slot] = math.ceil(self._expires[slot] * old_tick / self.tick)
+                self._link_wheel(slot)
+    
+    def _recover(self):
+        """Load the snapshot and replay the log after it, then open the log."""
+        started = time.perf_counter()
+        os.makedirs(self.directory, exist_ok=True)
+        generation = 0
+        if os.path.exists(self._snapshot_path()):
+            generation = self._load_snapshot(self._snapshot_path())
+        replayed = 0
+        inserted = set()
+        for segment_generation, segment in TokenLog.segments(self.directory):
+            if segment_generation < generation:
+                os.remove(segment)  # covered by the snapshot
+                continue
+            for body in TokenLog.read(segment):
+                self._apply(body)
+                if body[:1] == b'I':
+                    inserted.add(body[1:17])
+                replayed += 1
+            generation = segment_generation
+        now_tick = self._now_tick()
+        for key in inserted:  # drop replayed tokens that ran out while down
+            pos, slot = self._probe(key)
+            if slot >= 0 and self._expires[slot] <= now_tick:
+                self._remove(slot, pos)
+        self._log = TokenLog(self.directory, generation)
+        logger.info(f"Token store loaded {self._size} tokens ({replayed} log records) "
+                    f"in {time.perf_counter() - started:.2f}s")
+    
+    def close(self):
+        if self._log is not None:
+            self._log.close()
+    
+    # --- public interface -----------------------------------------------
+    
+    def issue(self, token, user_id, ttl=None):
+        """Store token (from make_token()) for user_id, for ttl seconds
+        (forever, in practice, if None)."""
+        parsed = parse_token(token)
+        if parsed is None:
+            raise ValueError(f"not a valid token: {token!r}")
+        self._issue(parsed[2], parsed[1], user_id, ttl)
+    
+    def _issue(self, key, issued, user_id, ttl):
+        now = time.time()
+        now_tick = int(now / self.tick)
+        expires = 2 ** 62 if ttl is None else max(math.ceil((now + ttl) / self.tick), now_tick + 1)
+        ttl = 0 if ttl is None else math.ceil(ttl)
+        with self._lock:
+            self._expire(now_tick)
+            self._insert(key, issued, ttl, user_id, expires)
+            sequence = self._logged(b'I' + key + struct.pack('<qII', expires, issued, ttl)
+                                    + json.dumps(user_id).encode())
+        self._sync(sequence)
+    
+    def lookup(self, token):
+        """ID the token was issued for, or None if it is unknown or expired."""
+        key = token_key(token)
+        return None if key is None else self._lookup(key)
+    
+    def _lookup(self, key):
+        with self._lock:
+            found = self._find(key, self._now_tick())
+            return None if found is None else self._user_ids[self._users[found[1]]]
+    
+    def lookup_many(self, tokens):
+        return [self.lookup(token) for token in tokens]
+    
+    def touch(self, token, user_id=None):
+        """ID the token was issued for, or None, as lookup(). Unless it
+        belongs to someone other than user_id, the session is extended when
+        refreshed_expiry() says it is due; otherwise nothing is written."""
+        parsed = parse_token(token)
+        return None if parsed is None else self._touch(parsed[2], user_id)
+    
+    def _touch(self, key, user_id):
+        now = time.time()
+        sequence = 0
+        with self._lock:
+            found = self._find(key, int(now / self.tick))
+            if found is None:
+                return None
+            slot = found[1]
+            stored_id = self._user_ids[self._users[slot]]
+            if user_id is None or user_id == stored_id:
+                extended = refreshed_expiry(self._expires[slot] * self.tick, self._ttls[slot],
+                                            self._issued[slot], now)
+                if extended is not None:
+                    expires = math.ceil(extended / self.tick)
+                    self._extend(slot, expires)
+                    sequence = self._logged(b'E' + key + struct.pack('<q', expires))
+        self._sync(sequence)
+        return stored_id
+    
+    def revoke(self, token):
+        """Forget the token, returning the ID it was issued for (or None)."""
+        key = token_key(token)
+        return None if key is None else self._revoke(key)
+    
+    def _revoke(self, key):
+        with self._lock:
+            found = self._find(key, self._now_tick())
+            if found is None:
+                return None
+            pos, slot = found
+            user_id = self._user_ids[self._users[slot]]
+            sequence = self._logged(b'R' + self._keys[16 * slot:16 * slot + 16])
+            self._remove(slot, pos)
+        self._sync(sequence)
+        return user_id
+    
+    def _user_slots(self, user_id):
+        number = self._user_nums.get(user_key(user_id))
+        slot = -1 if number is None else self._user_heads[number]
+        while slot >= 0:
+            yield slot
+            slot = self._user_next[slot]
+    
+    def tokens_for(self, user_id):
+        """The user's live tokens, newest first."""
+        with self._lock:
+            self._expire(self._now_tick())
+            return [make_token(self._keys[16 * slot:16 * slot + 16], self._issued[slot])
+                    for slot in self._user_slots(user_id)]
+    
+    def sessions_page(self, user_id, after=None, limit=SESSIONS_PAGE_SIZE):
+        """Up to limit of the user's live sessions, as {"session", "issued_at",
+        "expires_at"} in handle order, starting after the handle after
+        (whose session need not be live any more)."""
+        check_cursor(after)
+        return [{"session": handle, "issued_at": issued, "expires_at": expires_at}
+                for handle, issued, expires_at in self._sessions(user_id, after, limit)]
+    
+    def _sessions(self, user_id, after, limit):
+        """The limit smallest (handle, issue time, expiry) of the user's
+        sessions with handles above after. Costs O(the user's tokens)."""
+        with self._lock:
+            self._expire(self._now_tick())
+            candidates = []
+            for slot in self._user_slots(user_id):
+                handle = session_handle(self._keys[16 * slot:16 * slot + 16], self._issued[slot])
+                if after is None or handle > after:
+                    expires = self._expires[slot]
+                    candidates.append((handle, self._issued[slot],
+                                       None if expires >= 2 ** 62 else expires * self.tick))
+        return heapq.nsmallest(limit, candidates)
+    
+    def revoke_user(self, user_id):
+        """Forget all of the user's tokens, returning how many there were."""
+        with self._lock:
+            self._expire(self._now_tick())
+            slots = list(self._user_slots(user_id))
+            sequence = 0
+            for slot in slots:
+                sequence = self._logged(b'R' + self._keys[16 * slot:16 * slot + 16])
+                self._remove(slot)
+        self._sync(sequence)
+        return len(slots)
+    
+    def __contains__(self, token):
+        return self.lookup(token) is not None
+    
+    def __len__(self):
+        with self._lock:
+            self._expire(self._now_tick())
+            return self._size
+    
+    def clear(self):
+        with self._lock:
+            self._reset()
+            sequence = self._logged(b'C')
+        self._sync(sequence)
+    
+    def memory_bytes(self):
+        """Bytes held by the per-token arrays and the key table."""
+        with self._lock:
+            return (len(self._keys) + sum(a.itemsize * len(a) for a in (
+                self._issued, self._ttls, self._users, self._expires, self._user_next, self._user_prev,
+                self._wheel_next, self._wheel_prev, self._table)))
+
+
+class ShardedTokenStore:
+    """
+    Issued tokens in this process, split over MemoryTokenStore shards that
+    each have their own lock.
+    
+    A token names its shard, so it is parsed once and only that shard is
+    locked: threads working on different shards never wait for each other,
+    where a single store would serialize every request behind one lock.
+    Each operation on a token stays atomic within its shard, so concurrent
+    revocations of one token still see exactly one success.
+    
+    A user's tokens are spread over the shards, so per-user calls visit
+    them in turn. Given a directory, each shard keeps its log and snapshots
+    in a subdirectory of it, and snapshot_bytes is shared out between them.
+    Reopen a directory with the same number of shards.
+    """
+    
+    def __init__(self, shards=TOKEN_SHARDS, directory=None,
+                 snapshot_bytes=SNAPSHOT_LOG_BYTES, **kwargs):
+        self.directory = directory
+        self.shards = [
+            MemoryTokenStore(directory=None if directory is None
+                             else os.path.join(directory, f'shard-{i:02d}'),
+                             snapshot_bytes=snapshot_bytes // shards, **kwargs)
+            for i in range(shards)]
+    
+    def _shard(self, parsed):
+        return self.shards[parsed[0] % len(self.shards)]
+    
+    def issue(self, token, user_id, ttl=None):
+        """Store token (from make_token()) for user_id, for ttl seconds
+        (forever, in practice, if None)."""
+        parsed = parse_token(token)
+        if parsed is None:
+            raise ValueError(f"not a valid token: {token!r}")
+        self._shard(parsed)._issue(parsed[2], parsed[1], user_id, ttl)
+    
+    def lookup(self, token):
+        """ID the token was issued for, or None if it is unknown or expired."""
+        parsed = parse_token(token)
+        return None if parsed is None else self._shard(parsed)._lookup(parsed[2])
+    
+    def lookup_many(self, tokens):
+        return [self.lookup(token) for token in tokens]
+    
+    def touch(self, token, user_id=None):
+        """ID the token was issued for, or None, extending the session when
+        due (see MemoryTokenStore.touch)."""
+        parsed = parse_token(token)
+        return None if parsed is None else self._shard(parsed)._touch(parsed[2], user_id)
+    
+    def revoke(self, token):
+        """Forget the token, returning the ID it was issued for (or None)."""
+        parsed = parse_token(token)
+        return None if parsed is None else self._shard(parsed)._revoke(parsed[2])
+    
+    def tokens_for(self, user_id):
+        """The user's live tokens."""
+        return [token for shard in self.shards for token in shard.tokens_for(user_id)]
+    
+    def sessions_page(self, user_id, after=None, limit=SESSIONS_PAGE_SIZE):
+        """Up to limit of the user's live sessions in handle order, merged
+        from every shard (see MemoryTokenStore.sessions_page)."""
+        check_cursor(after)
+        candidates = [session for shard in self.shards
+                      for session in shard._sessions(user_id, after, limit)]
+        return [{"session": handle, "issued_at": issued, "expires_at": expires_at}
+                for handle, issued, expires_at in heapq.nsmallest(limit, candidates)]
+    
+    def revoke_user(self, user_id):
+        """Forget all of the user's tokens, returning how many there were."""
+        return sum(shard.revoke_user(user_id) for shard in self.shards)
+    
+    def __contains__(self, token):
+        return self.lookup(token) is not None
+    
+    def __len__(self):
+        return sum(len(shard) for shard in self.shards)
+    
+    def clear(self):
+        for shard in self.shards:
+            shard.clear()
+    
+    def memory_bytes(self):
+        return sum(shard.memory_bytes() for shard in self.shards)
+    
+    def snapshot(self):
+        for shard in self.shards:
+            shard.snapshot()
+    
+    def close(self):
+        for shard in self.shards:
+            shard.close()
+
+
+def create_token_store(url):
+    """Token store for a STATE_BACKEND url: sharded in-process arrays for
+    memory, or a TokenStore over the shared backend."""
+    if urllib.parse.urlsplit(url).scheme in ('', 'memory'):
+        return ShardedTokenStore(directory=TOKEN_STORE_DIR)
+    return TokenStore(create_backend(url, 'tokens'))
+
+
+# Storage for tokens; STATE_BACKEND picks where it lives
+token_store = create_token_store(STATE_BACKEND)
+
+
+rate_limiter = RateLimiter(RATE_LIMIT_FILE)
+
+
+@app.before_request
+def limit_auth_attempts():
+    """Turn away clients (by address, then by claimed ID) that have used up
+    their bucket, before the token is parsed or checked."""
+    if request.endpoint not in RATE_LIMITED_ENDPOINTS or RATE_LIMIT_RATE <= 0:
+        return None
+    keys = [f"addr:{request.remote_addr}"]
+    data = request.get_json(silent=True) if request.is_json else request.form
+    if isinstance(data, dict) and data.get('id') is not None:
+        keys.append(f"id:{data['id']}")
+    for key in keys:
+        wait = rate_limiter.acquire(key, RATE_LIMIT_RATE, RATE_LIMIT_BURST)
+        if wait:
+            logger.warning(f"Rate limited {key}")
+            return jsonify({
+                "error": "Too many requests"
+            }), 429, {"Retry-After": str(math.ceil(wait))}
+    return None
 
 
 @app.route('/')
@@ -25,9 +1122,11 @@ def home():
     return jsonify({
         "message": "Web Token Service",
         "endpoints": {
-            "/generate-token": "POST - Generate a new UUID token for an ID",
+            "/generate-token": "POST - Generate a new token for an ID",
             "/verify-token": "POST - Verify an existing token",
-            "/login": "POST - Login with ID and token"
+            "/login": "POST - Login with ID and token",
+            "/sessions/<id>": "GET - List an ID's sessions, a page at a time",
+            "/revoke-user": "POST - Revoke every token of an ID"
         }
     })
 
@@ -35,9 +1134,9 @@ def home():
 @app.route('/generate-token', methods=['POST'])
 def generate_token():
     """
-    Generate a UUID token for a given ID
-    Expected JSON: {"id": "user@example.com"}
-    Returns: {"id": "user@example.com", "uuid-token": "..."}
+    Generate a token for a given ID
+    Expected JSON: {"id": "user@example.com"} or {"id": "user@example.com", "expires_in": 3600}
+    Returns: {"id": "user@example.com", "uuid-token": "...", "expires_in": 86400}
     """
     try:
         data = request.get_json(silent=True)
@@ -49,17 +1148,29 @@ def generate_token():
         
         user_id = data['id']
         
-        # Generate a new UUID token
-        token = str(uuid.uuid4())
+        # Default lifetime: TOKEN_TTL
+        expires_in = data.get('expires_in', TOKEN_TTL)
+        if not isinstance(expires_in, int) or isinstance(expires_in, bool) or expires_in <= 0:
+            return jsonify({
+                "error": "'expires_in' must be a positive integer"
+            }), 400
+        if expires_in > TOKEN_MAX_AGE:
+            return jsonify({
+                "error": f"'expires_in' may not exceed {TOKEN_MAX_AGE} seconds"
+            }), 400
+        
+        # Generate a new opaque token
+        token = make_token()
         
         # Store the token associated with the user ID
-        token_store[token] = user_id
+        token_store.issue(token, user_id, expires_in)
         
         logger.info(f"Generated token for user: {user_id}")
         
         return jsonify({
             "id": user_id,
-            "uuid-token": token
+            "uuid-token": token,
+            "expires_in": expires_in
         }), 201
         
     except Exception as e:
@@ -72,7 +1183,7 @@ def generate_token():
 @app.route('/verify-token', methods=['POST'])
 def verify_token():
     """
-    Verify a UUID token
+    Verify a token
     Expected JSON: {"id": "user@example.com", "uuid-token": "..."}
     Returns: {"valid": true/false, "id": "user@example.com"}
     """
@@ -87,16 +1198,15 @@ def verify_token():
         token = data['uuid-token']
         provided_id = data.get('id')
         
-        # Check if token exists in our store
-        if token not in token_store:
+        # Check if token exists in our store (extending the session if due)
+        stored_id = token_store.touch(token, provided_id or None)
+        if stored_id is None:
             logger.warning(f"Invalid token verification attempt")
             return jsonify({
                 "valid": False,
                 "message": "Token not found"
             }), 404
         
-        stored_id = token_store[token]
-        
         # If ID was provided, verify it matches
         if provided_id and provided_id != stored_id:
             logger.warning(f"Token ID mismatch for {provided_id}")
@@ -142,16 +1252,15 @@ def login():
         user_id = data['id']
         token = data['uuid-token']
         
-        # Verify the token
-        if token not in token_store:
+        # Verify the token (extending the session if due)
+        stored_id = token_store.touch(token, user_id)
+        if stored_id is None:
             logger.warning(f"Login failed: Invalid token for {user_id}")
             return jsonify({
                 "success": False,
                 "message": "Invalid token"
             }), 401
         
-        stored_id = token_store[token]
-        
         if stored_id != user_id:
             logger.warning(f"Login failed: ID mismatch for {user_id}")
             return jsonify({
@@ -190,9 +1299,8 @@ def revoke_token():
         
         token = data['uuid-token']
         
-        if token in token_store:
-            user_id = token_store[token]
-            del token_store[token]
+        user_id = token_store.revoke(token)
+        if user_id is not None:
             logger.info(f"Token revoked for user: {user_id}")
             return jsonify({
                 "success": True,
@@ -211,6 +1319,129 @@ def revoke_token():
         }), 500
 
 
+def benchmark_contention(threads=(1, 2, 4, 8, 16), operations=20000):
+    """
+    Token store throughput, in operations per second, with the given
+    numbers of threads each issuing, verifying twice and revoking tokens.
+    The single-lock store is measured next to the sharded one.
+    """
+    results = {}
+    for name, store in [("single", MemoryTokenStore()), ("sharded", ShardedTokenStore())]:
+        results[name] = {}
+        for count in threads:
+            per_thread = max(operations // (4 * count), 1)
+            work = [[make_token() for _ in range(per_thread)] for _ in range(count)]
+            start = threading.Barrier(count + 1)
+            
+            def run(tokens):
+                start.wait()
+                for token in tokens:
+                    store.issue(token, 'bench', ttl=60)
+                    store.lookup(token)
+                    store.lookup(token)
+                    store.revoke(token)
+            
+            workers = [threading.Thread(target=run, args=(tokens,)) for tokens in work]
+            for worker in workers:
+                worker.start()
+            start.wait()
+            began = time.perf_counter()
+            for worker in workers:
+                worker.join()
+            results[name][count] = round(4 * per_thread * count / (time.perf_counter() - began))
+    return results
+
+
+@app.route('/sessions', methods=['GET'])
+@app.route('/sessions/<path:user_id>', methods=['GET'])
+def list_sessions(user_id=None):
+    """
+    List the live sessions of an ID, a page at a time
+    The ID is the path (for string IDs) or the query parameter id, as JSON
+    (e.g. ?id=123 or ?id="user@example.com"). Query parameters: limit
+    (default 100, at most 1000) and cursor (the next_cursor of the
+    previous page)
+    Returns: {"id": "user@example.com",
+              "sessions": [{"session": "...", "issued_at": ..., "expires_at": ...}],
+              "next_cursor": "..." or null}
+    Sessions are named by handles, which cannot be used as tokens.
+    """
+    try:
+        if user_id is None:
+            try:
+                user_id = json.loads(request.args['id'])
+            except (KeyError, ValueError):
+                return jsonify({
+                    "error": "Missing or invalid 'id' parameter (JSON, e.g. 123 or \"a@b.c\")"
+                }), 400
+        
+        limit = request.args.get('limit', SESSIONS_PAGE_SIZE)
+        try:
+            limit = int(limit)
+        except ValueError:
+            limit = 0
+        if not 1 <= limit <= SESSIONS_PAGE_MAX:
+            return jsonify({
+                "error": f"'limit' must be an integer from 1 to {SESSIONS_PAGE_MAX}"
+            }), 400
+        
+        try:
+            sessions = token_store.sessions_page(user_id, request.args.get('cursor'), limit)
+        except ValueError:
+            return jsonify({
+                "error": "Invalid cursor"
+            }), 400
+        
+        return jsonify({
+            "id": user_id,
+            "sessions": sessions,
+            "next_cursor": sessions[-1]["session"] if len(sessions) == limit else None
+        }), 200
+        
+    except Exception as e:
+        logger.error(f"Error listing sessions: {str(e)}")
+        return jsonify({
+            "error": "Internal server error"
+        }), 500
+
+
+@app.route('/revoke-user', methods=['POST'])
+def revoke_user():
+    """
+    Revoke every token of an ID
+    Expected JSON: {"id": "user@example.com"}
+    Returns: {"success": true, "revoked": 3}
+    """
+    try:
+        data = request.get_json(silent=True)
+        
+        if not data or 'id' not in data:
+            return jsonify({
+                "error": "Missing 'id' field"
+            }), 400
+        
+        user_id = data['id']
+        revoked = token_store.revoke_user(user_id)
+        logger.info(f"Revoked {revoked} tokens for user: {user_id}")
+        
+        return jsonify({
+            "success": True,
+            "revoked": revoked
+        }), 200
+        
+    except Exception as e:
+        logger.error(f"Error revoking user tokens: {str(e)}")
+        return jsonify({
+            "error": "Internal server error"
+        }), 500
+
+
 if __name__ == '__main__':
-    logger.info("Starting Web Token Service...")
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    if '--benchmark' in sys.argv[1:]:
+        results = benchmark_contention()
+        print(f"{'threads':<10}" + ''.join(f"{name + ' ops/s':>16}" for name in results))
+        for count in results["single"]:
+            print(f"{count:<10}" + ''.join(f"{results[name][count]:>16}" for name in results))
+    else:
+        logger.info("Starting Web Token Service...")
+        app.run(host='0.0.0.0', port=5000, debug=True)
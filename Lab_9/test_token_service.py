@@ -6,9 +6,14 @@ Lab 09: Web-tokens
 
 import unittest
 import json
-import uuid
+import base64
 import sys
 import os
+import socketserver
+import tempfile
+import threading
+import time
+from unittest import mock
 
 # Add the parent directory to the path to import the server
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
@@ -28,6 +33,93 @@ except ModuleNotFoundError:
     token_store = my_server.token_store
 
 
+class FakeRedisHandler(socketserver.StreamRequestHandler):
+    """Just enough of the Redis protocol for the state backend"""
+    
+    def read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        args = []
+        for _ in range(int(line[1:])):
+            length = int(self.rfile.readline()[1:])
+            args.append(self.rfile.read(length + 2)[:-2].decode())
+        return args
+    
+    @staticmethod
+    def encode(value):
+        if value is None:
+            return b'$-1\r\n'
+        if isinstance(value, int):
+            return b':%d\r\n' % value
+        if isinstance(value, list):
+            return b'*%d\r\n' % len(value) + b''.join(FakeRedisHandler.encode(v) for v in value)
+        data = value.encode()
+        return b'$%d\r\n%s\r\n' % (len(data), data)
+    
+    def handle(self):
+        data = self.server.data  # {key: (value, expires_at)}
+        while True:
+            args = self.read_command()
+            if args is None:
+                return
+            self.server.commands += 1
+            name, now = args[0].upper(), time.time()
+            for key in [k for k, (_, exp) in data.items() if exp and exp <= now]:
+                del data[key]
+            if name == 'GET':
+                reply = data.get(args[1], (None,))[0]
+            elif name == 'MGET':
+                reply = [data.get(key, (None,))[0] for key in args[1:]]
+            elif name == 'SET':
+                exp = now + int(args[4]) / 1000 if len(args) > 4 else None
+                if 'XX' in args[3:] and args[1] not in data:
+                    reply = None
+                else:
+                    data[args[1]] = (args[2], exp)
+                    reply = 'OK'
+            elif name == 'GETDEL':
+                reply = data.pop(args[1], (None,))[0]
+            elif name == 'DEL':
+                reply = sum(data.pop(key, None) is not None for key in args[1:])
+            elif name == 'SADD':
+                members = data.setdefault(args[1], (set(), None))[0]
+                reply = len(set(args[2:]) - members)
+                members.update(args[2:])
+            elif name == 'SREM':
+                members = data.get(args[1], (set(),))[0]
+                reply = len(members & set(args[2:]))
+                members.difference_update(args[2:])
+            elif name == 'PEXPIRE':
+                reply = int(args[1] in data)
+                if reply:
+                    data[args[1]] = (data[args[1]][0], now + int(args[2]) / 1000)
+            elif name == 'PERSIST':
+                reply = int(args[1] in data and data[args[1]][1] is not None)
+                if reply:
+                    data[args[1]] = (data[args[1]][0], None)
+            elif name == 'SMEMBERS':
+                reply = sorted(data.get(args[1], (set(),))[0])
+            elif name == 'SCAN':
+                prefix = args[3].rstrip('*')
+                reply = ['0', [key for key in data if key.startswith(prefix)]]
+            else:
+                self.wfile.write(b'-ERR unknown command\r\n')
+                continue
+            self.wfile.write(b'+OK\r\n' if reply == 'OK' else self.encode(reply))
+
+
+class FakeRedisServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), FakeRedisHandler)
+        self.data = {}
+        self.commands = 0
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+
 class TestWebTokenService(unittest.TestCase):
     """Unit and functional tests for the web token service"""
     
@@ -37,8 +129,9 @@ class TestWebTokenService(unittest.TestCase):
         self.client = self.app.test_client()
         self.app.testing = True
         
-        # Clear token store before each test
+        # Clear token store and rate limits before each test
         token_store.clear()
+        my_server.rate_limiter.clear()
     
     def tearDown(self):
         """Clean up after each test"""
@@ -63,13 +156,9 @@ class TestWebTokenService(unittest.TestCase):
         self.assertIn('uuid-token', data)
         self.assertEqual(data['id'], user_id)
         
-        # Verify UUID format
-        try:
-            uuid.UUID(data['uuid-token'])
-            uuid_valid = True
-        except ValueError:
-            uuid_valid = False
-        self.assertTrue(uuid_valid, "Generated token is not a valid UUID")
+        # Verify token format
+        self.assertIsNotNone(my_server.parse_token(data['uuid-token']),
+                             "Generated token does not validate")
     
     def test_generate_token_missing_id(self):
         """Test token generation with missing ID field"""
@@ -187,7 +276,7 @@ class TestWebTokenService(unittest.TestCase):
     
     def test_verify_invalid_token(self):
         """Test verification of non-existent token"""
-        fake_token = str(uuid.uuid4())
+        fake_token = my_server.make_token()
         
         response = self.client.post(
             '/verify-token',
@@ -284,7 +373,7 @@ class TestWebTokenService(unittest.TestCase):
     def test_login_invalid_token(self):
         """Test login with invalid token"""
         user_id = "test.user@uconn.edu"
-        fake_token = str(uuid.uuid4())
+        fake_token = my_server.make_token()
         
         response = self.client.post(
             '/login',
@@ -333,7 +422,7 @@ class TestWebTokenService(unittest.TestCase):
         # Missing ID
         response2 = self.client.post(
             '/login',
-            json={'uuid-token': str(uuid.uuid4())},
+            json={'uuid-token': my_server.make_token()},
             content_type='application/json'
         )
         self.assertEqual(response2.status_code, 400)
@@ -365,7 +454,7 @@ class TestWebTokenService(unittest.TestCase):
     
     def test_revoke_nonexistent_token(self):
         """Test revoking a token that doesn't exist"""
-        fake_token = str(uuid.uuid4())
+        fake_token = my_server.make_token()
         
         response = self.client.post(
             '/revoke-token',
@@ -404,6 +493,583 @@ class TestWebTokenService(unittest.TestCase):
         
         self.assertEqual(verify_response.status_code, 404)
     
+    # ========== Unit Tests for the In-Process Token Store ==========
+    
+    def test_token_expires_after_ttl(self):
+        """Test that tokens stop verifying once expires_in has passed"""
+        now = time.time()
+        with mock.patch.object(my_server.time, 'time', return_value=now):
+            response = self.client.post('/generate-token', json={'id': 'a@uconn.edu', 'expires_in': 5})
+            token = json.loads(response.data)['uuid-token']
+            self.assertEqual(json.loads(response.data)['expires_in'], 5)
+        
+        with mock.patch.object(my_server.time, 'time', return_value=now + 1):
+            response = self.client.post('/verify-token', json={'uuid-token': token})
+            self.assertEqual(response.status_code, 200)
+        
+        with mock.patch.object(my_server.time, 'time', return_value=now + 7):
+            response = self.client.post('/verify-token', json={'uuid-token': token})
+            self.assertEqual(response.status_code, 404)
+            self.assertEqual(len(token_store), 0)
+    
+    def test_generate_token_invalid_expires_in(self):
+        """Test that expires_in must be a positive integer"""
+        for expires_in in [0, -5, 'soon', True]:
+            with self.subTest(expires_in=expires_in):
+                response = self.client.post('/generate-token',
+                                            json={'id': 'a@uconn.edu', 'expires_in': expires_in})
+                self.assertEqual(response.status_code, 400)
+    
+    def test_timer_wheel_handles_long_ttls(self):
+        """Test tokens due several turns of the wheel away, and idle gaps"""
+        store = my_server.MemoryTokenStore(wheel_slots=8)
+        with mock.patch.object(my_server.time, 'time', return_value=1000.0):
+            tokens = [my_server.make_token() for _ in range(3)]
+            store.clear()
+            store.issue(tokens[0], 'u', ttl=3)
+            store.issue(tokens[1], 'u', ttl=20)
+            store.issue(tokens[2], 'u', ttl=500)
+        for now, live in [(1004, [False, True, True]), (1012, [False, True, True]),
+                          (1025, [False, False, True]), (1499, [False, False, True]),
+                          (1600, [False, False, False])]:
+            with mock.patch.object(my_server.time, 'time', return_value=float(now)):
+                self.assertEqual([token in store for token in tokens], live)
+                self.assertEqual(len(store), sum(live))
+    
+    def test_revoke_user_and_user_index(self):
+        """Test that a user's tokens are found and revoked via the index"""
+        store = my_server.MemoryTokenStore()
+        alice = [my_server.make_token() for _ in range(3)]
+        bob = my_server.make_token()
+        for token in alice:
+            store.issue(token, 'alice', ttl=60)
+        store.issue(bob, 'bob', ttl=60)
+        store.revoke(alice[1])
+        
+        self.assertEqual(sorted(store.tokens_for('alice')), sorted([alice[0], alice[2]]))
+        self.assertEqual(store.revoke_user('alice'), 2)
+        self.assertEqual(store.tokens_for('alice'), [])
+        self.assertEqual(store.lookup(bob), 'bob')
+        self.assertEqual(len(store), 1)
+    
+    def test_token_store_grows_and_reuses_slots(self):
+        """Test many issues and revocations against a plain dict"""
+        for capacity in [4, 100]:  # the table must work for any starting capacity
+            with self.subTest(capacity=capacity):
+                store = my_server.MemoryTokenStore(capacity=capacity)
+                expected = {}
+                for i in range(2000):
+                    token = my_server.make_token()
+                    store.issue(token, i % 7, ttl=60)
+                    expected[token] = i % 7
+                    if i % 3 == 0:
+                        victim = next(iter(expected))
+                        self.assertEqual(store.revoke(victim), expected.pop(victim))
+                self.assertEqual(len(store), len(expected))
+                self.assertEqual(store.lookup_many(list(expected)), list(expected.values()))
+                self.assertLess(store.memory_bytes() / len(store), 100)
+    
+    def test_token_store_rejects_malformed_tokens(self):
+        """Test that malformed tokens are never found"""
+        token = my_server.make_token()
+        token_store.issue(token, 'a', 60)
+        for candidate in [token.swapcase(), token[:-1], token + 'A', '{' + token[2:] + '}',
+                          42, None]:
+            self.assertIsNone(token_store.lookup(candidate))
+        with self.assertRaises(ValueError):
+            token_store.issue('not-a-token', 'a', 60)
+    
+    # ========== Unit Tests for Token Format ==========
+    
+    def test_token_round_trip(self):
+        """Test that a token parses back to its shard, issue time and body"""
+        body = bytes(range(16))
+        token = my_server.make_token(body, issued=int(time.time()))
+        self.assertEqual(len(token), my_server.TOKEN_LENGTH)
+        shard, issued, parsed_body = my_server.parse_token(token)
+        self.assertEqual(parsed_body, body)
+        self.assertEqual(shard, body[0] % my_server.TOKEN_SHARDS)
+        self.assertAlmostEqual(issued, time.time(), delta=2)
+    
+    def test_forged_tokens_rejected(self):
+        """Test that a token with any byte changed fails its MAC"""
+        raw = bytearray(base64.urlsafe_b64decode(my_server.make_token()))
+        for i in range(len(raw)):
+            forged = bytearray(raw)
+            forged[i] ^= 1
+            with self.subTest(byte=i):
+                self.assertIsNone(my_server.parse_token(
+                    base64.urlsafe_b64encode(bytes(forged)).decode()))
+    
+    def test_old_and_future_tokens_rejected(self):
+        """Test that tokens past TOKEN_MAX_AGE or from the future fail"""
+        now = int(time.time())
+        old = my_server.make_token(issued=now - my_server.TOKEN_MAX_AGE - 10)
+        future = my_server.make_token(issued=now + my_server.TOKEN_CLOCK_SKEW + 10)
+        self.assertIsNone(my_server.parse_token(old))
+        self.assertIsNone(my_server.parse_token(future))
+    
+    def test_invalid_tokens_skip_the_store(self):
+        """Test that verify, login and revoke reject garbage without a lookup"""
+        backend = mock.Mock(wraps=my_server.InMemoryBackend())
+        with mock.patch.object(my_server, 'token_store', my_server.TokenStore(backend)):
+            garbage = 'x' * my_server.TOKEN_LENGTH
+            response = self.client.post('/verify-token', json={'uuid-token': garbage})
+            self.assertEqual(response.status_code, 404)
+            response = self.client.post('/login', json={'id': 'a', 'uuid-token': garbage})
+            self.assertEqual(response.status_code, 401)
+            response = self.client.post('/revoke-token', json={'uuid-token': 'nope'})
+            self.assertEqual(response.status_code, 404)
+        self.assertEqual(backend.method_calls, [])
+    
+    def test_generate_token_expires_in_capped(self):
+        """Test that tokens cannot outlive TOKEN_MAX_AGE"""
+        response = self.client.post('/generate-token', json={
+            'id': 'a@uconn.edu', 'expires_in': my_server.TOKEN_MAX_AGE + 1})
+        self.assertEqual(response.status_code, 400)
+    
+    # ========== Unit Tests for Token Store Persistence ==========
+    
+    def _persistent_store(self, directory, **kwargs):
+        store = my_server.MemoryTokenStore(directory=directory, **kwargs)
+        self.addCleanup(store.close)
+        return store
+    
+    def test_store_survives_restart(self):
+        """Test that issues and revocations before and after a snapshot reload"""
+        with tempfile.TemporaryDirectory() as directory:
+            store = self._persistent_store(directory)
+            tokens = [my_server.make_token() for _ in range(6)]
+            for i, token in enumerate(tokens):
+                store.issue(token, f'user{i % 2}', ttl=3600)
+            store.revoke(tokens[0])
+            store.snapshot()
+            store.revoke_user('user1')
+            late = my_server.make_token()
+            store.issue(late, {'id': 7}, ttl=3600)
+            store.close()
+            
+            reloaded = self._persistent_store(directory)
+            self.assertEqual(len(reloaded), 3)
+            self.assertEqual(reloaded.lookup_many(tokens + [late]),
+                             [None, None, 'user0', None, 'user0', None, {'id': 7}])
+            self.assertEqual(sorted(reloaded.tokens_for('user0')), sorted([tokens[2], tokens[4]]))
+    
+    def test_store_drops_torn_log_tail(self):
+        """Test that a partly written last record is cut off on reload"""
+        with tempfile.TemporaryDirectory() as directory:
+            store = self._persistent_store(directory)
+            token = my_server.make_token()
+            store.issue(token, 'a', ttl=3600)
+            store.close()
+            (_, segment), = my_server.TokenLog.segments(directory)
+            with open(segment, 'ab') as f:
+                f.write(b'\x40\x00\x00\x00garbage')
+            
+            reloaded = self._persistent_store(directory)
+            self.assertEqual(reloaded.lookup(token), 'a')
+            reloaded.issue(my_server.make_token(), 'b', ttl=3600)
+            reloaded.close()
+            self.assertEqual(len(self._persistent_store(directory)), 2)
+    
+    def test_log_group_commit(self):
+        """Test that concurrent issues share fsyncs"""
+        with tempfile.TemporaryDirectory() as directory:
+            store = self._persistent_store(directory)
+            with mock.patch.object(my_server.os, 'fsync', wraps=os.fsync) as fsync:
+                threads = [threading.Thread(target=lambda: [
+                    store.issue(my_server.make_token(), 'u', ttl=60) for _ in range(50)])
+                    for _ in range(8)]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+            self.assertEqual(len(store), 400)
+            self.assertLess(fsync.call_count, 400)
+    
+    def test_snapshot_replaces_old_log_segments(self):
+        """Test that a large log triggers a snapshot and old segments go away"""
+        with tempfile.TemporaryDirectory() as directory:
+            store = self._persistent_store(directory, snapshot_bytes=2000)
+            tokens = [my_server.make_token() for _ in range(100)]
+            for token in tokens:
+                store.issue(token, 'u', ttl=3600)
+            while store._snapshotting:
+                time.sleep(0.01)  # let the background snapshot finish
+            self.assertTrue(os.path.exists(os.path.join(directory, 'tokens.snapshot')))
+            self.assertEqual(len(my_server.TokenLog.segments(directory)), 1)
+            store.close()
+            self.assertEqual(self._persistent_store(directory).lookup_many(tokens), ['u'] * 100)
+    
+    # ========== Unit Tests for Sliding Sessions ==========
+    
+    def test_session_extended_only_when_due(self):
+        """Test that touch() writes only once less than half the ttl remains"""
+        with tempfile.TemporaryDirectory() as directory:
+            store = my_server.ShardedTokenStore(shards=2, directory=directory)
+            self.addCleanup(store.close)
+            with mock.patch.object(my_server.time, 'time', return_value=1000.0):
+                token = my_server.make_token()
+                other = my_server.make_token()
+                store.issue(token, 'a', ttl=100)
+                store.issue(other, 'a', ttl=100)
+            with mock.patch.object(my_server.os, 'fsync') as fsync, \
+                    mock.patch.object(my_server.time, 'time', return_value=1040.0):
+                self.assertEqual(store.touch(token), 'a')
+                fsync.assert_not_called()
+            with mock.patch.object(my_server.time, 'time', return_value=1060.0):
+                self.assertEqual(store.touch(token, 'a'), 'a')
+                self.assertEqual(store.touch(other, 'b'), 'a')  # wrong user: no extension
+                self.assertEqual(store.lookup(other), 'a')  # lookups never extend
+            with mock.patch.object(my_server.time, 'time', return_value=1150.0):
+                self.assertEqual(store.lookup_many([token, other]), ['a', None])
+                store.close()
+                reloaded = my_server.ShardedTokenStore(shards=2, directory=directory)
+                self.addCleanup(reloaded.close)
+                self.assertEqual(reloaded.lookup(token), 'a')
+            with mock.patch.object(my_server.time, 'time', return_value=1161.0):
+                self.assertIsNone(reloaded.lookup(token))
+    
+    def test_session_capped_at_max_age(self):
+        """Test that extensions stop at TOKEN_MAX_AGE after issue"""
+        store = my_server.MemoryTokenStore()
+        issued = 1000.0
+        ttl = my_server.TOKEN_MAX_AGE // 2
+        with mock.patch.object(my_server.time, 'time', return_value=issued):
+            token = my_server.make_token()
+            store.issue(token, 'a', ttl=ttl)
+        with mock.patch.object(my_server.time, 'time', return_value=issued + ttl - 1):
+            store.touch(token)
+        with mock.patch.object(my_server.time, 'time',
+                               return_value=issued + my_server.TOKEN_MAX_AGE + 1):
+            self.assertIsNone(store.lookup(token))
+    
+    def test_verify_and_login_slide_sessions(self):
+        """Test that verify and login keep an active session alive"""
+        with mock.patch.object(my_server.time, 'time', return_value=1000.0):
+            response = self.client.post('/generate-token', json={'id': 'a', 'expires_in': 100})
+            token = json.loads(response.data)['uuid-token']
+        for now, path in [(1060.0, '/verify-token'), (1120.0, '/login'), (1180.0, '/verify-token')]:
+            with mock.patch.object(my_server.time, 'time', return_value=now):
+                response = self.client.post(path, json={'id': 'a', 'uuid-token': token})
+                self.assertEqual(response.status_code, 200)
+    
+    def test_token_store_sessions_slide_on_every_backend(self):
+        """Test touch() on the state backends, and that it never undoes a revocation"""
+        backends = [my_server.InMemoryBackend()] + [a for a, _ in self._shared_backends()]
+        for backend in backends:
+            with self.subTest(backend=type(backend).__name__):
+                store = my_server.TokenStore(backend)
+                token, revoked = my_server.make_token(), my_server.make_token()
+                store.issue(token, 'a', ttl=0.6)
+                store.issue(revoked, 'a', ttl=0.6)
+                time.sleep(0.4)
+                self.assertEqual(store.touch(token), 'a')
+                store.revoke(revoked)
+                self.assertFalse(backend.replace(revoked, '[]', 1))
+                time.sleep(0.4)
+                self.assertEqual(store.lookup(token), 'a')
+                self.assertIsNone(store.lookup(revoked))
+    
+    # ========== Unit Tests for the Session Index ==========
+    
+    def _issue_for(self, user_id, count):
+        return [json.loads(self.client.post('/generate-token', json={'id': user_id}).data)
+                ['uuid-token'] for _ in range(count)]
+    
+    def test_list_sessions_paginates(self):
+        """Test that GET /sessions/<id> pages through exactly the user's sessions,
+        even when the cursor's session is revoked mid-listing"""
+        alice = self._issue_for('alice@uconn.edu', 7)
+        self._issue_for('bob@uconn.edu', 2)
+        by_handle = {token[:16]: token for token in alice}
+        
+        seen, cursor = [], None
+        while True:
+            query = {'limit': 3} if cursor is None else {'limit': 3, 'cursor': cursor}
+            response = self.client.get('/sessions/alice@uconn.edu', query_string=query)
+            self.assertEqual(response.status_code, 200)
+            for token in alice:
+                self.assertNotIn(token.encode(), response.data)
+            data = json.loads(response.data)
+            self.assertLessEqual(len(data['sessions']), 3)
+            seen += [session['session'] for session in data['sessions']]
+            cursor = data['next_cursor']
+            if cursor is None:
+                break
+            token_store.revoke(by_handle[cursor])  # incident response: revoke as we go
+        self.assertEqual(seen, sorted(by_handle))
+        
+        response = self.client.get('/sessions/nobody@uconn.edu')
+        self.assertEqual(json.loads(response.data), {
+            'id': 'nobody@uconn.edu', 'sessions': [], 'next_cursor': None})
+    
+    def test_list_sessions_typed_id(self):
+        """Test that ?id= takes a JSON ID, so non-string IDs can be listed"""
+        token = self._issue_for(123, 1)[0]
+        response = self.client.get('/sessions', query_string={'id': '123'})
+        data = json.loads(response.data)
+        self.assertEqual(data['id'], 123)
+        self.assertEqual([s['session'] for s in data['sessions']], [token[:16]])
+        self.assertEqual(data['sessions'][0]['issued_at'], my_server.parse_token(token)[1])
+        
+        response = self.client.get('/sessions', query_string={'id': '"123"'})
+        self.assertEqual(json.loads(response.data)['sessions'], [])
+        for query in [{}, {'id': 'not json'}]:
+            response = self.client.get('/sessions', query_string=query)
+            self.assertEqual(response.status_code, 400)
+    
+    def test_list_sessions_rejects_bad_parameters(self):
+        """Test that bad limits and cursors get 400"""
+        self._issue_for('alice@uconn.edu', 1)
+        for query in [{'limit': 0}, {'limit': 'ten'}, {'limit': 5000}, {'cursor': 'junk'}]:
+            with self.subTest(query=query):
+                response = self.client.get('/sessions/alice@uconn.edu', query_string=query)
+                self.assertEqual(response.status_code, 400)
+    
+    def test_revoke_user(self):
+        """Test that POST /revoke-user kills every token of one user only"""
+        alice = self._issue_for('alice@uconn.edu', 4)
+        bob = self._issue_for('bob@uconn.edu', 1)
+        
+        response = self.client.post('/revoke-user', json={'id': 'alice@uconn.edu'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data), {'success': True, 'revoked': 4})
+        for token in alice:
+            response = self.client.post('/verify-token', json={'uuid-token': token})
+            self.assertEqual(response.status_code, 404)
+        response = self.client.post('/verify-token', json={'uuid-token': bob[0]})
+        self.assertEqual(response.status_code, 200)
+        
+        response = self.client.post('/revoke-user', json={})
+        self.assertEqual(response.status_code, 400)
+    
+    def test_sessions_page_on_every_store(self):
+        """Test sessions_page() on every store, skipping dead sessions and cursors"""
+        stores = [my_server.MemoryTokenStore(), my_server.ShardedTokenStore(shards=4)] + [
+            my_server.TokenStore(backend) for backend in
+            [my_server.InMemoryBackend()] + [a for a, _ in self._shared_backends()]]
+        for store in stores:
+            with self.subTest(store=type(store).__name__):
+                tokens = sorted((my_server.make_token() for _ in range(7)),
+                                key=lambda token: token[:16])
+                for token in tokens:
+                    store.issue(token, 42, ttl=60)
+                store.revoke(tokens[1])
+                first = [s['session'] for s in store.sessions_page(42, limit=3)]
+                self.assertEqual(first, [t[:16] for t in (tokens[0], tokens[2], tokens[3])])
+                store.revoke(tokens[3])  # the cursor need not stay live
+                rest = store.sessions_page(42, after=first[-1], limit=3)
+                self.assertEqual([s['session'] for s in rest], [t[:16] for t in tokens[4:7]])
+                self.assertAlmostEqual(rest[0]['expires_at'], time.time() + 60, delta=2)
+                self.assertEqual(store.sessions_page(42, after=tokens[6][:16]), [])
+    
+    # ========== Unit Tests for Rate Limiting ==========
+    
+    def test_rate_limit_by_address(self):
+        """Test that a client past its burst gets 429 before the token is looked at"""
+        token = self._issue_for('a@uconn.edu', 1)[0]
+        with mock.patch.object(my_server, 'RATE_LIMIT_BURST', 3), \
+                mock.patch.object(my_server, 'parse_token', wraps=my_server.parse_token) as parse:
+            for _ in range(3):
+                response = self.client.post('/verify-token', json={'uuid-token': token})
+                self.assertEqual(response.status_code, 200)
+            response = self.client.post('/login', json={'id': 'a@uconn.edu', 'uuid-token': token})
+            self.assertEqual(response.status_code, 429)
+            self.assertGreaterEqual(int(response.headers['Retry-After']), 1)
+            self.assertEqual(parse.call_count, 3)
+            
+            response = self.client.post('/verify-token', json={'uuid-token': token},
+                                        environ_base={'REMOTE_ADDR': '10.0.0.2'})
+            self.assertEqual(response.status_code, 200)
+    
+    def test_rate_limit_by_claimed_id(self):
+        """Test that guesses at one ID are limited across client addresses"""
+        with mock.patch.object(my_server, 'RATE_LIMIT_BURST', 2):
+            codes = [self.client.post('/login', data={'id': 'victim', 'uuid-token': 'guess'},
+                                      environ_base={'REMOTE_ADDR': f'10.0.0.{i}'}).status_code
+                     for i in range(4)]
+        self.assertEqual(codes, [401, 401, 429, 429])
+    
+    def test_rate_limiter_refills_and_shares_file(self):
+        """Test that buckets refill over time and are shared through the file"""
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'limits')
+            worker_a = my_server.RateLimiter(path, slots=64)
+            worker_b = my_server.RateLimiter(path, slots=64)
+            with mock.patch.object(my_server.time, 'monotonic', return_value=100.0):
+                self.assertEqual(worker_a.acquire('k', rate=2, burst=2), 0)
+                self.assertEqual(worker_b.acquire('k', rate=2, burst=2), 0)
+                self.assertAlmostEqual(worker_a.acquire('k', rate=2, burst=2), 0.5)
+            with mock.patch.object(my_server.time, 'monotonic', return_value=100.5):
+                self.assertEqual(worker_b.acquire('k', rate=2, burst=2), 0)
+                self.assertGreater(worker_a.acquire('k', rate=2, burst=2), 0)
+    
+    def test_rate_limiter_evicts_idle_buckets(self):
+        """Test that a full table makes room by dropping the longest-idle bucket"""
+        limiter = my_server.RateLimiter(slots=8)  # a single set
+        for i in range(8):
+            with mock.patch.object(my_server.time, 'monotonic', return_value=float(i + 1)):
+                limiter.acquire(f'k{i}', rate=0.1, burst=1)
+        with mock.patch.object(my_server.time, 'monotonic', return_value=9.0):
+            self.assertEqual(limiter.acquire('new', rate=0.1, burst=1), 0)
+            self.assertGreater(limiter.acquire('k7', rate=0.1, burst=1), 0)  # kept
+            self.assertEqual(limiter.acquire('k0', rate=0.1, burst=1), 0)  # evicted
+    
+    # ========== Unit Tests for the Sharded Token Store ==========
+    
+    def test_sharded_store_routes_by_token(self):
+        """Test that tokens land in the shard they name, and user calls span shards"""
+        store = my_server.ShardedTokenStore(shards=4)
+        tokens = [my_server.make_token() for _ in range(40)]
+        for token in tokens:
+            store.issue(token, 'alice', ttl=60)
+        for token in tokens:
+            shard, _, _ = my_server.parse_token(token)
+            self.assertEqual(store.shards[shard % 4].lookup(token), 'alice')
+        self.assertGreater(sum(len(shard) > 0 for shard in store.shards), 1)
+        self.assertEqual(sorted(store.tokens_for('alice')), sorted(tokens))
+        self.assertEqual(store.revoke_user('alice'), 40)
+        self.assertEqual(len(store), 0)
+    
+    def test_concurrent_revocations_succeed_once(self):
+        """Test that racing revocations of one token see exactly one success"""
+        store = my_server.ShardedTokenStore()
+        for _ in range(20):
+            token = my_server.make_token()
+            store.issue(token, 'a', ttl=60)
+            results = []
+            barrier = threading.Barrier(8)
+            
+            def revoke():
+                barrier.wait()
+                results.append(store.revoke(token))
+            
+            threads = [threading.Thread(target=revoke) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual((results.count('a'), results.count(None)), (1, 7))
+    
+    def test_sharded_store_survives_restart(self):
+        """Test that every shard reloads from its own subdirectory"""
+        with tempfile.TemporaryDirectory() as directory:
+            store = my_server.ShardedTokenStore(shards=4, directory=directory)
+            tokens = [my_server.make_token() for _ in range(20)]
+            for token in tokens:
+                store.issue(token, 'u', ttl=3600)
+            store.revoke(tokens[0])
+            store.close()
+            self.assertEqual(len(os.listdir(directory)), 4)
+            
+            reloaded = my_server.ShardedTokenStore(shards=4, directory=directory)
+            self.addCleanup(reloaded.close)
+            self.assertEqual(reloaded.lookup_many(tokens), [None] + ['u'] * 19)
+    
+    def test_benchmark_contention(self):
+        """Test the contention benchmark covers both stores and every thread count"""
+        results = my_server.benchmark_contention(threads=(1, 4), operations=200)
+        self.assertEqual(set(results), {'single', 'sharded'})
+        for rates in results.values():
+            self.assertEqual(set(rates), {1, 4})
+            self.assertTrue(all(rate > 0 for rate in rates.values()))
+    
+    # ========== Unit Tests for State Backends ==========
+    
+    def _shared_backends(self):
+        """A SQLite and a Redis backend, each paired with a second
+        instance standing in for another worker"""
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        redis = FakeRedisServer()
+        self.addCleanup(redis.server_close)
+        self.addCleanup(redis.shutdown)
+        path = os.path.join(tmp.name, 'state.db')
+        port = redis.server_address[1]
+        return [
+            (my_server.SQLiteBackend(path), my_server.SQLiteBackend(path)),
+            (my_server.RedisBackend('127.0.0.1', port), my_server.RedisBackend('127.0.0.1', port)),
+        ]
+    
+    def test_token_store_backends_behave_alike(self):
+        """Test issue/lookup/revoke on every backend"""
+        backends = [my_server.InMemoryBackend()] + [a for a, _ in self._shared_backends()]
+        for backend in backends:
+            with self.subTest(backend=type(backend).__name__):
+                store = my_server.TokenStore(backend)
+                t1, t2, t3, t4 = [my_server.make_token() for _ in range(4)]
+                store.issue(t1, 'user@uconn.edu')
+                store.issue(t2, 42)
+                self.assertEqual(store.lookup(t2), 42)
+                self.assertEqual(store.lookup_many([t1, 'nope', my_server.make_token(), t2]),
+                                 ['user@uconn.edu', None, None, 42])
+                self.assertEqual(store.revoke(t1), 'user@uconn.edu')
+                self.assertIsNone(store.revoke(t1))
+                self.assertEqual(len(store), 1)
+                
+                store.issue(t3, 42, ttl=0.2)
+                store.issue(t4, 42)
+                time.sleep(0.3)
+                self.assertEqual(sorted(store.tokens_for(42)), sorted([t2, t4]))
+                self.assertEqual(store.revoke_user(42), 2)
+                self.assertEqual(store.tokens_for(42), [])
+                store.clear()
+                self.assertNotIn(t2, store)
+    
+    def test_state_backend_expiry(self):
+        """Test that entries set with a ttl disappear once it passes"""
+        backends = [my_server.InMemoryBackend()] + [a for a, _ in self._shared_backends()]
+        for backend in backends:
+            with self.subTest(backend=type(backend).__name__):
+                backend.set_many([('short', '1')], ttl=0.2)
+                backend.set('long', '2', ttl=60)
+                time.sleep(0.3)
+                self.assertEqual(backend.get_many(['short', 'long']), [None, '2'])
+    
+    def test_member_sets_expire_on_every_backend(self):
+        """Test that set members added with a ttl go, so unlisted users' sets don't pile up"""
+        backends = [my_server.InMemoryBackend()] + [a for a, _ in self._shared_backends()]
+        for backend in backends:
+            with self.subTest(backend=type(backend).__name__):
+                backend.add_member('short', 'a', ttl=0.2)
+                backend.add_member('long', 'b', ttl=60)
+                backend.add_member('forever', 'c')
+                time.sleep(0.3)
+                backend.add_member('long', 'd', ttl=60)  # purges on the way in
+                self.assertEqual(backend.members('short'), [])
+                self.assertEqual(sorted(backend.members('long')), ['b', 'd'])
+                self.assertEqual(backend.members_page('forever'), ['c'])
+        
+        sqlite = backends[1]
+        self.assertEqual(sqlite._db.execute(
+            f"SELECT COUNT(*) FROM {sqlite.table}_members").fetchone()[0], 3)
+        
+        # A user's tokens all die by TOKEN_MAX_AGE after issue, and so does their entry
+        backend = my_server.InMemoryBackend()
+        with mock.patch.object(backend, 'add_member', wraps=backend.add_member) as add_member:
+            my_server.TokenStore(backend).issue(my_server.make_token(), 'unlisted', ttl=60)
+        add_member.assert_called_once_with(mock.ANY, mock.ANY,
+                                           my_server.TOKEN_MAX_AGE + my_server.TOKEN_CLOCK_SKEW)
+    
+    def test_revocation_seen_by_other_workers(self):
+        """Test that a token revoked by one worker is rejected by another"""
+        for worker_a, worker_b in self._shared_backends():
+            with self.subTest(backend=type(worker_a).__name__):
+                with mock.patch.object(my_server, 'token_store', my_server.TokenStore(worker_a)):
+                    response = self.client.post('/generate-token', json={'id': 'user@uconn.edu'})
+                    token = json.loads(response.data)['uuid-token']
+                
+                with mock.patch.object(my_server, 'token_store', my_server.TokenStore(worker_b)):
+                    response = self.client.post('/verify-token', json={'uuid-token': token})
+                    self.assertEqual(response.status_code, 200)
+                    response = self.client.post('/revoke-token', json={'uuid-token': token})
+                    self.assertEqual(response.status_code, 200)
+                
+                with mock.patch.object(my_server, 'token_store', my_server.TokenStore(worker_a)):
+                    response = self.client.post('/verify-token', json={'uuid-token': token})
+                    self.assertEqual(response.status_code, 404)
+    
     # ========== Functional Tests ==========
     
     def test_complete_workflow(self):
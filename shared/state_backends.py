@@ -0,0 +1,638 @@
+"""
+State backends and rate limiter shared by the token servers
+Labs 09 and 10
+"""
+
+import hashlib
+import heapq
+import math
+import mmap
+import os
+import socket
+import sqlite3
+import struct
+import tempfile
+import threading
+import time
+import urllib.parse
+
+try:
+    import fcntl
+except ImportError:  # not on Windows: rate limits are then per process
+    fcntl = None
+
+# State backends: expired entries purged per operation, and the window
+# (seconds) over which the purge rate is reported
+STATE_PURGE_BATCH = 64
+STATE_RATE_WINDOW = 60
+
+# Buckets in a rate limiter's table
+RATE_LIMIT_SLOTS = 65536
+
+
+class InMemoryBackend:
+    """
+    Process-local key/value state with optional per-key expiry.
+    
+    Expiry times sit in a min-heap, and every operation pops at most
+    purge_batch expired entries, so purging is spread over normal traffic
+    instead of done by periodic full scans. Only the process that owns it
+    sees its contents; use it for a single worker.
+    """
+    
+    shared = False
+    
+    def __init__(self, purge_batch=STATE_PURGE_BATCH, rate_window=STATE_RATE_WINDOW,
+                 on_expire=None):
+        self.purge_batch = purge_batch
+        self.rate_window = rate_window
+        self.on_expire = on_expire  # called with each purged key
+        self._data = {}  # {key: (value, expires_at or None)}
+        self._sets = {}  # {key: set of members}
+        self._set_expiry = {}  # {key: expires_at or None} for each set
+        self._heap = []  # [(expires_at, key)], may hold stale pairs for re-set keys
+        self._set_heap = []  # [(expires_at, key)] likewise, for sets
+        self._lock = threading.Lock()
+        self.purged_total = 0
+        self._window_start = time.time()
+        self._window_purged = 0
+        self._last_rate = None  # purges/sec over the last complete window
+    
+    def _purge(self, now):
+        """Drop up to purge_batch expired entries. Caller holds the lock."""
+        purged = 0
+        while self._heap and self._heap[0][0] <= now and purged < self.purge_batch:
+            expires_at, key = heapq.heappop(self._heap)
+            entry = self._data.get(key)
+            if entry is not None and entry[1] == expires_at:
+                del self._data[key]
+                if self.on_expire:
+                    self.on_expire(key)
+                purged += 1
+        dropped = 0
+        while self._set_heap and self._set_heap[0][0] <= now and dropped < self.purge_batch:
+            expires_at, key = heapq.heappop(self._set_heap)
+            if self._set_expiry.get(key) == expires_at:
+                del self._sets[key], self._set_expiry[key]
+                dropped += 1
+        self.purged_total += purged
+        self._window_purged += purged
+        if now - self._window_start >= self.rate_window:
+            self._last_rate = self._window_purged / (now - self._window_start)
+            self._window_start = now
+            self._window_purged = 0
+    
+    def _live(self, key, now):
+        entry = self._data.get(key)
+        if entry is None or (entry[1] is not None and entry[1] <= now):
+            return None
+        return entry[0]
+    
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            self._purge(now)
+            return self._live(key, now)
+    
+    def get_many(self, keys):
+        """Values for keys, in order, None where missing."""
+        now = time.time()
+        with self._lock:
+            self._purge(now)
+            return [self._live(key, now) for key in keys]
+    
+    def set(self, key, value, ttl=None):
+        """Store value under key for ttl seconds (forever if None).
+        
+        Returns True if key had no live value before.
+        """
+        now = time.time()
+        expires_at = None if ttl is None else now + ttl
+        with self._lock:
+            self._purge(now)
+            created = key not in self._data
+            self._data[key] = (value, expires_at)
+            if expires_at is not None:
+                heapq.heappush(self._heap, (expires_at, key))
+            return created
+    
+    def set_many(self, items, ttl=None):
+        for key, value in items:
+            self.set(key, value, ttl)
+    
+    def replace(self, key, value, ttl=None):
+        """Store value under key for ttl seconds, only if key has a live
+        value. Returns whether it did."""
+        now = time.time()
+        expires_at = None if ttl is None else now + ttl
+        with self._lock:
+            self._purge(now)
+            if self._live(key, now) is None:
+                return False
+            self._data[key] = (value, expires_at)
+            if expires_at is not None:
+                heapq.heappush(self._heap, (expires_at, key))
+            return True
+    
+    def pop(self, key):
+        """Remove key, returning its live value or None."""
+        now = time.time()
+        with self._lock:
+            self._purge(now)
+            value = self._live(key, now)
+            self._data.pop(key, None)
+            return value
+    
+    def pop_many(self, keys):
+        return [self.pop(key) for key in keys]
+    
+    def add_member(self, key, member, ttl=None):
+        """Add member to the set stored under key, keeping it for at least
+        ttl seconds (forever if None). The set goes once every member's
+        ttl has run out."""
+        now = time.time()
+        with self._lock:
+            self._purge(now)
+            if key in self._sets and not self._live_set(key, now):
+                del self._sets[key], self._set_expiry[key]  # expired, not yet purged
+            if key in self._sets:
+                current = self._set_expiry[key]
+                expires_at = None if current is None or ttl is None else max(current, now + ttl)
+            else:
+                self._sets[key] = set()
+                current, expires_at = None, None if ttl is None else now + ttl
+            if expires_at is not None and expires_at != current:
+                heapq.heappush(self._set_heap, (expires_at, key))
+            self._sets[key].add(member)
+            self._set_expiry[key] = expires_at
+    
+    def remove_members(self, key, members):
+        with self._lock:
+            current = self._sets.get(key)
+            if current is not None:
+                current.difference_update(members)
+                if not current:
+                    del self._sets[key], self._set_expiry[key]
+    
+    def _live_set(self, key, now):
+        expires_at = self._set_expiry.get(key)
+        if expires_at is not None and expires_at <= now:
+            return ()
+        return self._sets.get(key, ())
+    
+    def members(self, key):
+        now = time.time()
+        with self._lock:
+            return list(self._live_set(key, now))
+    
+    def members_page(self, key, after=None, limit=100):
+        """Up to limit members of the set under key, in sorted order,
+        starting after member after."""
+        now = time.time()
+        with self._lock:
+            members = sorted(m for m in self._live_set(key, now) if after is None or m > after)
+        return members[:limit]
+    
+    def count(self):
+        with self._lock:
+            return len(self._data)
+    
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._heap.clear()
+            self._sets.clear()
+            self._set_expiry.clear()
+            self._set_heap.clear()
+    
+    def stats(self):
+        now = time.time()
+        with self._lock:
+            self._purge(now)
+            rate = self._last_rate
+            if rate is None:
+                # Until the first window completes, report the rate so far
+                rate = self._window_purged / max(now - self._window_start, 1e-9)
+            return {
+                "backend": "memory",
+                "size": len(self._data),
+                "purged_total": self.purged_total,
+                "purge_rate_per_sec": round(rate, 3)
+            }
+
+
+class SQLiteBackend:
+    """
+    Key/value state in a SQLite table, shared by every worker on the host.
+    
+    The database runs in WAL mode, so lookups from any number of processes
+    proceed while one of them writes. Each thread gets its own connection.
+    Expired rows are skipped on read and deleted purge_batch at a time on
+    each write.
+    """
+    
+    shared = True
+    
+    def __init__(self, path, namespace='state', purge_batch=STATE_PURGE_BATCH):
+        if not namespace.isidentifier():
+            raise ValueError(f"invalid namespace: {namespace!r}")
+        self.path = path
+        self.table = namespace
+        self.purge_batch = purge_batch
+        self.purged_total = 0  # purged by this process
+        self._local = threading.local()
+    
+    @property
+    def _db(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(f"CREATE TABLE IF NOT EXISTS {self.table} ("
+                         "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)")
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {self.table}_expiry "
+                         f"ON {self.table} (expires_at)")
+            conn.execute(f"CREATE TABLE IF NOT EXISTS {self.table}_members ("
+                         "key TEXT, member TEXT, expires_at REAL, "
+                         "PRIMARY KEY (key, member)) WITHOUT ROWID")
+            columns = [row[1] for row in conn.execute(f"PRAGMA table_info({self.table}_members)")]
+            if 'expires_at' not in columns:
+                # Member tables from before members expired; theirs never do
+                conn.execute(f"ALTER TABLE {self.table}_members ADD COLUMN expires_at REAL")
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {self.table}_members_expiry "
+                         f"ON {self.table}_members (expires_at)")
+            self._local.conn = conn
+        return conn
+    
+    def _purge(self, db, now):
+        cursor = db.execute(
+            f"DELETE FROM {self.table} WHERE key IN (SELECT key FROM {self.table} "
+            "WHERE expires_at <= ? LIMIT ?)", (now, self.purge_batch))
+        self.purged_total += cursor.rowcount
+    
+    def get(self, key):
+        row = self._db.execute(
+            f"SELECT value FROM {self.table} WHERE key = ? "
+            "AND (expires_at IS NULL OR expires_at > ?)", (key, time.time())).fetchone()
+        return row[0] if row else None
+    
+    def get_many(self, keys):
+        """Values for keys, in order, None where missing (one query per 500 keys)."""
+        keys = list(keys)
+        found = {}
+        now = time.time()
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            marks = ",".join("?" * len(chunk))
+            found.update(self._db.execute(
+                f"SELECT key, value FROM {self.table} WHERE key IN ({marks}) "
+                "AND (expires_at IS NULL OR expires_at > ?)", (*chunk, now)))
+        return [found.get(key) for key in keys]
+    
+    def set(self, key, value, ttl=None):
+        self.set_many([(key, value)], ttl)
+    
+    def set_many(self, items, ttl=None):
+        """Store every (key, value) pair in one transaction."""
+        now = time.time()
+        expires_at = None if ttl is None else now + ttl
+        db = self._db
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            self._purge(db, now)
+            db.executemany(f"INSERT OR REPLACE INTO {self.table} VALUES (?, ?, ?)",
+                           [(key, value, expires_at) for key, value in items])
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+    
+    def replace(self, key, value, ttl=None):
+        now = time.time()
+        cursor = self._db.execute(
+            f"UPDATE {self.table} SET value = ?, expires_at = ? WHERE key = ? "
+            "AND (expires_at IS NULL OR expires_at > ?)",
+            (value, None if ttl is None else now + ttl, key, now))
+        return cursor.rowcount > 0
+    
+    def pop(self, key):
+        db = self._db
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            row = db.execute(
+                f"SELECT value FROM {self.table} WHERE key = ? "
+                "AND (expires_at IS NULL OR expires_at > ?)", (key, time.time())).fetchone()
+            db.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        return row[0] if row else None
+    
+    def pop_many(self, keys):
+        """Remove every key in one transaction, returning their live values."""
+        keys = list(keys)
+        db = self._db
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            values = self.get_many(keys)
+            db.executemany(f"DELETE FROM {self.table} WHERE key = ?", [(key,) for key in keys])
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        return values
+    
+    def add_member(self, key, member, ttl=None):
+        """Add member to the set stored under key, keeping it for at least
+        ttl seconds (forever if None). Expired members are deleted
+        purge_batch at a time on each add."""
+        now = time.time()
+        db = self._db
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            db.execute(
+                f"DELETE FROM {self.table}_members WHERE (key, member) IN (SELECT key, member "
+                f"FROM {self.table}_members WHERE expires_at <= ? LIMIT ?)", (now, self.purge_batch))
+            db.execute(f"INSERT OR REPLACE INTO {self.table}_members VALUES (?, ?, ?)",
+                       (key, member, None if ttl is None else now + ttl))
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+    
+    def remove_members(self, key, members):
+        self._db.executemany(f"DELETE FROM {self.table}_members WHERE key = ? AND member = ?",
+                             [(key, member) for member in members])
+    
+    def members(self, key):
+        return [row[0] for row in self._db.execute(
+            f"SELECT member FROM {self.table}_members WHERE key = ? "
+            "AND (expires_at IS NULL OR expires_at > ?)", (key, time.time()))]
+    
+    def members_page(self, key, after=None, limit=100):
+        return [row[0] for row in self._db.execute(
+            f"SELECT member FROM {self.table}_members WHERE key = ? AND member > ? "
+            "AND (expires_at IS NULL OR expires_at > ?) ORDER BY member LIMIT ?",
+            (key, '' if after is None else after, time.time(), limit))]
+    
+    def count(self):
+        return self._db.execute(
+            f"SELECT COUNT(*) FROM {self.table} WHERE expires_at IS NULL OR expires_at > ?",
+            (time.time(),)).fetchone()[0]
+    
+    def clear(self):
+        self._db.execute(f"DELETE FROM {self.table}")
+        self._db.execute(f"DELETE FROM {self.table}_members")
+    
+    def stats(self):
+        return {"backend": "sqlite", "size": self.count(), "purged_total": self.purged_total}
+
+
+class RedisError(Exception):
+    """Error reply from a Redis server."""
+
+
+class RedisBackend:
+    """
+    Key/value state on a Redis server (or anything speaking its protocol).
+    
+    Talks RESP directly over a socket, one connection per thread. Keys are
+    prefixed with the namespace, and expiry is left to the server. Multi-key
+    lookups go out as a single MGET and writes from set_many are pipelined,
+    so a batch costs one round trip.
+    """
+    
+    shared = True
+    
+    def __init__(self, host='localhost', port=6379, db=0, namespace='state', timeout=5.0):
+        self.host = host
+        self.port = port
+        self.db = db
+        self.prefix = f"{namespace}:"
+        self.set_prefix = f"{namespace}/set:"
+        self.timeout = timeout
+        self._local = threading.local()
+    
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            conn = (sock, sock.makefile('rb'))
+            self._local.conn = conn
+            if self.db:
+                self.pipeline([('SELECT', self.db)])
+        return conn
+    
+    @staticmethod
+    def _encode(args):
+        parts = [b'*%d\r\n' % len(args)]
+        for arg in args:
+            if not isinstance(arg, bytes):
+                arg = str(arg).encode()
+            parts += [b'$%d\r\n' % len(arg), arg, b'\r\n']
+        return b''.join(parts)
+    
+    @classmethod
+    def _read_reply(cls, reader):
+        line = reader.readline()
+        if not line.endswith(b'\r\n'):
+            raise ConnectionError("connection closed by Redis server")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b'+':
+            return rest.decode()
+        if kind == b'-':
+            return RedisError(rest.decode())
+        if kind == b':':
+            return int(rest)
+        if kind == b'$':
+            length = int(rest)
+            if length < 0:
+                return None
+            return reader.read(length + 2)[:-2].decode()
+        if kind == b'*':
+            length = int(rest)
+            if length < 0:
+                return None
+            return [cls._read_reply(reader) for _ in range(length)]
+        raise ConnectionError(f"unexpected reply from Redis server: {line!r}")
+    
+    def pipeline(self, commands):
+        """Send every command, then read all replies: one round trip."""
+        sock, reader = self._connection()
+        try:
+            sock.sendall(b''.join(self._encode(command) for command in commands))
+            replies = [self._read_reply(reader) for _ in commands]
+        except (OSError, ConnectionError):
+            # Replies may be out of step now; reconnect next time
+            self._local.conn = None
+            sock.close()
+            raise
+        for reply in replies:
+            if isinstance(reply, RedisError):
+                raise reply
+        return replies
+    
+    def execute(self, *args):
+        return self.pipeline([args])[0]
+    
+    def get(self, key):
+        return self.execute('GET', self.prefix + key)
+    
+    def get_many(self, keys):
+        keys = list(keys)
+        if not keys:
+            return []
+        return self.execute('MGET', *(self.prefix + key for key in keys))
+    
+    def set(self, key, value, ttl=None):
+        self.set_many([(key, value)], ttl)
+    
+    def set_many(self, items, ttl=None):
+        commands = []
+        for key, value in items:
+            command = ('SET', self.prefix + key, value)
+            if ttl is not None:
+                command += ('PX', max(int(ttl * 1000), 1))
+            commands.append(command)
+        if commands:
+            self.pipeline(commands)
+    
+    def replace(self, key, value, ttl=None):
+        command = ('SET', self.prefix + key, value)
+        if ttl is not None:
+            command += ('PX', max(int(ttl * 1000), 1))
+        return self.execute(*command, 'XX') is not None
+    
+    def pop(self, key):
+        return self.execute('GETDEL', self.prefix + key)
+    
+    def pop_many(self, keys):
+        return self.pipeline([('GETDEL', self.prefix + key) for key in keys]) if keys else []
+    
+    def add_member(self, key, member, ttl=None):
+        """Add member to the set stored under key, and keep the whole set
+        for ttl seconds from now (forever if None). Callers pass the same
+        ttl every time, so this only ever pushes the set's expiry out."""
+        key = self.set_prefix + key
+        expiry = ('PERSIST', key) if ttl is None else ('PEXPIRE', key, max(int(ttl * 1000), 1))
+        self.pipeline([('SADD', key, member), expiry])
+    
+    def remove_members(self, key, members):
+        members = list(members)
+        if members:
+            self.execute('SREM', self.set_prefix + key, *members)
+    
+    def members(self, key):
+        return self.execute('SMEMBERS', self.set_prefix + key)
+    
+    def members_page(self, key, after=None, limit=100):
+        # Redis sets are unordered: fetch the set and page through it here
+        members = sorted(m for m in self.members(key) if after is None or m > after)
+        return members[:limit]
+    
+    def _keys(self, prefix=None):
+        cursor = '0'
+        while True:
+            cursor, keys = self.execute('SCAN', cursor, 'MATCH', (prefix or self.prefix) + '*',
+                                        'COUNT', 1000)
+            yield from keys
+            if cursor == '0':
+                break
+    
+    def count(self):
+        return sum(1 for _ in self._keys())
+    
+    def clear(self):
+        keys = list(self._keys()) + list(self._keys(self.set_prefix))
+        for start in range(0, len(keys), 1000):
+            self.execute('DEL', *keys[start:start + 1000])
+    
+    def stats(self):
+        return {"backend": "redis", "size": self.count()}
+
+
+def create_backend(url, namespace):
+    """
+    Backend for a STATE_BACKEND url: memory, sqlite:///relative.db,
+    sqlite:////absolute.db or redis://host:port/db.
+    """
+    parsed = urllib.parse.urlsplit(url)
+    if parsed.scheme in ('', 'memory'):
+        return InMemoryBackend()
+    if parsed.scheme == 'sqlite':
+        return SQLiteBackend(parsed.path[1:], namespace=namespace)
+    if parsed.scheme == 'redis':
+        db = int(parsed.path.strip('/') or 0)
+        return RedisBackend(parsed.hostname or 'localhost', parsed.port or 6379, db,
+                            namespace=namespace)
+    raise ValueError(f"unsupported state backend: {url}")
+
+
+class RateLimiter:
+    """
+    Token buckets for arbitrary keys, in a fixed table of shared memory.
+    
+    Each bucket is a 24-byte slot: a 64-bit hash of its key, the tokens
+    left and when they were counted. Slots are grouped in sets of WAYS. A
+    key may only sit in the set its hash picks, and when the set is full it
+    takes over the slot used longest ago. So the table never grows, and a
+    flood of new keys only evicts idle buckets.
+    
+    Sets are guarded in stripes, by a thread lock within the process and
+    an fcntl lock on one byte of the file between processes. Every process
+    that maps the file shares the same buckets.
+    """
+    
+    SLOT = struct.Struct('<Qdd')  # key hash, tokens, monotonic time
+    WAYS = 8
+    
+    def __init__(self, path=None, slots=RATE_LIMIT_SLOTS, stripes=64):
+        size = slots * self.SLOT.size
+        if path is None:
+            self._file = tempfile.TemporaryFile()
+        else:
+            self._file = open(os.open(path, os.O_RDWR | os.O_CREAT, 0o600), 'r+b')
+        if os.fstat(self._file.fileno()).st_size < size:
+            os.ftruncate(self._file.fileno(), size)
+        self._map = mmap.mmap(self._file.fileno(), size)
+        self.sets = slots // self.WAYS
+        self._locks = [threading.Lock() for _ in range(stripes)]
+    
+    def acquire(self, key, rate, burst):
+        """Take a token from key's bucket. Returns 0 if there was one, or
+        else the seconds until there will be."""
+        digest = int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(),
+                                'little') or 1
+        group = digest % self.sets
+        stripe = group % len(self._locks)
+        base = group * self.WAYS * self.SLOT.size
+        now = time.monotonic()
+        with self._locks[stripe]:
+            if fcntl is not None:
+                fcntl.lockf(self._file.fileno(), fcntl.LOCK_EX, 1, stripe)
+            try:
+                oldest = math.inf
+                for way in range(self.WAYS):
+                    offset = base + way * self.SLOT.size
+                    stored, tokens, counted = self.SLOT.unpack_from(self._map, offset)
+                    if stored == digest:
+                        tokens = min(burst, tokens + max(now - counted, 0) * rate)
+                        break
+                    if counted < oldest:  # empty slots count as oldest of all
+                        victim, oldest = offset, counted
+                else:
+                    offset, tokens = victim, burst
+                if tokens >= 1:
+                    self.SLOT.pack_into(self._map, offset, digest, tokens - 1, now)
+                    return 0
+                self.SLOT.pack_into(self._map, offset, digest, tokens, now)
+                return (1 - tokens) / rate
+            finally:
+                if fcntl is not None:
+                    fcntl.lockf(self._file.fileno(), fcntl.LOCK_UN, 1, stripe)
+    
+    def clear(self):
+        self._map[:] = bytes(len(self._map))